@@ -3,19 +3,255 @@ import threading
 import time
 import signal
 import sys
+import os
+import json
+import queue
+import argparse
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# Bitácoras abiertas, para vaciarlas antes de terminar el programa
+active_journals = []
+
+# Clase BITÁCORA DE MENSAJES: un único hilo escritor por nodo alimentado por una cola. Los registros se
+# escriben en grupo (al juntar flush_size registros o al pasar flush_interval segundos) con un solo
+# write/flush y, si se pide, un fsync por grupo
+class MessageJournal:
+    def __init__(self, path, record_format="jsonl", flush_size=256, flush_interval=0.05, fsync=False):
+        self.path = path
+        self.record_format = record_format
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.queue = queue.Queue()
+        self.file = open(path, "a")
+        self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+        self.writer.start()
+        active_journals.append(self)
+
+    # direction: ">>" mensaje enviado, "<<" mensaje o confirmación recibidos
+    def record(self, direction, peer, current_time, node_name, message):
+        self.queue.put((direction, peer, current_time, node_name, message))
+
+    def format_record(self, record):
+        direction, peer, current_time, node_name, message = record
+        if self.record_format == "jsonl":
+            return json.dumps({"d": direction, "p": f"{peer[0]}:{peer[1]}", "t": current_time, "n": node_name, "m": message}, ensure_ascii=False, separators=(",", ":")) + "\n"
+        if direction == ">>":
+            return f">> Message Sent to {peer} - ({current_time}) {node_name}: {message}\n\n"
+        return f"<< Message Received from {peer} - ({current_time}) {node_name}: {message}\n\n"
+
+    def write_batch(self, batch):
+        self.file.write("".join(batch))
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def writer_loop(self):
+        batch = []
+        last_flush = time.monotonic()
+        running = True
+        while running:
+            try:
+                record = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = False
+
+            # Tomar todo lo que ya está en la cola sin esperar, hasta completar un grupo
+            while record is not False:
+                if record is None:
+                    running = False
+                    break
+                batch.append(self.format_record(record))
+                if len(batch) >= self.flush_size:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    record = False
+
+            now = time.monotonic()
+            if batch and (len(batch) >= self.flush_size or now - last_flush >= self.flush_interval or not running):
+                self.write_batch(batch)
+                batch = []
+                last_flush = now
+        self.file.close()
+
+    def close(self):
+        if self in active_journals:
+            active_journals.remove(self)
+            self.queue.put(None)
+            self.writer.join()
+
+def close_journals():
+    for journal in list(active_journals):
+        journal.close()
 
 # Función que se ejecutará cuando se reciba una interrupción (Ctrl+C o Ctrl+Z)
 def signal_handler(sig, frame):
     print("\n")
+    close_journals()
     sys.exit(1)
 
 # Función que se ejecutará cuando se reciba la señal Ctrl+Z
 def signal_stop_handler(sig, frame):
     print("\n")
+    close_journals()
     sys.exit(1)
 
-# Función para manejar la comunicación con un nodo remoto
-def handle_client(client_socket, node_name, messages_file):
+# Modo sesión: el cliente abre la conexión enviando este preámbulo (un mensaje de texto nunca empieza con
+# un byte nulo) y después cada mensaje viaja en una trama [longitud (4 bytes) | secuencia (8 bytes) | datos]
+SESSION_PREAMBLE = b"\x00SESION1"
+FRAME_HEADER = struct.Struct(">IQ")
+
+def encode_frame(seq, payload):
+    return FRAME_HEADER.pack(len(payload), seq) + payload
+
+# Función para leer tramas de un socket. Devuelve, por cada recv, la lista de tramas completas recibidas
+def read_frames(client_socket):
+    buffer = bytearray()
+    while True:
+        chunk = client_socket.recv(262144)
+        if not chunk:
+            return
+        buffer += chunk
+
+        frames = []
+        offset = 0
+        while len(buffer) - offset >= FRAME_HEADER.size:
+            length, seq = FRAME_HEADER.unpack_from(buffer, offset)
+            start = offset + FRAME_HEADER.size
+            if len(buffer) - start < length:
+                break
+            frames.append((seq, bytes(buffer[start:start + length])))
+            offset = start + length
+        del buffer[:offset]
+        if frames:
+            yield frames
+
+# Clase SESIÓN CON UN NODO: una conexión persistente por destinatario. Los mensajes se envían en tramas sin
+# esperar confirmación (hasta `window` mensajes en vuelo) y un hilo lector recibe confirmaciones acumulativas
+class PeerSession:
+    def __init__(self, dest_ip, dest_port, node_name, journal=None, window=4096, verbose=True):
+        self.node_name = node_name
+        self.journal = journal
+        self.window = window
+        self.verbose = verbose
+
+        self.socket = socket.create_connection((dest_ip, dest_port))
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.socket.sendall(SESSION_PREAMBLE)
+        self.peer = self.socket.getpeername()
+
+        self.next_seq = 1
+        self.acked_seq = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.send_lock = threading.Lock()
+
+        self.reader = threading.Thread(target=self.ack_loop, daemon=True)
+        self.reader.start()
+
+    # Función para enviar un mensaje; devuelve su número de secuencia sin esperar la confirmación
+    def send(self, message):
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        payload = f"({current_time}) {self.node_name}: {message}".encode()
+        with self.send_lock:
+            with self.condition:
+                while self.next_seq - self.acked_seq > self.window and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    raise ConnectionError(f"La sesión con {self.peer} está cerrada")
+                seq = self.next_seq
+                self.next_seq += 1
+            self.socket.sendall(encode_frame(seq, payload))
+
+        if self.journal is not None:
+            self.journal.record(">>", self.peer, current_time, self.node_name, message)
+        return seq
+
+    def ack_loop(self):
+        try:
+            for frames in read_frames(self.socket):
+                seq, payload = frames[-1]
+                with self.condition:
+                    self.acked_seq = seq
+                    self.condition.notify_all()
+
+                response = payload.decode()
+                if self.verbose:
+                    print(f"Confirmación de recepción (hasta #{seq}): {response}")
+                if self.journal is not None:
+                    current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+                    self.journal.record("<<", self.peer, current_time, self.node_name, f"Confirmación de recepción (hasta #{seq}): {response}")
+        except OSError:
+            pass
+        finally:
+            with self.condition:
+                self.closed = True
+                self.condition.notify_all()
+
+    # Función para esperar a que todos los mensajes enviados estén confirmados
+    def flush(self, timeout=None):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.acked_seq >= self.next_seq - 1 or self.closed, timeout)
+
+    def close(self):
+        self.flush()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+# Función para atender una sesión: se procesan todas las tramas disponibles y se responde con una sola
+# confirmación acumulativa con la secuencia de la última
+def handle_session(client_socket, node_name, journal):
+    peer = client_socket.getpeername()
+    for frames in read_frames(client_socket):
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        for seq, payload in frames:
+            data = payload.decode()
+            print(f"Mensaje recibido en {node_name} de {peer}: {data}")
+            journal.record("<<", peer, current_time, node_name, data)
+        client_socket.sendall(encode_frame(frames[-1][0], f"Mensaje recibido en {node_name} a las {current_time}".encode()))
+
+# Hilo propio de una sesión persistente: lee el preámbulo, atiende la sesión hasta que el par la cierra y
+# devuelve su lugar en `sessions`
+def session_worker(client_socket, node_name, journal, sessions):
+    try:
+        preamble = b""
+        while len(preamble) < len(SESSION_PREAMBLE):
+            chunk = client_socket.recv(len(SESSION_PREAMBLE) - len(preamble))
+            if not chunk:
+                break
+            preamble += chunk
+        if preamble == SESSION_PREAMBLE:
+            handle_session(client_socket, node_name, journal)
+    except OSError:
+        pass
+    except Exception as e:
+        print(f"Error al atender la sesión en ({node_name}). {e}")
+    finally:
+        client_socket.close()
+        sessions.release()
+
+# Función para pasar una sesión a un hilo propio: dura lo que la conexión del par, así que no ocupa un
+# trabajador del grupo, que queda para los mensajes de un solo uso. Con `sessions` sesiones ya abiertas la
+# conexión se cierra: el remitente ve la sesión cerrada y la vuelve a abrir en el siguiente envío
+def start_session(client_socket, node_name, journal, sessions):
+    if not sessions.acquire(blocking=False):
+        print(f"Sesión rechazada en ({node_name}): demasiadas sesiones abiertas")
+        client_socket.close()
+        return
+    try:
+        threading.Thread(target=session_worker, args=(client_socket, node_name, journal, sessions), daemon=True).start()
+    except RuntimeError:
+        sessions.release()
+        raise
+
+# Función para manejar la comunicación con un nodo remoto en modo de un solo uso
+def handle_client(client_socket, node_name, journal):
     while True:
         data = client_socket.recv(1024).decode()
         if not data:
@@ -30,32 +266,111 @@ def handle_client(client_socket, node_name, messages_file):
         # Enviar una confirmación de recepción al remitente
         client_socket.send(f"Mensaje recibido en {node_name} a las {current_time}".encode())
 
-        # Almacenar el mensaje recibido en el archivo
-        with open(messages_file, 'a') as file:
-            file.write(f"<< Message Received from {client_socket.getpeername()} - ({current_time}) {node_name}: {data}\n\n")
+        # Almacenar el mensaje recibido en la bitácora
+        journal.record("<<", client_socket.getpeername(), current_time, node_name, data)
 
     client_socket.close()
 
-# Función para iniciar el servidor en un nodo
-def start_server(ip, port, node_name, messages_file):
+# Hilo del grupo de trabajadores del servidor: atiende las conexiones aceptadas de una en una y pasa las
+# sesiones a su propio hilo (ver start_session). Cualquier error de una conexión (de red o, p. ej., un
+# carácter multibyte partido entre dos recv) sólo cierra esa conexión: si terminara el hilo, el grupo fijo se
+# iría achicando hasta que el servidor dejara de responder
+def connection_worker(connections, node_name, journal, sessions):
+    while True:
+        client = connections.get()
+        try:
+            if client.recv(1, socket.MSG_PEEK) == SESSION_PREAMBLE[:1]:
+                start_session(client, node_name, journal, sessions)
+            else:
+                handle_client(client, node_name, journal)
+        except Exception as e:
+            print(f"Error al atender la conexión en ({node_name}). {e}")
+            client.close()
+
+# Función para iniciar el servidor en un nodo. Las conexiones las atiende un grupo fijo de `workers` hilos;
+# si hay más de `pending` conexiones esperando, el hilo aceptador se bloquea y las siguientes esperan en la
+# cola del kernel (`backlog`), de modo que una ráfaga de remitentes no agota hilos ni memoria. Las sesiones
+# persistentes corren en hilos propios, hasta `max_sessions` a la vez
+def start_server(ip, port, node_name, journal, workers=16, pending=64, backlog=20, max_sessions=64):
     try:
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         server.bind((ip, port))
-        server.listen(20)
+        server.listen(backlog)
 
         #print(f"Servidor en {node_name} escuchando en {ip}:{port}")
         print(f"Servidor en {node_name} escuchando en {server.getsockname()}")
 
+        connections = queue.Queue(maxsize=pending)
+        sessions = threading.BoundedSemaphore(max_sessions)
+        for _ in range(workers):
+            threading.Thread(target=connection_worker, args=(connections, node_name, journal, sessions), daemon=True).start()
+
         while True:
             client, addr = server.accept()
             print(f"\nConexión entrante desde {addr}")
-            client_handler = threading.Thread(target=handle_client, args=(client, node_name, messages_file))
-            client_handler.start()
+            connections.put(client)
     except OSError as e:
         print(f"Error al iniciar el servidor en ({node_name}). {e}")
         sys.exit(1)
 
+# Función para enviar un mensaje en modo de un solo uso: una conexión nueva por mensaje y espera
+# síncrona de la confirmación
+def send_message(dest_ip, dest_port, node_name, message, journal):
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        client_socket.connect((dest_ip, dest_port))
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        client_socket.send(f"({current_time}) {node_name}: {message}".encode())
+
+        # Almacenar el mensaje a enviar en la bitácora
+        journal.record(">>", client_socket.getpeername(), current_time, node_name, message)
+
+        response = client_socket.recv(1024).decode()
+
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        # Almacenar el mensaje de confirmacion en la bitácora
+        journal.record("<<", client_socket.getpeername(), current_time, node_name, f"Confirmación de recepción: {response}")
+        return response
+    finally:
+        client_socket.close()
+
+# Función para enviar un mismo mensaje a un grupo de nodos en paralelo a través de un ejecutor acotado.
+# Devuelve, por destinatario, la confirmación recibida o la excepción producida
+def send_group(executor, destinations, dest_port, node_name, message, journal):
+    futures = {dest_ip: executor.submit(send_message, dest_ip, dest_port, node_name, message, journal) for dest_ip in destinations}
+    results = {}
+    for dest_ip, future in futures.items():
+        try:
+            results[dest_ip] = future.result()
+        except Exception as e:
+            results[dest_ip] = e
+    return results
+
+# Función para mostrar el error de envío a un nodo
+def print_send_error(dest_ip, e):
+    if isinstance(e, socket.gaierror):
+        print(f"Error de resolución de dirección IP. {e}")
+    elif isinstance(e, ConnectionRefusedError):
+        print(f"El nodo ({dest_ip}) rechazó la conexión. {e}")
+    elif isinstance(e, TimeoutError):
+        print(f"Se agotó el tiempo de espera al conectar con el nodo ({dest_ip}). {e}")
+    else:
+        print(f"Error de conexión con el nodo ({dest_ip}). {e}")
+
 def main():
+    parser = argparse.ArgumentParser(description="Mensajería entre nodos")
+    parser.add_argument("--journal-format", choices=["jsonl", "text"], default="jsonl", help="Formato de la bitácora de mensajes")
+    parser.add_argument("--journal-flush-size", type=int, default=256, help="Registros por escritura en grupo")
+    parser.add_argument("--journal-flush-interval", type=float, default=0.05, help="Segundos máximos antes de escribir un grupo incompleto")
+    parser.add_argument("--journal-fsync", action="store_true", help="Hacer fsync después de cada escritura en grupo")
+    parser.add_argument("--session", action="store_true", help="Mantener una conexión persistente por destinatario con tramas y confirmaciones asíncronas")
+    parser.add_argument("--workers", type=int, default=16, help="Hilos del servidor para atender conexiones")
+    parser.add_argument("--pending", type=int, default=64, help="Conexiones aceptadas en espera de un hilo antes de dejar de aceptar")
+    parser.add_argument("--backlog", type=int, default=20, help="Cola de conexiones pendientes del kernel (listen)")
+    parser.add_argument("--max-sessions", type=int, default=64, help="Sesiones persistentes atendidas a la vez, cada una en su propio hilo")
+    parser.add_argument("--fanout-workers", type=int, default=8, help="Envíos simultáneos al mandar un mensaje a varios nodos")
+    args = parser.parse_args()
 
     # Registra la función de manejo de señales para la interrupción (Ctrl+C)
     signal.signal(signal.SIGINT, signal_handler)
@@ -68,52 +383,52 @@ def main():
     node_ip = input(">> Ingresa la dirección IP de tu nodo: ")
     node_port = 2222
 
-    # Crear un archivo para almacenar los mensajes
-    messages_file = f"{node_name}_messages.txt"
+    # Crear la bitácora para almacenar los mensajes
+    extension = "jsonl" if args.journal_format == "jsonl" else "txt"
+    journal = MessageJournal(f"{node_name}_messages.{extension}", args.journal_format, args.journal_flush_size,
+                             args.journal_flush_interval, args.journal_fsync)
 
     # Iniciar el servidor en el nodo
-    server_thread = threading.Thread(target=start_server, args=(node_ip, node_port, node_name, messages_file))
+    server_thread = threading.Thread(target=start_server, args=(node_ip, node_port, node_name, journal, args.workers, args.pending, args.backlog,
+                                                                   args.max_sessions))
     server_thread.start()
     time.sleep(0.1)
 
+    # Sesiones persistentes abiertas (modo --session), una por destinatario
+    sessions = {}
+
+    # Ejecutor acotado para los envíos a grupos de nodos
+    executor = ThreadPoolExecutor(max_workers=args.fanout_workers)
+
     # Bucle para enviar mensajes a otros nodos
     while True:
-        dest_ip = input(">> Ingresa la dirección IP del nodo destinatario: ")
+        destinations = [ip.strip() for ip in input(">> Ingresa la dirección IP del nodo destinatario (varias separadas por comas): ").split(",") if ip.strip()]
         dest_port = 2222
         message = input(">> Escribe tu mensaje: ")
 
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            client_socket.connect((dest_ip, dest_port))
-            current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            client_socket.send(f"({current_time}) {node_name}: {message}".encode())
-
-            # Almacenar el mensaje a enviar en el archivo
-            with open(messages_file, 'a') as file:
-                file.write(f">> Message Sent to {client_socket.getpeername()} - ({current_time}) {node_name}: {message}\n\n")
-
-            response = client_socket.recv(1024).decode()
-            print(f"Confirmación de recepción: {response}")
-
-            current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-            # Almacenar el mensaje de confirmacion en el archivo
-            with open(messages_file, 'a') as file:
-                file.write(f"<< Message Received from {client_socket.getpeername()} - ({current_time}) {node_name}: Confirmación de recepción: {response}\n\n")
-
-        except socket.gaierror as e:
-            print(f"Error de resolución de dirección IP. {e}")
-
-        except ConnectionRefusedError as e:
-            print(f"El nodo ({dest_ip}) rechazó la conexión. {e}")
-
-        except TimeoutError as e:
-            print(f"Se agotó el tiempo de espera al conectar con el nodo ({dest_ip}). {e}")
-
-        except (socket.error, ConnectionError) as e:
-            print(f"Error de conexión con el nodo ({dest_ip}). {e}")
-
-        finally:
-            client_socket.close()
+        if args.session:
+            for dest_ip in destinations:
+                try:
+                    # Reutilizar (o abrir) la sesión persistente con el destinatario. El envío no espera la
+                    # confirmación, así que un grupo se atiende sin el ejecutor
+                    if dest_ip not in sessions or sessions[dest_ip].closed:
+                        sessions[dest_ip] = PeerSession(dest_ip, dest_port, node_name, journal)
+                    sessions[dest_ip].send(message)
+                except (socket.error, ConnectionError) as e:
+                    print_send_error(dest_ip, e)
+                    sessions.pop(dest_ip, None)
+        elif len(destinations) == 1:
+            try:
+                response = send_message(destinations[0], dest_port, node_name, message, journal)
+                print(f"Confirmación de recepción: {response}")
+            except (socket.error, ConnectionError) as e:
+                print_send_error(destinations[0], e)
+        else:
+            for dest_ip, response in send_group(executor, destinations, dest_port, node_name, message, journal).items():
+                if isinstance(response, Exception):
+                    print_send_error(dest_ip, response)
+                else:
+                    print(f"Confirmación de recepción de ({dest_ip}): {response}")
 
 if __name__ == "__main__":
     main()
@@ -5,208 +5,2450 @@ import sys
 import sqlite3
 import random
 import time
-from prettytable import PrettyTable
+import hashlib
+import heapq
+import bisect
+import argparse
+import json
+import os
+import contextlib
+import functools
+import collections
+import queue
+import selectors
+import struct
+import zlib
+from concurrent.futures import Future
 from collections import Counter
 
+# Tablas sincronizadas por anti-entropía: llave natural (igual en todos los nodos) y columnas que se comparan.
+# SUCURSAL excluye nodo_actual porque es distinto en cada nodo
+ANTI_ENTROPY_TABLES = {
+    "CLIENTE": ("usuario", ["usuario", "nombre", "direccion", "tarjeta", "status"]),
+    "ARTICULO": ("codigo", ["codigo", "id_sucursal", "nombre", "precio", "stock"]),
+    "GUIA_ENVIO": ("serie", ["serie", "id_cliente", "id_articulo", "id_sucursal", "monto_total", "fecha_compra"]),
+    "SUCURSAL": ("id_sucursal", ["id_sucursal", "ip", "nodo_maestro", "status", "capacidad", "espacio_usado"])
+}
+
+# Versión del esquema de la base de datos (se guarda en PRAGMA user_version). Una base con esta versión ya
+# tiene sus tablas y sucursales iniciales, así que el arranque en caliente no vuelve a prepararlas.
+#   1: GUIA_ENVIO en una sola tabla
+#   2: GUIA_ENVIO particionada por mes de fecha_compra (ver ShipmentPartitions)
+#   3: índice GUIA_ENVIO_SERIE con la serie de cada guía, caliente o archivada
+SCHEMA_VERSION = 3
+
+# Versión del formato del archivo de estado del nodo
+STATE_FORMAT = 1
+
+# Niveles de consistencia de las lecturas de la API programática:
+#   local: lee la base de datos local sin esperar nada (la más rápida)
+#   bounded: lee localmente si el nodo estuvo al día hace menos de max_staleness segundos; si no, hace
+#            primero una lectura del índice de replicación en el maestro
+#   linearizable: siempre pide el índice de replicación al maestro (que espera a la escritura en curso)
+#                 y espera a haber aplicado hasta ese índice antes de leer
+# Pedir el índice toma la exclusión mutua de escritura del maestro (ver read_index), así que esas lecturas
+# compiten con las escrituras
+READ_CONSISTENCY_LEVELS = ("local", "bounded", "linearizable")
+
+# Límites (en segundos) de los histogramas de latencia
+METRICS_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10)
+
+# Clase MÉTRICAS: contadores e histogramas de latencia en formato de texto de Prometheus
+class Metrics:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.semaphore = threading.Semaphore()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.semaphore:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.semaphore:
+            self.gauges[key] = value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(METRICS_BUCKETS, seconds)
+        with self.semaphore:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(METRICS_BUCKETS) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    # Función para medir la duración de un bloque de código
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def format_labels(labels):
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+    def render(self):
+        lines = []
+        with self.semaphore:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, (list(value[0]), value[1], value[2])) for key, value in self.histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self.format_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{self.format_labels(labels)} {value}")
+
+        for (name, labels), (buckets, total, count) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for limit, bucket_count in zip(METRICS_BUCKETS + ("+Inf",), buckets):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{self.format_labels(labels + (('le', limit),))} {cumulative}")
+            lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+            lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+# Cursor de SQLite que mide el tiempo de cada sentencia (sólo se usa con las métricas activas)
+class MetricsCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            statement = sql.split(None, 1)[0].upper() if sql.strip() else "VACIA"
+            self.connection.metrics.observe("nodo_sqlite_statement_seconds", time.perf_counter() - start, statement=statement)
+
+# Registro en memoria de una fila de SUCURSAL
+class Branch:
+    __slots__ = ("id_sucursal", "ip", "nodo_actual", "nodo_maestro", "status", "capacidad", "espacio_usado")
+
+    def __init__(self, id_sucursal, ip, nodo_actual, nodo_maestro, status, capacidad, espacio_usado):
+        self.id_sucursal = id_sucursal
+        self.ip = ip
+        self.nodo_actual = nodo_actual
+        self.nodo_maestro = nodo_maestro
+        self.status = status
+        self.capacidad = capacidad
+        self.espacio_usado = espacio_usado
+
+SUCURSAL_COLUMNS = "id_sucursal, ip, nodo_actual, nodo_maestro, status, capacidad, espacio_usado"
+
+# Vista inmutable del clúster con los datos que se consultan en cada escritura: la sucursal actual, el
+# maestro, los demás nodos activos (peers) y los totales de capacidad y espacio usado de las activas
+class ClusterView:
+    __slots__ = ("branches", "by_ip", "current", "master", "peers", "active", "total_capacity", "total_used")
+
+    def __init__(self, branches):
+        self.branches = branches
+        self.by_ip = {}
+        self.current = self.master = None
+        self.total_capacity = self.total_used = 0
+        active = []
+        for id_sucursal in sorted(branches):
+            branch = branches[id_sucursal]
+            self.by_ip[branch.ip] = branch
+            if branch.status != 1:
+                continue
+            active.append(branch)
+            self.total_capacity += branch.capacidad
+            self.total_used += branch.espacio_usado
+            if branch.nodo_actual == 1 and self.current is None:
+                self.current = branch
+            if branch.nodo_maestro == 1 and self.master is None:
+                self.master = branch
+        self.active = tuple(active)
+        self.peers = tuple(branch for branch in active if branch.nodo_actual == 0)
+
+# Clase ESTADO DEL CLÚSTER: copia en memoria de SUCURSAL. Cada conexión del nodo tiene triggers temporales
+# que anotan las sucursales que modifica; al confirmar o deshacer, la conexión vuelve a leer sólo esas filas
+# y se publica una vista nueva de una sola vez (los lectores nunca ven una vista a medias). La lectura se hace
+# con el candado tomado para que una confirmación anterior no publique sus filas después de una posterior
+class ClusterState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.view = ClusterView({})
+
+    # Función para instalar los triggers en una conexión. Devuelve False si SUCURSAL todavía no existe
+    def attach(self, connection):
+        connection.cluster_state = self
+        connection.changed_branches = set()
+        connection.create_function("sucursal_changed", 1, connection.changed_branches.add)
+        try:
+            for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                connection.execute(f"""
+                    CREATE TEMP TRIGGER IF NOT EXISTS sucursal_{event.lower()} AFTER {event} ON main.SUCURSAL
+                    BEGIN SELECT sucursal_changed({row}.id_sucursal); END
+                """)
+        except sqlite3.OperationalError:
+            return False
+        return True
+
+    def load(self, connection):
+        with self.lock:
+            rows = connection.execute(f"SELECT {SUCURSAL_COLUMNS} FROM SUCURSAL").fetchall()
+            self.view = ClusterView({row[0]: Branch(*row) for row in rows})
+
+    def refresh(self, connection):
+        ids = list(connection.changed_branches)
+        connection.changed_branches.clear()
+        with self.lock:
+            rows = connection.execute(f"SELECT {SUCURSAL_COLUMNS} FROM SUCURSAL WHERE id_sucursal IN ({','.join('?' * len(ids))})", ids).fetchall()
+            branches = dict(self.view.branches)
+            for id_sucursal in ids:
+                branches.pop(id_sucursal, None)
+            for row in rows:
+                branches[row[0]] = Branch(*row)
+            self.view = ClusterView(branches)
+
+# Conexión del nodo: después de confirmar o deshacer actualiza el estado del clúster con las sucursales que
+# modificó (las anotan los triggers de ClusterState.attach)
+class ClusterStateConnection(sqlite3.Connection):
+    cluster_state = None
+    changed_branches = ()
+
+    def commit(self):
+        super().commit()
+        if self.changed_branches:
+            self.cluster_state.refresh(self)
+
+    def rollback(self):
+        super().rollback()
+        if self.changed_branches:
+            self.cluster_state.refresh(self)
+
+# Tamaño en bytes del resumen de una propuesta de consenso (los 20 dígitos hexadecimales de vote_digest)
+DIGEST_SIZE = 10
+
+# Tabla de votos de una ronda de consenso: el resumen de cada sucursal en un solo bytearray, indexado por
+# id_sucursal - 1, y un byte por sucursal que indica si ya votó. Crece si llega un voto de un id mayor
+class VoteTable:
+    __slots__ = ("digests", "voted", "lock")
+
+    def __init__(self, size=5):
+        self.digests = bytearray(size * DIGEST_SIZE)
+        self.voted = bytearray(size)
+        self.lock = threading.Lock()
+
+    def set(self, id_sucursal, digest):
+        index = id_sucursal - 1
+        with self.lock:
+            if index >= len(self.voted):
+                self.digests.extend(bytes((index + 1 - len(self.voted)) * DIGEST_SIZE))
+                self.voted.extend(bytes(index + 1 - len(self.voted)))
+            self.digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE] = digest
+            self.voted[index] = 1
+
+    # Función para obtener el resumen con más votos (None si nadie votó)
+    def majority(self):
+        with self.lock:
+            votes = Counter(bytes(self.digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE])
+                            for index, voted in enumerate(self.voted) if voted)
+        return votes.most_common(1)[0][0] if votes else None
+
+    def clear(self):
+        with self.lock:
+            self.voted[:] = bytes(len(self.voted))
+
+class MetricsConnection(ClusterStateConnection):
+    metrics = None
+
+    def cursor(self, factory=MetricsCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        finally:
+            self.metrics.observe("nodo_sqlite_commit_seconds", time.perf_counter() - start)
+
+# Conexión del hilo escritor del pipeline de aplicación: los commit() de las funciones CRUD no hacen nada y
+# el escritor confirma cada grupo de operaciones con group_commit()
+class GroupCommitConnection(ClusterStateConnection):
+    def commit(self):
+        pass
+
+    def group_commit(self):
+        super().commit()
+
+class MetricsGroupCommitConnection(GroupCommitConnection, MetricsConnection):
+    pass
+
+# Columnas de GUIA_ENVIO, en el orden de la tabla original
+GUIA_ENVIO_COLUMNS = ("id_guia", "id_cliente", "id_articulo", "id_sucursal", "serie", "monto_total", "fecha_compra")
+
+# Clase PARTICIONES DE GUIA_ENVIO: las guías se guardan en una tabla por mes de fecha_compra
+# (GUIA_ENVIO_AAAA_MM), así el índice UNIQUE de serie de la partición en la que se escribe se mantiene chico.
+# GUIA_ENVIO es una vista con la unión de las particiones calientes (para las lecturas existentes) y
+# GUIA_ENVIO_CONTADOR da id_guia crecientes entre particiones. Los meses anteriores a los `hot_months`
+# más recientes son fríos: archive() los compacta en un archivo JSON comprimido con zlib de sólo lectura y
+# borra su tabla. select() lee un rango de fechas visitando sólo las particiones (y archivos) del rango.
+# El índice UNIQUE de serie de cada partición sólo cubre su mes: GUIA_ENVIO_SERIE (serie -> mes) mantiene la
+# serie única entre todas las particiones y los meses archivados, como en la tabla original. insert() la
+# registra en la misma transacción que la guía y archive() no la borra.
+# El hilo de archivado cambia `months` y el caché del último archivo leído mientras otros hilos los usan: se
+# accede a ambos bajo `lock`, que nunca se toma alrededor de una sentencia SQL (quien escribe ya tiene la
+# transacción de SQLite; tomarlo antes que ella invertiría el orden entre hilos). Dos hilos que crean la
+# misma partición a la vez dejan una sola (CREATE TABLE IF NOT EXISTS)
+class ShipmentPartitions:
+    def __init__(self, archive_directory, hot_months=3):
+        self.archive_directory = archive_directory
+        self.hot_months = hot_months
+        self.months = set()
+        self.lock = threading.RLock()
+        self.archive_cache = (None, None)
+
+    @staticmethod
+    def partition_table(month):
+        return "GUIA_ENVIO_" + month.replace("-", "_")
+
+    def archive_path(self, month):
+        return os.path.join(self.archive_directory, f"{self.partition_table(month)}.json.z")
+
+    # Función para obtener el primer mes caliente ("AAAA-MM", hora local como fecha_compra)
+    def cutoff(self, now):
+        local = time.localtime(now)
+        index = local.tm_year * 12 + local.tm_mon - 1 - (self.hot_months - 1)
+        return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+    # Función para leer las particiones existentes en la base de datos
+    def load(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'GUIA_ENVIO_[0-9]*'")
+        months = {name[len("GUIA_ENVIO_"):].replace("_", "-") for (name,) in cursor.fetchall()}
+        with self.lock:
+            self.months = months
+
+    # Función para obtener los meses de las particiones calientes, ordenados
+    def partitions(self):
+        with self.lock:
+            return sorted(self.months)
+
+    def has_partition(self, month):
+        with self.lock:
+            return month in self.months
+
+    def archived_months(self):
+        if not os.path.isdir(self.archive_directory):
+            return []
+        prefix, suffix = "GUIA_ENVIO_", ".json.z"
+        return sorted(name[len(prefix):-len(suffix)].replace("_", "-") for name in os.listdir(self.archive_directory)
+                      if name.startswith(prefix) and name.endswith(suffix))
+
+    def create_schema(self, cursor):
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS GUIA_ENVIO_CONTADOR (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                ultimo_id INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("INSERT OR IGNORE INTO GUIA_ENVIO_CONTADOR (id, ultimo_id) VALUES (0, 0)")
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS GUIA_ENVIO_SERIE (
+                serie INTEGER PRIMARY KEY,
+                mes TEXT NOT NULL
+            )
+        """)
+        self.load(cursor)
+        self.create_view(cursor)
+
+    # Función para recrear la vista GUIA_ENVIO con las particiones calientes
+    def create_view(self, cursor):
+        columns = ", ".join(GUIA_ENVIO_COLUMNS)
+        selects = [f"SELECT {columns} FROM {self.partition_table(month)}" for month in self.partitions()]
+        if not selects:
+            selects = [f"SELECT {', '.join(f'NULL AS {column}' for column in GUIA_ENVIO_COLUMNS)} WHERE 0"]
+        cursor.execute("DROP VIEW IF EXISTS GUIA_ENVIO")
+        cursor.execute(f"CREATE VIEW GUIA_ENVIO AS {' UNION ALL '.join(selects)}")
+
+    def create_partition(self, cursor, month):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.partition_table(month)} (
+                id_guia INTEGER PRIMARY KEY,
+                id_cliente INTEGER NOT NULL,
+                id_articulo INTEGER NOT NULL,
+                id_sucursal INTEGER NOT NULL,
+                serie INTEGER NOT NULL UNIQUE,
+                monto_total REAL NOT NULL,
+                fecha_compra TEXT NOT NULL
+            )
+        """)
+        with self.lock:
+            self.months.add(month)
+        self.create_view(cursor)
+
+    # Función para encontrar el mes (caliente o archivado) de la guía con una serie (None si no está)
+    def find_serie(self, cursor, serie):
+        cursor.execute("SELECT mes FROM GUIA_ENVIO_SERIE WHERE serie = ?", (serie,))
+        found = cursor.fetchone()
+        return found[0] if found is not None else None
+
+    # Función para llenar GUIA_ENVIO_SERIE con las guías de las particiones calientes y de los archivos (base
+    # del esquema 2, anterior al índice)
+    def index_series(self, cursor):
+        for month in self.partitions():
+            cursor.execute(f"INSERT OR IGNORE INTO GUIA_ENVIO_SERIE (serie, mes) SELECT serie, ? FROM {self.partition_table(month)}", (month,))
+        for month in self.archived_months():
+            cursor.executemany("INSERT OR IGNORE INTO GUIA_ENVIO_SERIE (serie, mes) VALUES (?, ?)",
+                               ((row[4], month) for row in self.read_archive(month)))
+
+    # Función para insertar una guía en la partición de su mes (que se crea con la primera guía del mes).
+    # Una serie que ya tiene otra guía, caliente o archivada, falla como en la tabla original
+    def insert(self, cursor, id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra, id_guia=None):
+        month = fecha_compra[:7]
+        try:
+            cursor.execute("INSERT INTO GUIA_ENVIO_SERIE (serie, mes) VALUES (?, ?)", (serie, month))
+        except sqlite3.IntegrityError:
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: GUIA_ENVIO.serie") from None
+        if not self.has_partition(month):
+            self.create_partition(cursor, month)
+        if id_guia is None:
+            cursor.execute("UPDATE GUIA_ENVIO_CONTADOR SET ultimo_id = ultimo_id + 1 WHERE id = 0")
+            cursor.execute("SELECT ultimo_id FROM GUIA_ENVIO_CONTADOR WHERE id = 0")
+            id_guia = cursor.fetchone()[0]
+        row = (id_guia, id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra)
+        query = f"INSERT INTO {self.partition_table(month)} ({', '.join(GUIA_ENVIO_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)"
+        try:
+            cursor.execute(query, row)
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            # La partición se creó en una transacción que se deshizo
+            self.create_partition(cursor, month)
+            cursor.execute(query, row)
+
+    # Función para insertar o actualizar una guía por su serie (reparación de anti-entropía). Si la serie está
+    # en la partición de otro mes (cambió fecha_compra) la guía se mueve conservando su id_guia. Los meses
+    # archivados son de sólo lectura: una serie archivada no se toca
+    def upsert(self, cursor, serie, id_cliente, id_articulo, id_sucursal, monto_total, fecha_compra):
+        month = fecha_compra[:7]
+        found = self.find_serie(cursor, serie)
+        if found is not None and not self.has_partition(found):
+            return
+        if found == month:
+            cursor.execute(f"""
+                UPDATE {self.partition_table(month)}
+                SET id_cliente = ?, id_articulo = ?, id_sucursal = ?, monto_total = ?, fecha_compra = ?
+                WHERE serie = ?
+            """, (id_cliente, id_articulo, id_sucursal, monto_total, fecha_compra, serie))
+            return
+        id_guia = None
+        if found is not None:
+            table = self.partition_table(found)
+            cursor.execute(f"SELECT id_guia FROM {table} WHERE serie = ?", (serie,))
+            id_guia = cursor.fetchone()[0]
+            cursor.execute(f"DELETE FROM {table} WHERE serie = ?", (serie,))
+            cursor.execute("DELETE FROM GUIA_ENVIO_SERIE WHERE serie = ?", (serie,))
+        self.insert(cursor, id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra, id_guia)
+
+    def delete(self, cursor, serie, fecha_compra):
+        month = fecha_compra[:7]
+        if self.has_partition(month):
+            cursor.execute(f"DELETE FROM {self.partition_table(month)} WHERE serie = ?", (serie,))
+            if cursor.rowcount:
+                cursor.execute("DELETE FROM GUIA_ENVIO_SERIE WHERE serie = ?", (serie,))
+
+    # Función para leer las filas de un mes archivado. Se guarda en caché el último archivo leído, identificado
+    # por su mes y su versión (archive() lo reemplaza al combinar), y se devuelven las filas leídas por este
+    # hilo aunque otro cambie el caché mientras tanto
+    def read_archive(self, month):
+        path = self.archive_path(month)
+        stat = os.stat(path)
+        version = (month, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            cached_version, rows = self.archive_cache
+        if cached_version == version:
+            return rows
+        with open(path, "rb") as file:
+            rows = json.loads(zlib.decompress(file.read()))["rows"]
+        with self.lock:
+            self.archive_cache = (version, rows)
+        return rows
+
+    # Función para leer las guías con since <= fecha_compra < until ("AAAA-MM-DD HH:MM:SS", None = sin límite).
+    # Sólo se consultan las particiones cuyo mes cae en el rango; con include_archive también los archivos
+    def select(self, cursor, columns=GUIA_ENVIO_COLUMNS, since=None, until=None, include_archive=False):
+        def in_range(month):
+            return (since is None or month >= since[:7]) and (until is None or month <= until[:7])
+
+        conditions, parameters = [], []
+        if since is not None:
+            conditions.append("fecha_compra >= ?")
+            parameters.append(since)
+        if until is not None:
+            conditions.append("fecha_compra < ?")
+            parameters.append(until)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        rows = []
+        partitions = self.partitions()
+        if include_archive:
+            positions = [GUIA_ENVIO_COLUMNS.index(column) for column in columns]
+            for month in self.archived_months():
+                if in_range(month) and month not in partitions:
+                    rows.extend(tuple(row[i] for i in positions) for row in self.read_archive(month)
+                                if (since is None or row[6] >= since) and (until is None or row[6] < until))
+        for month in partitions:
+            if in_range(month):
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {self.partition_table(month)}{where}", parameters)
+                rows.extend(cursor.fetchall())
+        return rows
+
+    # Función para compactar las particiones frías en archivos comprimidos y borrar sus tablas. Cada mes se
+    # archiva en una transacción IMMEDIATE (nadie escribe en la partición mientras tanto) y el archivo se
+    # escribe completo (temporal + rename) antes de borrar la tabla; si el mes ya tenía archivo se combina
+    def archive(self, cursor, now):
+        cutoff = self.cutoff(now)
+        archived = []
+        for month in self.partitions():
+            if month >= cutoff:
+                break
+            table = self.partition_table(month)
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(f"SELECT {', '.join(GUIA_ENVIO_COLUMNS)} FROM {table} ORDER BY id_guia")
+            rows = [list(row) for row in cursor.fetchall()]
+            path = self.archive_path(month)
+            if os.path.exists(path):
+                archived_series = {row[4] for row in rows}
+                rows = [row for row in self.read_archive(month) if row[4] not in archived_series] + rows
+            os.makedirs(self.archive_directory, exist_ok=True)
+            temporary = path + ".tmp"
+            with open(temporary, "wb") as file:
+                file.write(zlib.compress(json.dumps({"columns": GUIA_ENVIO_COLUMNS, "rows": rows}).encode(), 9))
+                file.flush()
+                os.fsync(file.fileno())
+            if os.path.exists(path):
+                os.chmod(path, 0o644)
+            os.replace(temporary, path)
+            os.chmod(path, 0o444)
+
+            cursor.execute(f"DROP TABLE {table}")
+            with self.lock:
+                self.months.discard(month)
+            self.create_view(cursor)
+            cursor.connection.commit()
+            archived.append((month, len(rows)))
+        return archived
+
+    # Función para pasar una tabla GUIA_ENVIO del esquema 1 a las particiones (conservando id_guia)
+    def migrate(self, cursor):
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = 'GUIA_ENVIO'")
+        found = cursor.fetchone()
+        if found is None or found[0] != "table":
+            return 0
+        cursor.execute(f"SELECT {', '.join(GUIA_ENVIO_COLUMNS)} FROM GUIA_ENVIO ORDER BY id_guia")
+        rows = cursor.fetchall()
+        cursor.execute("ALTER TABLE GUIA_ENVIO RENAME TO GUIA_ENVIO_ESQUEMA_1")
+        self.create_schema(cursor)
+        for row in rows:
+            month = row[6][:7]
+            if not self.has_partition(month):
+                self.create_partition(cursor, month)
+            cursor.execute(f"INSERT INTO {self.partition_table(month)} ({', '.join(GUIA_ENVIO_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+            cursor.execute("INSERT INTO GUIA_ENVIO_SERIE (serie, mes) VALUES (?, ?)", (row[4], month))
+        cursor.execute("UPDATE GUIA_ENVIO_CONTADOR SET ultimo_id = (SELECT COALESCE(MAX(id_guia), 0) FROM GUIA_ENVIO_ESQUEMA_1) WHERE id = 0")
+        cursor.execute("DROP TABLE GUIA_ENVIO_ESQUEMA_1")
+        return len(rows)
+
+# Clase PIPELINE DE APLICACIÓN: las operaciones ya decididas (por consenso o localmente) se encolan y un
+# único hilo escritor las aplica en transacciones agrupadas: toma todo lo que haya en la cola (hasta
+# max_batch operaciones, esperando como mucho max_delay segundos por más) y hace un solo commit (un fsync)
+# por grupo. Cada operación corre en su propio SAVEPOINT, así una que falla no deshace a las demás.
+# submit() devuelve un Future que se resuelve después del commit, para confirmar sólo lo que ya es durable.
+# `context` se entrega tal cual a apply (el nodo lo usa para el contexto de trazado de quien encoló).
+# Con inline=True no hay hilo escritor: cada operación se aplica y confirma en quien la envía (simulación)
+class ApplyPipeline:
+    def __init__(self, connect, apply, metrics, max_batch=64, max_delay=0.0, inline=False):
+        self.connect = connect
+        self.apply = apply
+        self.metrics = metrics
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.connection = None
+        self.queue = queue.Queue()
+        self.writer = None
+        if not inline:
+            self.writer = threading.Thread(target=self.writer_loop, daemon=True)
+            self.writer.start()
+
+    def submit(self, operation, context=None):
+        future = Future()
+        if self.writer is None:
+            self.apply_batch([(operation, context, future)])
+        else:
+            self.queue.put((operation, context, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        return batch
+
+    def writer_loop(self):
+        while True:
+            self.apply_batch(self.next_batch())
+
+    def apply_batch(self, batch):
+        if self.connection is None:
+            # La conexión se abre con la primera operación, cuando el esquema ya existe
+            self.connection = self.connect()
+        connection = self.connection
+        cursor = connection.cursor()
+        results = []
+        try:
+            cursor.execute("BEGIN")
+            for operation, context, future in batch:
+                cursor.execute("SAVEPOINT operacion")
+                try:
+                    results.append((future, self.apply(cursor, operation, context), None))
+                    cursor.execute("RELEASE operacion")
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO operacion")
+                    cursor.execute("RELEASE operacion")
+                    results.append((future, None, e))
+            connection.group_commit()
+        except Exception as e:
+            connection.rollback()
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+
+        self.metrics.inc("nodo_apply_operations_total", len(batch))
+        self.metrics.inc("nodo_apply_commits_total")
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+# Decorador para registrar un span de trazado alrededor de un método de Nodo
+def traced(name):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.tracing_enabled:
+                return method(self, *args, **kwargs)
+            with self.span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+# Clase PERFILADOR: perfilado bajo demanda de un nodo. Durante una ventana (pedida con el mensaje `profile`)
+# toma muestras de las pilas de todos los hilos cada `interval` segundos con sys._current_frames() y cuenta cada
+# pila en formato colapsado ("raíz;...;hoja"), el que leen flamegraph.pl y speedscope. El muestreo es de tiempo
+# de pared: también cuenta lo que los hilos pasan esperando sockets, semáforos o SQLite. Mientras dura la ventana
+# los métodos marcados con @timed registran llamadas, tiempo total y máximo; fuera de ella no hay hilo de
+# muestreo y los métodos marcados sólo consultan `enabled`
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.window = threading.Lock()
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.labels = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            count, total, maximum = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + seconds, max(maximum, seconds))
+
+    # Función para obtener el nombre de un marco: función calificada (archivo:línea de su definición)
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self.labels[code] = label
+        return label
+
+    # Función para colapsar la pila de un hilo, sin los marcos de arranque del módulo threading ni los
+    # envoltorios de @traced y @timed
+    def collapse(self, frame):
+        codes = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_name != "wrapper" or code.co_filename != __file__:
+                codes.append(code)
+            frame = frame.f_back
+        codes.reverse()
+        start = 0
+        while start < len(codes) - 1 and codes[start].co_filename == threading.__file__:
+            start += 1
+        return ";".join(self.label(code) for code in codes[start:])
+
+    # Función para perfilar durante `seconds` segundos (con el reloj real). Devuelve None si ya hay una ventana
+    def profile(self, seconds, interval=0.01):
+        if not self.window.acquire(blocking=False):
+            return None
+        try:
+            with self.lock:
+                self.timings = {}
+            self.enabled = True
+            stacks = Counter()
+            samples = 0
+            own = threading.get_ident()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident != own:
+                        stacks[self.collapse(frame)] += 1
+                samples += 1
+                time.sleep(interval)
+            self.enabled = False
+            with self.lock:
+                timings = self.timings
+            return {"seconds": seconds, "interval": interval, "samples": samples, "stacks": dict(stacks), "timings": timings}
+        finally:
+            self.enabled = False
+            self.window.release()
+
+# Límites de una ventana de perfilado pedida por otro proceso
+PROFILE_MAX_SECONDS = 300
+PROFILE_MIN_INTERVAL = 0.001
+
+# Decorador para medir un método caliente de Nodo durante una ventana de perfilado (ver Profiler). Fuera de la
+# ventana sólo agrega la consulta de profiler.enabled
+def timed(name):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if not profiler.enabled:
+                return method(self, *args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                profiler.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+# Mensajes entre nodos que se pueden repetir sin efectos secundarios: si falla la respuesta se reintentan.
+# Los demás sólo se reintentan si falló la conexión (el mensaje nunca llegó al par)
+IDEMPOTENT_OPCODES = {"heart_beat", "shard_query", "shard_write", "shard_copy", "merkle_root", "merkle_node", "merkle_rows",
+                      "distribute_new_article", "read_index", "metrics", "traces"}
+
+# Mensajes cuya respuesta llega enseguida: su tiempo de espera se adapta al RTT observado del par
+FAST_REPLY_OPCODES = {"heart_beat", "shard_query", "merkle_root", "merkle_node", "merkle_rows", "distribute_new_article",
+                      "try_permission"}
+
+# Clases de prioridad de los mensajes entrantes:
+#   control: consenso, fin de la exclusión mutua, detección de fallas y lo que pide quien tiene la exclusión
+#            mutua para terminar su escritura (se esperan entre sí, así que nunca quedan detrás de otro tráfico)
+#   normal: pedidos de la exclusión mutua (acquire_permission, read_index), que no ocupan su cupo mientras esperan
+#   bulk: transferencias de anti-entropía, consultas de métricas y trazas y ventanas de perfilado
+# Cada mensaje declara su clase al registrarse (ver message_handler); los desconocidos son normal
+PRIORITY_CLASSES = ("control", "normal", "bulk")
+# Respuesta a un mensaje rechazado por el control de admisión (no se ejecutó, así que se puede reintentar)
+BUSY_REPLY = b"busy"
+# Valor que devuelve un manejador que responderá más tarde: el socket del cliente queda abierto y lo cierra
+# quien envíe la respuesta (ver handle_acquire_permission)
+DEFERRED_REPLY = object()
+
+# Clase CONTROL DE ADMISIÓN: cada clase de prioridad tiene su propio cupo de mensajes en curso (`limits`) y
+# una cola de espera acotada (`queue_limits`). Un mensaje que llega con el cupo lleno espera en la cola de su
+# clase; con la cola también llena se rechaza (el servidor responde `busy`). El hilo que termina un mensaje
+# atiende el siguiente de su cola, así los hilos en uso nunca pasan de la suma de los cupos. Como los cupos
+# son independientes, el tráfico normal y de fondo no puede ocupar los hilos que necesita el consenso
+class AdmissionController:
+    def __init__(self, limits, queue_limits, metrics):
+        self.limits = limits
+        self.queue_limits = queue_limits
+        self.metrics = metrics
+        self.in_flight = dict.fromkeys(PRIORITY_CLASSES, 0)
+        self.pending = {priority: collections.deque() for priority in PRIORITY_CLASSES}
+        self.lock = threading.Lock()
+
+    # Función para admitir un mensaje. Devuelve False si se rechazó
+    def submit(self, priority, function, *args):
+        with self.lock:
+            if self.in_flight[priority] < self.limits[priority]:
+                self.in_flight[priority] += 1
+                queued = False
+            elif len(self.pending[priority]) < self.queue_limits[priority]:
+                self.pending[priority].append((time.perf_counter(), function, args))
+                queued = True
+            else:
+                self.metrics.inc("nodo_admission_rejected_total", priority=priority)
+                return False
+            self.update_gauges(priority)
+        if not queued:
+            threading.Thread(target=self.run, args=(priority, function, args), daemon=True).start()
+        return True
+
+    def run(self, priority, function, args):
+        while True:
+            try:
+                function(*args)
+            except Exception as e:
+                print(f"\n>> Error en admisión ({priority}): {e} \n")
+            with self.lock:
+                if not self.pending[priority]:
+                    self.in_flight[priority] -= 1
+                    self.update_gauges(priority)
+                    return
+                queued_at, function, args = self.pending[priority].popleft()
+                self.update_gauges(priority)
+            self.metrics.observe("nodo_admission_wait_seconds", time.perf_counter() - queued_at, priority=priority)
+
+    def update_gauges(self, priority):
+        self.metrics.set("nodo_admission_in_flight", self.in_flight[priority], priority=priority)
+        self.metrics.set("nodo_admission_queue_depth", len(self.pending[priority]), priority=priority)
+
+# Clase OPCODE: entrada del registro de mensajes entre nodos o del de operaciones replicadas. `decoders`
+# convierte cada campo después del opcode a su tipo y fija cuántos campos trae el mensaje; con decoders=None el
+# manejador recibe el mensaje sin separar (p. ej. la operación que viaja dentro de start_consensus). Los campos
+# de texto se pasan tal cual, así que al decodificar sólo se llama a los demás decodificadores
+class Opcode:
+    def __init__(self, name, decoders=None, handler=None, sql=None, priority="normal", database=False):
+        self.name = name
+        self.decoders = decoders
+        self.arity = None if decoders is None else len(decoders) + 1
+        self.conversions = [(index, decoder) for index, decoder in enumerate(decoders or ()) if decoder is not str]
+        self.handler = handler
+        self.sql = sql
+        self.priority = priority
+        self.database = database
+
+    def decode(self, parts):
+        fields = parts[1:]
+        for index, decoder in self.conversions:
+            fields[index] = decoder(fields[index])
+        return fields
+
+# Registro de los mensajes entre nodos: opcode -> Opcode con el método de Nodo que lo atiende, su clase de
+# prioridad y si abre una conexión a la base de datos local (los demás se atienden sin abrirla)
+MESSAGE_HANDLERS = {}
+
+# Registro de las operaciones replicadas (lo que se aplica tras el consenso): nombre -> Opcode con la sentencia
+# SQL o el método de Nodo que la aplica
+REPLICATED_OPERATIONS = {}
+
+# Decorador para registrar un método de Nodo como manejador de un mensaje. El método recibe
+# (client_socket, cursor, mensaje, *campos decodificados); con raw=True sólo el mensaje completo
+def message_handler(name, *decoders, raw=False, priority="normal", database=False):
+    def decorator(method):
+        MESSAGE_HANDLERS[name] = Opcode(name, None if raw else decoders, method, priority=priority, database=database)
+        return method
+    return decorator
+
+# Decorador para registrar un método de Nodo que aplica una operación replicada; recibe (cursor, *campos)
+def replicated_operation(name, *decoders):
+    def decorator(method):
+        REPLICATED_OPERATIONS[name] = Opcode(name, decoders, method)
+        return method
+    return decorator
+
+# Función para registrar una operación replicada que es una sola sentencia: se ejecuta con los campos en el
+# orden del mensaje (?1, ?2... para usarlos en otro orden) y se confirma. El texto de la sentencia es siempre
+# el mismo objeto, así que sqlite3 la prepara una vez por conexión y después la toma de su caché
+def register_operation(name, *decoders, sql):
+    REPLICATED_OPERATIONS[name] = Opcode(name, decoders, sql=sql)
+
+# Función para decodificar los movimientos de migrate_articulos: "codigo:origen:destino,..."
+def decode_moves(field):
+    return [tuple(int(value) for value in move.split(':')) for move in field.split(',')]
+
+register_operation("create_cliente", str, str, str, int, sql="""
+    INSERT INTO CLIENTE (usuario, nombre, direccion, tarjeta, status)
+    VALUES (?, ?, ?, ?, 'Activo')
+""")
+register_operation("update_cliente", str, str, str, int, sql="""
+    UPDATE CLIENTE
+    SET nombre = ?2, direccion = ?3, tarjeta = ?4
+    WHERE usuario = ?1
+""")
+register_operation("activate_cliente", str, sql="""
+    UPDATE CLIENTE
+    SET status = 'Activo'
+    WHERE usuario = ?
+""")
+register_operation("deactivate_cliente", str, sql="""
+    UPDATE CLIENTE
+    SET status = 'Inactivo'
+    WHERE usuario = ?
+""")
+register_operation("update_articulo", int, str, float, sql="""
+    UPDATE ARTICULO
+    SET nombre = ?2, precio = ?3
+    WHERE codigo = ?1
+""")
+register_operation("restock_articulo", int, sql="""
+    UPDATE ARTICULO
+    SET stock = 'Disponible'
+    WHERE codigo = ? AND stock = 'Agotado'
+""")
+register_operation("deactivate_articulo", int, sql="""
+    UPDATE ARTICULO
+    SET stock = 'Agotado'
+    WHERE codigo = ? AND stock = 'Disponible'
+""")
+register_operation("increment_espacio_usado", int, sql="""
+    UPDATE SUCURSAL
+    SET espacio_usado = espacio_usado + 1
+    WHERE id_sucursal = ?
+""")
+register_operation("set_espacio_usado", int, int, sql="""
+    UPDATE SUCURSAL
+    SET espacio_usado = ?2
+    WHERE id_sucursal = ?1
+""")
+
+# Lote de mensajes en una sola conexión: [marcador | banderas | longitud (4 bytes)] seguido de los mensajes,
+# cada uno como [longitud (4 bytes) | mensaje]. Un mensaje de texto nunca empieza con un byte nulo
+BATCH_MARKER = b"\x00"
+BATCH_HEADER = struct.Struct(">cBI")
+BATCH_ITEM = struct.Struct(">I")
+BATCH_COMPRESSED = 1
+
+# Mensaje suelto: [marcador | longitud (4 bytes)] seguido del mensaje. El servidor lee el resto hasta completar
+# la longitud, así un mensaje no tiene tope de tamaño. Los mensajes sin marcador (herramientas externas) se
+# siguen leyendo con un solo recv
+MESSAGE_MARKER = b"\x01"
+MESSAGE_HEADER = struct.Struct(">cI")
+
+# Socket vacío para los mensajes que llegan dentro de un lote (no esperan respuesta)
+class NullSocket:
+    def send(self, data):
+        return len(data)
+
+    def sendall(self, data):
+        pass
+
+    def close(self):
+        pass
+
+# Error de un par que no responde o cuyo circuito está abierto. Es un ConnectionError (y OSError), así que
+# los manejadores existentes de errores de socket lo siguen atrapando
+class PeerUnavailableError(ConnectionError):
+    pass
+
+# Error de un par que rechazó el mensaje por sobrecarga (respondió `busy`). El par está vivo, así que no
+# cuenta para su cortacircuitos ni dispara una elección
+class PeerBusyError(ConnectionError):
+    pass
+
+# Estado de un par: RTT suavizado (algoritmo de Jacobson/Karels) y cortacircuitos
+class PeerState:
+    def __init__(self, reset_timeout):
+        self.outbound = None
+        self.srtt = None
+        self.rttvar = None
+        self.failures = 0
+        self.open_until = 0.0
+        self.reset_timeout = reset_timeout
+        self.probing = False
+        # Último intercambio exitoso con el par (reloj monótono), para no mandarle heart_beat si se sabe vivo
+        self.last_success = None
+        self.lock = threading.Lock()
+
+# Clase TRANSPORTE ENTRE NODOS: una conexión por mensaje (como el protocolo original) con
+#   - tiempos de espera por par derivados del RTT observado (srtt + 4 * rttvar, acotado)
+#   - reintentos con espera exponencial y jitter completo: siempre si falló la conexión y, si el mensaje
+#     es idempotente, también si falló la respuesta
+#   - un cortacircuitos por sucursal: tras `failure_threshold` llamadas fallidas seguidas (cada llamada cuenta
+#     una sola falla después de agotar sus reintentos) el par queda abierto durante `reset_timeout` segundos
+#     (que se duplica si la prueba siguiente falla) y las llamadas fallan al instante
+# El reloj y la función de conexión son intercambiables (la simulación pasa los de su red en memoria)
+class PeerTransport:
+    def __init__(self, address, metrics, retries=2, failure_threshold=3, reset_timeout=2.0, max_reset_timeout=30.0,
+                 min_timeout=0.2, max_timeout=5.0, initial_timeout=1.0, backoff_base=0.05, backoff_max=1.0,
+                 batching=True, max_batch=64, compress_threshold=1024, clock=None, connect=socket.create_connection):
+        self.address = address
+        self.clock = clock or RealClock()
+        self.connect = connect
+        self.metrics = metrics
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.initial_timeout = initial_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.batching = batching
+        self.max_batch = max_batch
+        self.compress_threshold = compress_threshold
+        self.peers = {}
+        self.lock = threading.Lock()
+
+        # Bytes y conexiones enviados (para medir bytes en la red por operación)
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        self.connections_opened = 0
+
+    def peer(self, ip):
+        state = self.peers.get(ip)
+        if state is None:
+            with self.lock:
+                state = self.peers.setdefault(ip, PeerState(self.reset_timeout))
+        return state
+
+    def timeout(self, state):
+        if state.srtt is None:
+            return self.initial_timeout
+        return min(max(state.srtt + 4 * state.rttvar, self.min_timeout), self.max_timeout)
+
+    def observe_rtt(self, state, rtt):
+        with state.lock:
+            if state.srtt is None:
+                state.srtt, state.rttvar = rtt, rtt / 2
+            else:
+                state.rttvar = 0.75 * state.rttvar + 0.25 * abs(state.srtt - rtt)
+                state.srtt = 0.875 * state.srtt + 0.125 * rtt
+
+    # Función para verificar el cortacircuitos antes de una llamada. Con el circuito abierto se falla al
+    # instante; al vencer el plazo se deja pasar una sola llamada de prueba (semiabierto)
+    def check_circuit(self, ip, state):
+        with state.lock:
+            if state.failures < self.failure_threshold:
+                return
+            if self.clock.monotonic() >= state.open_until and not state.probing:
+                state.probing = True
+                return
+        self.metrics.inc("nodo_peer_fast_failures_total", peer=ip)
+        raise PeerUnavailableError(f"Circuito abierto con el nodo ({ip})")
+
+    def record_success(self, state):
+        with state.lock:
+            state.last_success = self.clock.monotonic()
+            state.failures = 0
+            state.probing = False
+            state.reset_timeout = self.reset_timeout
+
+    def record_failure(self, ip, state):
+        with state.lock:
+            state.failures += 1
+            if state.probing:
+                state.probing = False
+                state.reset_timeout = min(state.reset_timeout * 2, self.max_reset_timeout)
+            if state.failures >= self.failure_threshold:
+                state.open_until = self.clock.monotonic() + state.reset_timeout
+                opened = True
+            else:
+                opened = False
+        if opened:
+            self.metrics.inc("nodo_peer_circuit_open_total", peer=ip)
+
+    # Función para enviar un mensaje a un par. `opcode` decide los reintentos y el tiempo de espera de la
+    # respuesta; reply_timeout=None espera sin límite (p. ej. acquire_permission espera el permiso).
+    # Con reply=False sólo se envía; con read_all se lee hasta que el par cierre la conexión
+    def request(self, ip, message, opcode, reply=True, reply_timeout=None, read_all=False):
+        payload = message.encode()
+        return self.exchange(ip, MESSAGE_HEADER.pack(MESSAGE_MARKER, len(payload)) + payload, opcode, 1, reply, reply_timeout, read_all)
+
+    def exchange(self, ip, payload, opcode, message_count=1, reply=True, reply_timeout=None, read_all=False):
+        state = self.peer(ip)
+        idempotent = opcode in IDEMPOTENT_OPCODES
+        adaptive_reply = opcode in FAST_REPLY_OPCODES
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                self.metrics.inc("nodo_peer_retries_total", peer=ip)
+                self.clock.sleep(self.clock.random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+            self.check_circuit(ip, state)
+
+            start = self.clock.perf_counter()
+            try:
+                client_socket = self.connect(self.address(ip), timeout=self.timeout(state))
+            except OSError as e:
+                last_error = e
+                if state.probing:
+                    # La llamada de prueba no se reintenta: el circuito vuelve a abrirse enseguida
+                    break
+                continue
+            connect_rtt = self.clock.perf_counter() - start
+
+            with self.lock:
+                self.bytes_sent += len(payload)
+                self.messages_sent += message_count
+                self.connections_opened += 1
+            try:
+                client_socket.sendall(payload)
+                if not reply:
+                    data = None
+                else:
+                    client_socket.settimeout(self.timeout(state) if adaptive_reply else reply_timeout)
+                    if read_all:
+                        chunks = []
+                        while True:
+                            chunk = client_socket.recv(65536)
+                            if not chunk:
+                                break
+                            chunks.append(chunk)
+                        data = b"".join(chunks).decode()
+                    else:
+                        data = client_socket.recv(1024).decode()
+                    if data == BUSY_REPLY.decode():
+                        # El par rechazó el mensaje sin ejecutarlo: se reintenta tras la espera aunque no sea idempotente
+                        self.metrics.inc("nodo_peer_busy_total", peer=ip)
+                        self.record_success(state)
+                        last_error = PeerBusyError(f"El nodo ({ip}) está sobrecargado y rechazó {opcode}")
+                        continue
+            except OSError as e:
+                last_error = e
+                if idempotent and not state.probing:
+                    continue
+                self.record_failure(ip, state)
+                raise PeerUnavailableError(f"El nodo ({ip}) no respondió a {opcode}. {e}") from e
+            finally:
+                client_socket.close()
+
+            self.observe_rtt(state, self.clock.perf_counter() - start if adaptive_reply else connect_rtt)
+            self.record_success(state)
+            return data
+        if isinstance(last_error, PeerBusyError):
+            raise last_error
+        self.record_failure(ip, state)
+        raise PeerUnavailableError(f"No se pudo comunicar con el nodo ({ip}). {last_error}") from last_error
+
+    # Función para enviar un mensaje sin respuesta agrupándolo con los demás que esperan para el mismo par.
+    # Un hilo por par vacía su cola y manda todo lo acumulado en una conexión (comprimido con zlib si el lote
+    # supera compress_threshold bytes). Devuelve un Future que se resuelve al entregar el lote
+    def send_batched(self, ip, message, opcode):
+        future = Future()
+        if not self.batching:
+            try:
+                future.set_result(self.request(ip, message, opcode, reply=False))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        state = self.peer(ip)
+        if state.outbound is None:
+            with state.lock:
+                if state.outbound is None:
+                    state.outbound = queue.Queue()
+                    threading.Thread(target=self.batch_loop, args=(ip, state.outbound), daemon=True).start()
+        state.outbound.put((message, opcode, future))
+        return future
+
+    def batch_loop(self, ip, outbound):
+        while True:
+            batch = [outbound.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(outbound.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if len(batch) == 1:
+                    message, opcode, _ = batch[0]
+                    self.request(ip, message, opcode, reply=False)
+                else:
+                    self.exchange(ip, self.encode_batch([message for message, _, _ in batch]), "batch", len(batch), reply=False)
+                    self.metrics.inc("nodo_batched_messages_total", len(batch), peer=ip)
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for _, _, future in batch:
+                future.set_result(None)
+
+    def encode_batch(self, messages):
+        body = b"".join(BATCH_ITEM.pack(len(item)) + item for item in (message.encode() for message in messages))
+        flags = 0
+        if self.compress_threshold and len(body) >= self.compress_threshold:
+            compressed = zlib.compress(body, 1)
+            if len(compressed) < len(body):
+                body, flags = compressed, BATCH_COMPRESSED
+        return BATCH_HEADER.pack(BATCH_MARKER, flags, len(body)) + body
+
+    @staticmethod
+    def decode_batch(flags, body):
+        if flags & BATCH_COMPRESSED:
+            body = zlib.decompress(body)
+        messages = []
+        offset = 0
+        while offset < len(body):
+            (length,) = BATCH_ITEM.unpack_from(body, offset)
+            offset += BATCH_ITEM.size
+            messages.append(body[offset:offset + length])
+            offset += length
+        return messages
+
+# Clase ANILLO DE HASH CONSISTENTE
+class HashRing:
+    def __init__(self, ids_sucursales, virtual_nodes=64):
+        self.ids_sucursales = tuple(sorted(ids_sucursales))
+        self.ring = sorted(
+            (self.hash_key(f"sucursal-{id_sucursal}-{i}"), id_sucursal)
+            for id_sucursal in self.ids_sucursales
+            for i in range(virtual_nodes)
+        )
+        self.hashes = [hash_value for hash_value, _ in self.ring]
+
+    @staticmethod
+    def hash_key(key):
+        return int(hashlib.md5(str(key).encode()).hexdigest()[:16], 16)
+
+    # Función para obtener las sucursales responsables de una llave, en el orden del anillo
+    def preference_list(self, key, count):
+        if not self.ring:
+            return []
+        result = []
+        index = bisect.bisect(self.hashes, self.hash_key(key))
+        for offset in range(len(self.ring)):
+            id_sucursal = self.ring[(index + offset) % len(self.ring)][1]
+            if id_sucursal not in result:
+                result.append(id_sucursal)
+                if len(result) == count:
+                    break
+        return result
+
+# Clase RELOJ REAL: tiempo, esperas y primitivas de sincronización del sistema operativo. El nodo las usa
+# a través de su reloj para que la simulación pueda reemplazarlas por tiempo virtual
+class RealClock:
+    simulated = False
+
+    def __init__(self):
+        self.random = random
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def perf_counter(self):
+        return time.perf_counter()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def Semaphore(self, value=1):
+        return threading.Semaphore(value)
+
+    def Condition(self):
+        return threading.Condition()
+
+# Error con el que se detienen las tareas de un nodo caído o de una simulación terminada. Hereda de
+# BaseException para que los `except Exception` del protocolo no lo atrapen
+class SimulationStopped(BaseException):
+    pass
+
+# Tarea de la simulación: un hilo que sólo corre cuando el planificador le pasa el turno
+class SimulatedTask:
+    __slots__ = ("owner", "resume", "token", "stopped", "finished")
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.resume = threading.Semaphore(0)
+        self.token = 0
+        self.stopped = False
+        self.finished = False
+
+# Clase RELOJ SIMULADO: planificador de tiempo virtual para correr varios nodos en un proceso. Cada tarea corre
+# en un hilo (los hilos libres se reutilizan), pero corre una sola a la vez: la tarea actual corre hasta que
+# duerme o se bloquea (en un semáforo o condición del reloj) y entonces el planificador despierta la siguiente
+# por (instante, orden de llegada). Con la misma semilla la ejecución se repite exactamente: el tiempo no
+# depende de la velocidad de la máquina
+class SimulatedClock:
+    simulated = True
+
+    def __init__(self, seed=0, epoch=1700000000.0):
+        self.random = random.Random(seed)
+        self.epoch = epoch
+        self.now = 0.0
+        self.queue = []
+        self.sequence = 0
+        self.current = None
+        self.baton = threading.Semaphore(0)
+        self.tasks = []
+        self.idle = []
+        self.errors = []
+
+    def time(self):
+        return self.epoch + self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def Semaphore(self, value=1):
+        return SimulatedSemaphore(self, value)
+
+    def Condition(self):
+        return SimulatedCondition(self)
+
+    # Función para despertar una tarea dentro de `delay` segundos. Una tarea puede tener varios despertares
+    # pendientes (p. ej. el del plazo y el de la señal): sólo vale el primero, los demás quedan vencidos
+    def schedule(self, task, delay=0.0):
+        self.sequence += 1
+        heapq.heappush(self.queue, (self.now + max(delay, 0.0), self.sequence, task.token, task))
+
+    # Función para ejecutar `function(*args)` en el planificador dentro de `delay` segundos (no debe bloquearse)
+    def call_later(self, delay, function, *args):
+        self.sequence += 1
+        heapq.heappush(self.queue, (self.now + max(delay, 0.0), self.sequence, None, (function, args)))
+
+    # Función para crear una tarea. `owner` agrupa las tareas de un nodo para detenerlas todas si se cae
+    def spawn(self, target, *args, owner=None):
+        task = SimulatedTask(owner)
+        self.tasks.append(task)
+        if self.idle:
+            inbox = self.idle.pop()
+        else:
+            inbox = queue.SimpleQueue()
+            threading.Thread(target=self.worker_loop, args=(inbox,), daemon=True).start()
+        inbox.put((task, target, args))
+        self.schedule(task)
+        return task
+
+    def worker_loop(self, inbox):
+        while True:
+            item = inbox.get()
+            if item is None:
+                return
+            task, target, args = item
+            task.resume.acquire()
+            try:
+                if not task.stopped:
+                    target(*args)
+            except SimulationStopped:
+                pass
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                task.finished = True
+                # El hilo queda libre antes de devolver el turno al planificador
+                self.idle.append(inbox)
+                self.baton.release()
+
+    # Función para ceder el turno hasta que la tarea actual vuelva a ser despertada
+    def park(self):
+        task = self.current
+        if task is None:
+            raise RuntimeError("Solo las tareas de la simulación pueden esperar en el reloj simulado")
+        if task.stopped:
+            raise SimulationStopped()
+        self.baton.release()
+        task.resume.acquire()
+        if task.stopped:
+            raise SimulationStopped()
+
+    def sleep(self, seconds):
+        self.schedule(self.current, seconds)
+        self.park()
+
+    # Función para avanzar la simulación hasta el instante `until` (o hasta que no quede nada por hacer)
+    def run(self, until=None):
+        while self.queue:
+            at, _, token, item = self.queue[0]
+            if until is not None and at > until:
+                break
+            heapq.heappop(self.queue)
+            self.now = max(self.now, at)
+            if token is None:
+                function, args = item
+                function(*args)
+                continue
+            if token != item.token or item.finished:
+                continue
+            item.token += 1
+            self.current = item
+            item.resume.release()
+            self.baton.acquire()
+            self.current = None
+        if until is not None:
+            self.now = max(self.now, until)
+        self.tasks = [task for task in self.tasks if not task.finished]
+
+    # Función para detener las tareas de un nodo (o todas): cada una termina con SimulationStopped
+    def stop(self, owner=None):
+        for task in self.tasks:
+            if not task.finished and (owner is None or task.owner is owner):
+                task.stopped = True
+                if owner is None:
+                    self.current = task
+                    task.resume.release()
+                    self.baton.acquire()
+                    self.current = None
+                else:
+                    self.schedule(task)
+        self.tasks = [task for task in self.tasks if not task.finished]
+        if owner is None:
+            for inbox in self.idle:
+                inbox.put(None)
+            self.idle = []
+
+# Semáforo del reloj simulado: quien no obtiene el permiso cede el turno hasta que se libere
+class SimulatedSemaphore:
+    def __init__(self, clock, value=1):
+        self.clock = clock
+        self.value = value
+        self.waiters = collections.deque()
+
+    def acquire(self, blocking=True, timeout=None):
+        if self.value > 0:
+            self.value -= 1
+            return True
+        if not blocking:
+            return False
+        task = self.clock.current
+        self.waiters.append(task)
+        if timeout is not None:
+            self.clock.schedule(task, timeout)
+        try:
+            self.clock.park()
+        finally:
+            acquired = task not in self.waiters
+            if not acquired:
+                self.waiters.remove(task)
+        return acquired
+
+    def release(self):
+        if self.waiters:
+            # El permiso pasa directamente a la primera tarea en espera
+            self.clock.schedule(self.waiters.popleft())
+        else:
+            self.value += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+# Condición del reloj simulado. Como corre una sola tarea a la vez no necesita candado
+class SimulatedCondition:
+    def __init__(self, clock):
+        self.clock = clock
+        self.waiters = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def notify_all(self):
+        for task in self.waiters:
+            self.clock.schedule(task)
+        self.waiters = []
+
+    def wait_for(self, predicate, timeout=None):
+        deadline = None if timeout is None else self.clock.now + timeout
+        result = predicate()
+        while not result:
+            if deadline is not None and self.clock.now >= deadline:
+                break
+            task = self.clock.current
+            self.waiters.append(task)
+            if deadline is not None:
+                self.clock.schedule(task, deadline - self.clock.now)
+            try:
+                self.clock.park()
+            finally:
+                if task in self.waiters:
+                    self.waiters.remove(task)
+            result = predicate()
+        return result
+
+# Conexión de la red simulada. El cliente la usa como un socket (sendall, settimeout, recv, close) y el
+# servidor recibe su otro extremo. Los datos de cada sentido llegan en orden, después de la latencia de la red
+class SimulatedConnection:
+    def __init__(self, network, source, target):
+        self.network = network
+        self.source = source
+        self.target = target
+        self.timeout = None
+        self.buffer = bytearray()
+        self.closed = False
+        self.reset = False
+        self.arrival = {"request": 0.0, "reply": 0.0}
+        self.arrived = network.clock.Condition()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def sendall(self, payload):
+        if self.reset:
+            raise ConnectionResetError("Conexión reiniciada por el nodo")
+        self.network.transmit(self, "request", self.network.deliver, self, bytes(payload))
+
+    def recv(self, size):
+        if not self.arrived.wait_for(lambda: self.buffer or self.closed or self.reset, self.timeout):
+            raise socket.timeout("timed out")
+        if self.buffer:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            return data
+        if self.reset:
+            raise ConnectionResetError("Conexión reiniciada por el nodo")
+        return b""
+
+    def close(self):
+        self.network.connections.pop(self, None)
+
+    # Funciones del planificador para entregar al cliente la respuesta, el cierre o el reinicio
+    def receive(self, data):
+        if data is None:
+            self.closed = True
+        else:
+            self.buffer += data
+        self.arrived.notify_all()
+
+    def abort(self):
+        self.reset = True
+        self.arrived.notify_all()
+
+# Extremo del servidor de una conexión simulada (lo que recibe handle_client)
+class SimulatedServerSocket:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def send(self, data):
+        self.connection.network.transmit(self.connection, "reply", self.connection.receive, bytes(data))
+        return len(data)
+
+    def sendall(self, data):
+        self.send(data)
+
+    def recv(self, size):
+        # El mensaje completo llega en la primera lectura
+        return b""
+
+    def close(self):
+        self.connection.network.transmit(self.connection, "reply", self.connection.receive, None)
+
+# Clase RED SIMULADA: conecta en memoria los nodos que comparten un reloj simulado. Cada segmento tarda
+# `latency` ± `jitter` segundos y se pierde con probabilidad `loss`: una conexión perdida vence su plazo
+# (el transporte la reintenta) y un dato perdido se retransmite tras `retransmit` segundos, como en TCP.
+# Con partition() los nodos de grupos distintos dejan de verse (sus mensajes se pierden sin aviso) y con
+# crash() un nodo se detiene: sus tareas terminan y sus conexiones abiertas se reinician
+class SimulatedNetwork:
+    def __init__(self, clock, latency=0.001, jitter=0.0005, loss=0.0, retransmit=0.2):
+        self.clock = clock
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.retransmit = retransmit
+        self.nodos = []
+        self.down = set()
+        self.groups = None
+        self.connections = {}
+
+    def attach(self, nodo):
+        self.nodos.append(nodo)
+
+    # Función para encontrar el nodo que escucha en una dirección (uno en ejecución si hay varios)
+    def find(self, address):
+        found = None
+        for nodo in self.nodos:
+            current = nodo.cluster.view.current
+            if current is not None and nodo.node_address(current.ip) == tuple(address):
+                if nodo not in self.down:
+                    return nodo
+                found = nodo
+        return found
+
+    def delay(self):
+        delay = self.latency + self.clock.random.uniform(-self.jitter, self.jitter)
+        while self.loss and self.clock.random.random() < self.loss:
+            delay += self.retransmit
+        return max(delay, 0.0)
+
+    def reachable(self, source, target):
+        if source in self.down or target in self.down:
+            return False
+        return self.groups is None or self.groups.get(source) == self.groups.get(target)
+
+    # Función para separar los nodos en grupos que no se ven entre sí (los nodos no listados forman otro grupo)
+    def partition(self, *groups):
+        self.groups = {nodo: index for index, group in enumerate(groups) for nodo in group}
+
+    def heal(self):
+        self.groups = None
+
+    def crash(self, nodo):
+        self.down.add(nodo)
+        self.clock.stop(owner=nodo)
+        for connection in list(self.connections):
+            if nodo in (connection.source, connection.target):
+                del self.connections[connection]
+                self.clock.call_later(self.delay(), connection.abort)
+
+    def recover(self, nodo):
+        self.down.discard(nodo)
+
+    # Función de conexión de un nodo, con la misma forma que socket.create_connection
+    def connector(self, nodo):
+        return functools.partial(self.connect, nodo)
+
+    def connect(self, source, address, timeout=None):
+        if source in self.down:
+            raise SimulationStopped()
+        target = self.find(address)
+        syn = self.latency + self.clock.random.uniform(-self.jitter, self.jitter)
+        if target is None or target in self.down:
+            # Nadie escucha: el rechazo vuelve en un viaje de ida y vuelta
+            self.clock.sleep(2 * syn)
+            raise ConnectionRefusedError(f"Conexión rechazada por {address[0]}:{address[1]}")
+        if not self.reachable(source, target) or (self.loss and self.clock.random.random() < self.loss):
+            self.clock.sleep(timeout if timeout is not None else self.retransmit)
+            raise socket.timeout("timed out")
+        self.clock.sleep(2 * syn)
+        connection = SimulatedConnection(self, source, target)
+        self.connections[connection] = None
+        return connection
+
+    # Función para enviar un segmento por un sentido de la conexión: llega en orden, después de los anteriores
+    def transmit(self, connection, direction, function, *args):
+        if not self.reachable(connection.source, connection.target):
+            return
+        arrival = max(connection.arrival[direction], self.clock.now + self.delay())
+        connection.arrival[direction] = arrival
+        self.clock.call_later(arrival - self.clock.now, function, *args)
+
+    # Función del planificador para entregar un mensaje al nodo destino: lo atiende una tarea nueva del nodo
+    def deliver(self, connection, payload):
+        if not self.reachable(connection.source, connection.target):
+            return
+        self.clock.spawn(connection.target.handle_client, SimulatedServerSocket(connection), payload, owner=connection.target)
+
 # Clase NODO
 class Nodo:
-    def __init__(self, db_path):
+    def __init__(self, db_path, sharded=False, replicas=1, anti_entropy_interval=30, metrics_enabled=False,
+                 tracing_enabled=False, trace_log_path=None, trace_buffer_size=10000, rebalance_interval=0,
+                 rebalance_rate=1.0, rebalance_batch=5, rebalance_tolerance=0.1, group_commit_size=64,
+                 group_commit_delay=0.0, peer_retries=2, breaker_threshold=3, breaker_reset=2.0, digest_votes=True,
+                 batch_messages=True, compress_threshold=1024, state_path=None, state_interval=5.0,
+                 control_in_flight=256, max_in_flight=16, bulk_in_flight=4, max_queued=64, control_queued=1024, backlog=128,
+                 clock=None, network=None, archive_directory=None, hot_months=3, archive_interval=3600,
+                 heartbeat_interval=1.0):
         self.db_path = db_path
-        self.connection = sqlite3.connect(db_path)
+        self.metrics = Metrics(metrics_enabled)
+        self.profiler = Profiler()
+
+        # Reloj y red del nodo: los del sistema operativo o, en una simulación, un reloj virtual y una red en
+        # memoria compartidos por todos los nodos del proceso (sin lotes ni hilo escritor, que esperan fuera del reloj)
+        self.clock = clock or RealClock()
+        self.network = network
+        if network is not None:
+            network.attach(self)
+
+        # Copia en memoria de SUCURSAL, al día con los cambios que confirma cualquier conexión del nodo
+        self.cluster = ClusterState()
+        self.connection = self.connect_db()
         self.cursor = self.connection.cursor()
+        try:
+            self.cluster.load(self.connection)
+        except sqlite3.OperationalError:
+            # Base nueva: el estado se carga al crear las tablas
+            pass
 
-        self.semaphore_mutual_exclusion = threading.Semaphore()
-        self.semaphore_consensus = threading.Semaphore()
-        self.semaphore_consensus_completion = threading.Semaphore()
+        # Particiones mensuales de GUIA_ENVIO y archivo comprimido de los meses fríos
+        self.guia_envio = ShipmentPartitions(archive_directory or os.path.splitext(db_path)[0] + "_archivo", hot_months)
+        self.guia_envio.load(self.cursor)
+        self.archive_interval = archive_interval
+        self.transport = PeerTransport(self.node_address, self.metrics, peer_retries, breaker_threshold, breaker_reset,
+                                       batching=batch_messages and not self.clock.simulated, compress_threshold=compress_threshold,
+                                       clock=self.clock, connect=network.connector(self) if network is not None else socket.create_connection)
+
+        # Control de admisión de los mensajes entrantes: cupo de mensajes en curso y cola por clase de prioridad.
+        # La cola de control es mucho más larga que las otras: con una sola escritura a la vez en el clúster sus
+        # mensajes en espera son del orden del número de nodos, y el límite sólo corta a un par que inunda al
+        # nodo. Un mensaje de control sin respuesta (p. ej. dentro de un lote) que se rechaza se pierde y lo
+        # repara la anti-entropía
+        self.admission = AdmissionController({"control": control_in_flight, "normal": max_in_flight, "bulk": bulk_in_flight},
+                                             {"control": control_queued, "normal": max_queued, "bulk": max_queued},
+                                             self.metrics)
+        self.backlog = backlog
+
+        # Votos de consenso con el resumen (digest) de la propuesta en lugar del mensaje completo
+        self.digest_votes = digest_votes
+
+        # Todas las operaciones replicadas se aplican a través del pipeline de commits agrupados
+        self.apply_pipeline = ApplyPipeline(functools.partial(self.connect_db, group_commit=True), self.apply_operation_in_context,
+                                            self.metrics, group_commit_size, group_commit_delay, inline=self.clock.simulated)
+
+        # Exclusión mutua de escritura del maestro y pedidos que esperan su turno (ver request_mutual_exclusion)
+        self.semaphore_mutual_exclusion = self.clock.Semaphore()
+        self.mutual_exclusion_lock = threading.Lock()
+        self.mutual_exclusion_waiters = collections.deque()
+
+        # Votos y confirmaciones recibidos en la ronda de consenso en curso (se esperan con la condición)
+        self.consensus_condition = self.clock.Condition()
 
         self.active_nodes_count = 0
         self.consensus_node_count = 0
         self.consensus_completion_count = 0
+        # Rondas de consenso que este nodo recibió y todavía no terminó de aplicar (ver run_anti_entropy)
+        self.rounds_in_flight = 0
 
-        self.first_branch_consensus = None
-        self.second_branch_consensus = None
-        self.third_branch_consensus = None
-        self.fourth_branch_consensus = None
-        self.fifth_branch_consensus = None
+        # Votos (resúmenes de la propuesta) de la ronda de consenso en curso, por sucursal
+        self.votes = VoteTable(max(self.cluster.view.branches, default=5))
 
         self.is_running = True
 
+        # Modo particionado: los artículos (y sus guías) sólo viven en su sucursal dueña más R réplicas
+        self.sharded = sharded
+        self.replicas = replicas
+        self.hash_ring = None
+        # Última escritura shard_write aplicada (permiso, operación), para no repetirla si se reintenta, y espacio
+        # usado (sucursal, espacio) de la dueña del último artículo creado, que se le informa al maestro
+        self.shard_write_lock = threading.Lock()
+        self.last_shard_write = None
+        self.shard_usage = None
+
+        # Modo particionado: check_active_nodes no manda heart_beat a los pares con los que hubo un intercambio
+        # exitoso en los últimos `heartbeat_interval` segundos
+        self.heartbeat_interval = heartbeat_interval
+
+        # Anti-entropía: árboles de Merkle con 2^profundidad rangos de filas por tabla
+        self.anti_entropy_interval = anti_entropy_interval
+        self.merkle_depth = 8
+        self.merkle_cache = {}
+        self.capacity_tracker = None
+        self.semaphore_merkle_cache = threading.Semaphore()
+
+        # Rebalanceo en segundo plano (sólo en el maestro): mueve hasta `rebalance_batch` artículos por ronda,
+        # a no más de `rebalance_rate` artículos por segundo, hacia la utilización global de las sucursales
+        self.rebalance_interval = rebalance_interval
+        self.rebalance_rate = rebalance_rate
+        self.rebalance_batch = rebalance_batch
+        self.rebalance_tolerance = rebalance_tolerance
+        self.rebalance_tokens = 0.0
+
+        # Índice de replicación: el maestro numera cada permiso de exclusión mutua (grant_index) y guarda el
+        # último permiso que terminó con una escritura replicada a todos los nodos (last_write_index). Cada
+        # nodo guarda el mayor índice que aplicó (applied_index) y desde cuándo sabe que está al día (synced_at)
+        self.grant_index = 0
+        self.last_write_index = 0
+        self.write_index = None
+        self.lock_wrote = False
+        self.applied_index = 0
+        self.synced_at = 0.0
+        self.applied_condition = self.clock.Condition()
+
+        # Un solo escritor a la vez en este nodo: write_index, lock_wrote y shard_usage son de la escritura en
+        # curso, desde acquire_permission hasta el final de release_permission (o de una ronda de run_rebalance)
+        self.semaphore_writer = self.clock.Semaphore()
+        self.permission_acquired_at = None
+
+        # Archivo de estado para el arranque en caliente (índices de replicación, membresía y RTT de los pares)
+        self.state_path = state_path
+        self.state_interval = state_interval
+        self.semaphore_state = threading.Semaphore()
+
+        # Trazado distribuido: el contexto (trace_id, span_id) viaja como prefijo de cada mensaje entre nodos
+        # y los spans terminados se guardan en un buffer circular (y opcionalmente en un log JSONL)
+        self.tracing_enabled = tracing_enabled or trace_log_path is not None
+        self.trace_context = threading.local()
+        self.trace_buffer = collections.deque(maxlen=trace_buffer_size)
+        self.trace_log = open(trace_log_path, "a", buffering=1) if trace_log_path else None
+        self.semaphore_trace_log = threading.Semaphore()
+        self.trace_node = None
+
     # Función que se ejecutará cuando se reciba una interrupción (Ctrl+C o Ctrl+Z)
     def signal_handler(self, sig, frame):
         print("\n")
+        self.save_state(clean=True)
         sys.exit(1)
 
     # Función que se ejecutará cuando se reciba la señal Ctrl+Z
     def signal_stop_handler(self, sig, frame):
         print("\n")
+        self.save_state(clean=True)
         sys.exit(1)
 
+    # Función para abrir una conexión a la base de datos local (con medición de sentencias si hay métricas).
+    # group_commit abre la conexión del escritor del pipeline, donde sólo group_commit() confirma. En una
+    # simulación las tareas son hilos distintos que nunca corren a la vez, así que comparten las conexiones
+    @timed("connect_db")
+    def connect_db(self, group_commit=False):
+        check_same_thread = not self.clock.simulated
+        if not self.metrics.enabled:
+            connection = sqlite3.connect(self.db_path, factory=GroupCommitConnection if group_commit else ClusterStateConnection,
+                                         check_same_thread=check_same_thread)
+        else:
+            connection = sqlite3.connect(self.db_path, factory=MetricsGroupCommitConnection if group_commit else MetricsConnection,
+                                         check_same_thread=check_same_thread)
+            connection.metrics = self.metrics
+        self.cluster.attach(connection)
+        return connection
+
+    # Función para aplicar una operación replicada en el nodo actual y esperar a que sea durable
+    @timed("apply_local")
+    def apply_local(self, operation):
+        context = getattr(self.trace_context, "current", None) if self.tracing_enabled else None
+        return self.apply_pipeline.submit(operation, context).result()
+
+    # Función para registrar que el nodo aplicó la escritura replicada con el índice dado. Al aplicarla el nodo
+    # está al día: la siguiente escritura no puede terminar antes de que ésta se confirme en todos los nodos
+    def mark_applied(self, index):
+        if index is None:
+            return
+        with self.applied_condition:
+            self.applied_index = max(self.applied_index, index)
+            self.synced_at = self.clock.time()
+            self.applied_condition.notify_all()
+
+    # Función del maestro para atender una lectura del índice de replicación: espera a que termine la escritura
+    # en curso (tomando y soltando la exclusión mutua) y devuelve el índice de la última escritura completa.
+    # Cada lectura linearizable (o bounded fuera de su margen) pasa así por la exclusión mutua de escritura: con
+    # el clúster en reposo la toma enseguida, pero con escrituras en curso espera hasta una ronda de consenso
+    # completa y compite con los escritores que esperan el permiso
+    def read_index(self):
+        with self.metrics.timer("nodo_read_index_seconds"):
+            granted = self.clock.Semaphore(0)
+            self.request_mutual_exclusion(lambda: granted.release())
+            granted.acquire()
+        return self.last_write_index
+
+    # Función del maestro para pedir la exclusión mutua sin bloquearse: si está libre se toma y se llama
+    # enseguida a `grant`; si no, `grant` queda en la cola y lo llama quien la suelte. `grant` corre con la
+    # exclusión mutua tomada y devuelve True si el solicitante se la queda (la soltará con release_mutual_exclusion)
+    # o un valor falso si ya terminó con ella o no la pudo recibir. Así un manejador de mensajes no ocupa un
+    # cupo de admisión mientras espera su turno
+    def request_mutual_exclusion(self, grant):
+        with self.mutual_exclusion_lock:
+            if not self.semaphore_mutual_exclusion.acquire(blocking=False):
+                self.mutual_exclusion_waiters.append(grant)
+                return
+        if not grant():
+            self.release_mutual_exclusion()
+
+    # Función para soltar la exclusión mutua del maestro. Con pedidos en espera pasa directamente al primero sin
+    # liberar el semáforo, así los pedidos que no esperan (try_permission, el rebalanceo) no se les adelantan
+    def release_mutual_exclusion(self):
+        while True:
+            with self.mutual_exclusion_lock:
+                if not self.mutual_exclusion_waiters:
+                    self.semaphore_mutual_exclusion.release()
+                    return
+                grant = self.mutual_exclusion_waiters.popleft()
+            if grant():
+                return
+
+    # Función para cumplir el nivel de consistencia pedido antes de una lectura local
+    @timed("ensure_read_consistency")
+    def ensure_read_consistency(self, consistency="local", max_staleness=1.0, timeout=10.0):
+        if consistency not in READ_CONSISTENCY_LEVELS:
+            raise ValueError(f"Nivel de consistencia desconocido: {consistency}")
+        if consistency == "local":
+            return
+        if consistency == "bounded" and self.clock.time() - self.synced_at <= max_staleness:
+            self.metrics.inc("nodo_reads_total", consistency=consistency, path="local")
+            return
+
+        requested_at = self.clock.time()
+        master = self.cluster.view.master
+        if master.nodo_actual == 1:
+            index = self.read_index()
+        else:
+            index = int(self.call(master.ip, "read_index", reply_timeout=timeout))
+
+        with self.applied_condition:
+            if not self.applied_condition.wait_for(lambda: self.applied_index >= index, timeout):
+                raise TimeoutError(f"El nodo aplicó hasta el índice {self.applied_index} y el maestro está en {index}")
+            self.synced_at = max(self.synced_at, requested_at)
+        self.metrics.inc("nodo_reads_total", consistency=consistency, path="read_index")
+
+    # Función del hilo escritor del pipeline: aplica la operación dentro del contexto de trazado de quien la encoló
+    def apply_operation_in_context(self, cursor, operation, context):
+        self.trace_context.current = context
+        try:
+            return self.apply_operation(cursor, operation)
+        finally:
+            self.trace_context.current = None
+
+    # Función para iniciar un span hijo del contexto actual (o la raíz de una nueva traza)
+    def start_span(self, name):
+        parent = getattr(self.trace_context, "current", None)
+        trace_id = parent[0] if parent else "%032x" % random.getrandbits(128)
+        span_id = "%016x" % random.getrandbits(64)
+        self.trace_context.current = (trace_id, span_id)
+        return (trace_id, span_id, parent[1] if parent else None, name, self.clock.time(), self.clock.perf_counter(), parent)
+
+    def finish_span(self, span):
+        trace_id, span_id, parent_id, name, start_wall, start, parent = span
+        self.trace_context.current = parent
+        if self.trace_node is None:
+            current = self.cluster.view.current
+            self.trace_node = current.id_sucursal if current is not None else self.db_path
+        record = {
+            "trace_id": trace_id,
+            "span_id": span_id,
+            "parent_id": parent_id,
+            "name": name,
+            "node": self.trace_node,
+            "start": start_wall,
+            "duration": self.clock.perf_counter() - start
+        }
+        self.trace_buffer.append(record)
+        if self.trace_log is not None:
+            with self.semaphore_trace_log:
+                self.trace_log.write(json.dumps(record) + "\n")
+
+    @contextlib.contextmanager
+    def span(self, name):
+        if not self.tracing_enabled:
+            yield
+            return
+        current_span = self.start_span(name)
+        try:
+            yield
+        finally:
+            self.finish_span(current_span)
+
+    # Función para agregar el contexto de trazado actual a un mensaje saliente
+    def trace_message(self, message):
+        current = getattr(self.trace_context, "current", None) if self.tracing_enabled else None
+        if current is None:
+            return message
+        return f"trace:{current[0]}:{current[1]} {message}"
+
+    # Función para enviar un mensaje a otro nodo a través del transporte (con el contexto de trazado actual)
+    @timed("call")
+    def call(self, ip, message, reply=True, reply_timeout=None, read_all=False):
+        opcode = message.split('|', 1)[0].split('-', 1)[0]
+        return self.transport.request(ip, self.trace_message(message), opcode, reply, reply_timeout, read_all)
+
+    # Función para enviar un mensaje sin respuesta a varios nodos a la vez (agrupado por par) y esperar la entrega
+    @timed("send_to_nodes")
+    def send_to_nodes(self, ips, message):
+        opcode = message.split('|', 1)[0].split('-', 1)[0]
+        futures = [self.transport.send_batched(ip, self.trace_message(message), opcode) for ip in ips]
+        for future in futures:
+            future.result()
+
+    # Función para obtener el resumen de una propuesta de consenso (los votos pueden traer el resumen o el mensaje)
+    @staticmethod
+    def vote_digest(vote):
+        if vote.startswith("digest:"):
+            return vote[len("digest:"):]
+        return hashlib.sha1(vote.encode()).hexdigest()[:20]
+
+    # Función para separar el contexto de trazado de un mensaje entrante y adoptarlo en el hilo actual
+    def extract_trace_context(self, data):
+        self.trace_context.current = None
+        if data.startswith("trace:"):
+            header, data = data.split(" ", 1)
+            _, trace_id, span_id = header.split(":")
+            self.trace_context.current = (trace_id, span_id)
+        return data
+
     # Función para manejar la comunicación con un nodo remoto
-    def handle_client(self, client_socket):
+    def handle_client(self, client_socket, raw):
+        if raw[:1] == BATCH_MARKER:
+            self.handle_batch(client_socket, raw)
+        else:
+            self.handle_message(client_socket, raw)
+
+    # Función para atender un lote: cada mensaje pasa por el control de admisión como si hubiera llegado en su
+    # propia conexión (los mensajes de consenso se esperan entre sí, así que no se atienden en orden)
+    def handle_batch(self, client_socket, raw):
         try:
-            data = client_socket.recv(1024).decode()
+            while len(raw) < BATCH_HEADER.size:
+                chunk = client_socket.recv(65536)
+                if not chunk:
+                    return
+                raw += chunk
+            _, flags, length = BATCH_HEADER.unpack_from(raw)
+            body = bytearray(raw[BATCH_HEADER.size:])
+            while len(body) < length:
+                chunk = client_socket.recv(65536)
+                if not chunk:
+                    return
+                body += chunk
+            for message in PeerTransport.decode_batch(flags, bytes(body)):
+                self.admit(NullSocket(), message)
+        except (OSError, zlib.error, struct.error) as e:
+            print(f"\n>> Error def handle_batch: {e} \n")
+        finally:
+            client_socket.close()
+
+    # Función para leer el resto de un mensaje con longitud (ver MESSAGE_MARKER). Devuelve el mensaje sin el
+    # encabezado o None si el par cerró la conexión antes de completarlo
+    @staticmethod
+    def read_framed_message(client_socket, raw):
+        while len(raw) < MESSAGE_HEADER.size:
+            chunk = client_socket.recv(65536)
+            if not chunk:
+                return None
+            raw += chunk
+        _, length = MESSAGE_HEADER.unpack_from(raw)
+        message = bytearray(raw[MESSAGE_HEADER.size:])
+        while len(message) < length:
+            chunk = client_socket.recv(65536)
+            if not chunk:
+                return None
+            message += chunk
+        return bytes(message)
+
+    # Función para atender un mensaje de otro nodo. El opcode (antes del primer '|' y sin el sufijo "-id") se
+    # busca en MESSAGE_HANDLERS; los mensajes desconocidos o con otro número de campos se ignoran
+    @timed("handle_message")
+    def handle_message(self, client_socket, raw):
+        opcode = None
+        deferred = False
+        server_span = None
+        start = self.clock.perf_counter()
+        try:
+            if raw[:1] == MESSAGE_MARKER:
+                raw = self.read_framed_message(client_socket, raw)
+                if raw is None:
+                    return
+            data = self.extract_trace_context(raw.decode())
             if data:
-                local_connection = sqlite3.connect(self.db_path)
-                cursor = local_connection.cursor()
-                parts_aux = data.split('|')
-
-                if data == 'acquire_permission':
-                    self.semaphore_mutual_exclusion.acquire()
-                    client_socket.send("authorized_permission".encode())
-                elif data == 'release_permission':
-                    self.semaphore_mutual_exclusion.release()
-                elif data == 'consensus_over':
-                    with self.semaphore_consensus_completion:
-                        self.consensus_completion_count +=1
-                elif data == 'heart_beat':
-                    client_socket.send("still_here".encode())
-                elif data == 'distribute_new_article':
-                    id_branch = self.automatic_distribution_new_article(cursor)
-                    client_socket.send(f"{id_branch}".encode())
-                elif data.startswith("continue_consensus"):
-                    continue_consensus_parts = data.split("|", 1)
-                    continue_first_part = continue_consensus_parts[0]
-                    continue_second_part = continue_consensus_parts[1]
-                    parts_id_continue_node = continue_first_part.split("-", 1)
-                    id_continue_node = int(parts_id_continue_node[1])
-                    print(">>         Consenso: Nodo ID: ",id_continue_node," - Message: ",continue_second_part)
-
-                    if id_continue_node == 1:
-                        self.first_branch_consensus = continue_second_part
-                    elif id_continue_node == 2:
-                        self.second_branch_consensus = continue_second_part
-                    elif id_continue_node == 3:
-                        self.third_branch_consensus = continue_second_part
-                    elif id_continue_node == 4:
-                        self.fourth_branch_consensus = continue_second_part
-                    elif id_continue_node == 5:
-                        self.fifth_branch_consensus = continue_second_part
-
-                    with self.semaphore_consensus:
-                        self.consensus_node_count +=1
-                
-                elif data.startswith("start_consensus"):
-                    start_consensus_parts = data.split("|", 1)
-                    start_first_part = start_consensus_parts[0]
-                    start_second_part = start_consensus_parts[1]
-                    parts_id_start_node = start_first_part.split("-", 1)
-                    id_start_node = int(parts_id_start_node[1])
-                    print("\n\n>> Consenso: Nodo inicial ID: ",id_start_node," - Message: ",start_second_part)
-
-                    if id_start_node == 1:
-                        self.first_branch_consensus = start_second_part
-                    elif id_start_node == 2:
-                        self.second_branch_consensus = start_second_part
-                    elif id_start_node == 3:
-                        self.third_branch_consensus = start_second_part
-                    elif id_start_node == 4:
-                        self.fourth_branch_consensus = start_second_part
-                    elif id_start_node == 5:
-                        self.fifth_branch_consensus = start_second_part
-
-                    self.consensus_node_count +=1
-                    self.send_messages_to_nodes_continue_consensus(cursor, id_start_node, start_second_part)
-                    self.active_nodes_count = int(self.get_active_nodes_count(cursor)) - 1
-                    while self.consensus_node_count < self.active_nodes_count:
-                        pass
-                    
-                    time.sleep(1)
-                    print("\n")
-
-                    cadenas = [
-                        self.first_branch_consensus,
-                        self.second_branch_consensus,
-                        self.third_branch_consensus,
-                        self.fourth_branch_consensus,
-                        self.fifth_branch_consensus
-                    ]
-
-                    cadenas_no_none = [cadena for cadena in cadenas if cadena is not None]
-                    cadena_mas_repetida = Counter(cadenas_no_none).most_common(1)[0][0]
-                    parts = cadena_mas_repetida.split('|')
-
-                    if parts[0] == 'create_cliente' and len(parts) == 5:
-                        usuario, nombre, direccion, tarjeta = parts[1:]
-                        self.create_cliente(cursor, usuario, nombre, direccion, int(tarjeta))
-                    elif parts[0] == 'update_cliente' and len(parts) == 5:
-                        usuario, nombre, direccion, tarjeta = parts[1:]
-                        self.update_cliente(cursor, usuario, nombre, direccion, int(tarjeta))
-                    elif parts[0] == 'activate_cliente' and len(parts) == 2:
-                        usuario = parts[1]
-                        self.activate_cliente(cursor, usuario)
-                    elif parts[0] == 'deactivate_cliente' and len(parts) == 2:
-                        usuario = parts[1]
-                        self.deactivate_cliente(cursor, usuario)
-                    elif parts[0] == 'create_articulo' and len(parts) == 5:
-                        codigo, nombre, precio, id_sucursal = parts[1:]
-                        self.create_articulo(cursor, int(codigo), nombre, float(precio), int(id_sucursal))
-                    elif parts[0] == 'update_articulo' and len(parts) == 4:
-                        codigo, nombre, precio = parts[1:]
-                        self.update_articulo(cursor, int(codigo), nombre, float(precio))
-                    elif parts[0] == 'restock_articulo' and len(parts) == 2:
-                        codigo = parts[1]
-                        self.restock_articulo(cursor, int(codigo))
-                    elif parts[0] == 'deactivate_articulo' and len(parts) == 2:
-                        codigo = parts[1]
-                        self.deactivate_articulo(cursor, int(codigo))
-                    elif parts[0] == 'create_guia_envio' and len(parts) == 7:
-                        id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra = parts[1:]
-                        self.create_guia_envio(cursor, int(id_cliente), int(id_articulo), int(id_sucursal), int(serie), float(monto_total), fecha_compra)
-
-                    self.consensus_node_count = 0
-
-                    self.first_branch_consensus = None
-                    self.second_branch_consensus = None
-                    self.third_branch_consensus = None
-                    self.fourth_branch_consensus = None
-                    self.fifth_branch_consensus = None
-
-                    ip_start_node = self.get_start_consensus_sucursal_ip(cursor, id_start_node)
-                    self.send_message_to_node(ip_start_node, "consensus_over")
-                    
-                elif parts_aux[0] == 'new_master_node' and len(parts_aux) == 3:
-                    old_master, new_master = parts_aux[1:]
-                    self.update_master_node_status(cursor, int(old_master), int(new_master))
-                    client_socket.send("new_master_updated".encode())
-
-                elif parts_aux[0] == 'node_failure' and len(parts_aux) == 2:
-                    id = parts_aux[1]
-                    self.update_node_failure(cursor, id)
-
-                    nodes_ips = self.get_ip_active_nodes_less_master(cursor)
-                    message = f"node_failure_node_active|{id}"
-                    for ip in nodes_ips:
-                        self.send_message_node_failure_node_active(ip, message)
-                    client_socket.send("master_node_failure_updated".encode())
-
-                elif parts_aux[0] == 'node_failure_node_active' and len(parts_aux) == 2:
-                    id = parts_aux[1]
-                    self.update_node_failure(cursor, id)
-                    client_socket.send("node_failure_updated".encode())
-
-                cursor.close()
-                local_connection.close()
+                parts = data.split('|')
+                opcode = parts[0].split('-', 1)[0]
+                entry = MESSAGE_HANDLERS.get(opcode)
+                if entry is None or (entry.arity is not None and len(parts) != entry.arity):
+                    return
+                fields = entry.decode(parts) if entry.arity is not None else ()
+                local_connection = self.connect_db() if entry.database else None
+                cursor = local_connection.cursor() if local_connection is not None else None
+                if self.tracing_enabled and self.trace_context.current is not None:
+                    server_span = self.start_span(f"handle:{opcode}")
+
+                deferred = entry.handler(self, client_socket, cursor, data, *fields) is DEFERRED_REPLY
+
+                if local_connection is not None:
+                    cursor.close()
+                    local_connection.close()
         except Exception as e:
+            self.metrics.inc("nodo_request_errors_total", opcode=opcode)
             print(f"\n>> Error def handle_client: {e} \n")
         finally:
-            client_socket.close()
+            if not deferred:
+                client_socket.close()
+            if server_span is not None:
+                self.finish_span(server_span)
+            self.trace_context.current = None
+            if opcode is not None:
+                self.metrics.inc("nodo_requests_total", opcode=opcode)
+                self.metrics.observe("nodo_request_seconds", self.clock.perf_counter() - start, opcode=opcode)
+
+    # Manejadores de los mensajes entre nodos (ver message_handler). Reciben el socket del cliente, un cursor de
+    # la base de datos local (None si el mensaje no se registró con database=True), el mensaje y sus campos
+    # acquire_permission: la respuesta se difiere hasta que llega el turno del solicitante (ver
+    # request_mutual_exclusion); el manejador vuelve enseguida y libera su cupo de admisión
+    @message_handler("acquire_permission")
+    def handle_acquire_permission(self, client_socket, cursor, data):
+        requested_at = self.clock.perf_counter()
+
+        def grant():
+            try:
+                self.metrics.observe("nodo_lock_wait_seconds", self.clock.perf_counter() - requested_at, side="maestro")
+                client_socket.send(f"authorized_permission|{self.grant_index + 1}".encode())
+            except OSError:
+                # El solicitante ya no espera (venció su plazo o se cayó): el turno pasa al siguiente
+                return False
+            finally:
+                client_socket.close()
+            self.grant_index += 1
+            return True
+
+        self.request_mutual_exclusion(grant)
+        return DEFERRED_REPLY
+
+    # try_permission: como acquire_permission pero sin esperar ni consumir un índice de escritura. La anti-entropía
+    # lo pide para reparar sólo cuando no hay una ronda de consenso en curso y lo devuelve con release_permission|0|0
+    @message_handler("try_permission", priority="control")
+    def handle_try_permission(self, client_socket, cursor, data):
+        if not self.semaphore_mutual_exclusion.acquire(blocking=False):
+            client_socket.send("permission_busy".encode())
+            return
+        try:
+            client_socket.send("authorized_repair".encode())
+        except OSError:
+            self.release_mutual_exclusion()
+            raise
+
+    # release_permission|indice|escribió[|sucursal|espacio]: el solicitante ya replicó y aplicó su escritura. En modo
+    # particionado trae el espacio usado de la dueña del artículo que creó (ver replicate_articulo)
+    @message_handler("release_permission", raw=True, priority="control")
+    def handle_release_permission(self, client_socket, cursor, data):
+        parts = data.split('|')
+        try:
+            if len(parts) >= 3 and parts[2] == '1':
+                self.last_write_index = max(self.last_write_index, int(parts[1]))
+            if len(parts) == 5:
+                self.apply_local(f"set_espacio_usado|{parts[3]}|{parts[4]}")
+        finally:
+            self.release_mutual_exclusion()
+
+    # read_index: como acquire_permission, responde cuando le llega el turno y suelta la exclusión mutua enseguida
+    @message_handler("read_index")
+    def handle_read_index(self, client_socket, cursor, data):
+        requested_at = self.clock.perf_counter()
+
+        def grant():
+            try:
+                self.metrics.observe("nodo_read_index_seconds", self.clock.perf_counter() - requested_at)
+                client_socket.send(f"{self.last_write_index}".encode())
+            except OSError:
+                pass
+            finally:
+                client_socket.close()
+
+        self.request_mutual_exclusion(grant)
+        return DEFERRED_REPLY
+
+    @message_handler("consensus_over", priority="control")
+    def handle_consensus_over(self, client_socket, cursor, data):
+        with self.consensus_condition:
+            self.consensus_completion_count +=1
+            self.consensus_condition.notify_all()
+
+    # heart_beat: en modo particionado la respuesta trae el espacio usado de esta sucursal (still_here|espacio)
+    @message_handler("heart_beat", priority="control")
+    def handle_heart_beat(self, client_socket, cursor, data):
+        current = self.cluster.view.current
+        if self.sharded and current is not None:
+            client_socket.send(f"still_here|{current.espacio_usado}".encode())
+        else:
+            client_socket.send("still_here".encode())
+
+    @message_handler("metrics", priority="bulk")
+    def handle_metrics(self, client_socket, cursor, data):
+        client_socket.sendall(self.metrics.render().encode())
+
+    # traces[|trace_id]: spans del buffer circular (todos o los de una traza)
+    @message_handler("traces", raw=True, priority="bulk")
+    def handle_traces(self, client_socket, cursor, data):
+        parts = data.split('|')
+        spans = [span for span in self.trace_buffer if len(parts) == 1 or span["trace_id"] == parts[1]]
+        client_socket.sendall(json.dumps(spans).encode())
+
+    # profile|segundos|intervalo: perfila el nodo durante la ventana pedida y responde las pilas colapsadas y los
+    # tiempos de los métodos marcados con @timed. Es de fondo porque ocupa su hilo durante toda la ventana
+    @message_handler("profile", float, float, priority="bulk")
+    def handle_profile(self, client_socket, cursor, data, seconds, interval):
+        result = self.profiler.profile(min(seconds, PROFILE_MAX_SECONDS), max(interval, PROFILE_MIN_INTERVAL))
+        if result is None:
+            client_socket.send("profile_busy".encode())
+            return
+        result["node"] = self.get_current_sucursal_id()
+        client_socket.sendall(json.dumps(result).encode())
+
+    @message_handler("distribute_new_article", priority="control")
+    def handle_distribute_new_article(self, client_socket, cursor, data):
+        id_branch = self.automatic_distribution_new_article(cursor)
+        client_socket.send(f"{id_branch}".encode())
+
+    # continue_consensus-id|operación: voto de otro participante
+    @message_handler("continue_consensus", raw=True, priority="control")
+    @timed("continue_consensus")
+    def handle_continue_consensus(self, client_socket, cursor, data):
+        continue_consensus_parts = data.split("|", 1)
+        continue_first_part = continue_consensus_parts[0]
+        continue_second_part = continue_consensus_parts[1]
+        parts_id_continue_node = continue_first_part.split("-", 1)
+        id_continue_node = int(parts_id_continue_node[1])
+        print(">>         Consenso: Nodo ID: ",id_continue_node," - Message: ",continue_second_part)
+
+        self.votes.set(id_continue_node, bytes.fromhex(self.vote_digest(continue_second_part)))
+
+        with self.consensus_condition:
+            self.consensus_node_count +=1
+            self.consensus_condition.notify_all()
+
+    # start_consensus-id-indice|operación: propuesta del nodo que tiene la exclusión mutua
+    @message_handler("start_consensus", raw=True, priority="control")
+    @timed("start_consensus")
+    def handle_start_consensus(self, client_socket, cursor, data):
+        start_consensus_parts = data.split("|", 1)
+        start_first_part = start_consensus_parts[0]
+        start_second_part = start_consensus_parts[1]
+        parts_id_start_node = start_first_part.split("-")
+        id_start_node = int(parts_id_start_node[1])
+        write_index = int(parts_id_start_node[2]) if len(parts_id_start_node) > 2 else None
+        consensus_start = self.clock.perf_counter()
+        print("\n\n>> Consenso: Nodo inicial ID: ",id_start_node," - Message: ",start_second_part)
+
+        # El nodo inicial espera el consensus_over de cada participante con la exclusión mutua tomada: se envía
+        # y se limpia el estado de la ronda aunque falle la votación o la aplicación (p. ej. una restricción
+        # violada o un error del pipeline); la réplica que no aplicó la repara la anti-entropía
+        with self.consensus_condition:
+            self.rounds_in_flight += 1
+        try:
+            proposal_digest = bytes.fromhex(self.vote_digest(start_second_part))
+            self.votes.set(id_start_node, proposal_digest)
+
+            self.consensus_node_count +=1
+            self.send_messages_to_nodes_continue_consensus(cursor, id_start_node, start_second_part)
+            self.active_nodes_count = int(self.get_active_nodes_count(cursor)) - 1
+            # Esperar los votos de los demás nodos (los atiende el servidor en otros hilos)
+            with self.consensus_condition:
+                self.consensus_condition.wait_for(lambda: self.consensus_node_count >= self.active_nodes_count)
+
+            self.clock.sleep(1)
+            print("\n")
+
+            # Los votos se comparan por resumen: la propuesta se aplica si la mayoría coincide con ella
+            if self.votes.majority() == proposal_digest:
+                self.apply_local(start_second_part)
+                self.mark_applied(write_index)
+            else:
+                print(">> Consenso: La propuesta recibida no coincide con la mayoría de los votos; no se aplica.")
+        finally:
+            with self.consensus_condition:
+                self.rounds_in_flight -= 1
+            self.consensus_node_count = 0
+            self.votes.clear()
+
+            ip_start_node = self.get_start_consensus_sucursal_ip(cursor, id_start_node)
+            self.send_message_to_node(ip_start_node, "consensus_over")
+            self.metrics.observe("nodo_consensus_round_seconds", self.clock.perf_counter() - consensus_start, role="participante")
+
+    # shard_write-indice|operación: escritura de un artículo en una de las sucursales que lo guardan. `indice` es
+    # el permiso de exclusión mutua de la escritura: si se reintenta (se perdió la respuesta) no se vuelve a
+    # aplicar. Responde con el espacio usado de esta sucursal o shard_write_failed si no la pudo aplicar
+    @message_handler("shard_write", raw=True, priority="control")
+    def handle_shard_write(self, client_socket, cursor, data):
+        header, operation = data.split("|", 1)
+        write = (header.partition("-")[2], operation)
+        if self.get_current_sucursal_id() is None:
+            # Sin su fila en SUCURSAL este nodo no sabe su espacio usado: no guarda artículos
+            client_socket.send("shard_write_failed".encode())
+            return
+        with self.shard_write_lock:
+            if write != self.last_shard_write:
+                try:
+                    self.apply_local(operation)
+                except Exception:
+                    client_socket.send("shard_write_failed".encode())
+                    raise
+                self.last_shard_write = write
+        client_socket.send(f"shard_write_applied|{self.get_current_espacio_usado()}".encode())
+
+    # shard_copy|codigo|nombre|precio|stock|dueña: copia de un artículo para una sucursal que pasa a guardarlo
+    # tras la caída de otra (ver copy_shard_articles). Si ya lo tiene se reemplaza por la copia
+    @message_handler("shard_copy", int, str, float, str, int, priority="control", database=True)
+    def handle_shard_copy(self, client_socket, cursor, data, codigo, nombre, precio, stock, id_sucursal):
+        self.store_shard_articulo(cursor, codigo, nombre, precio, stock, id_sucursal)
+        cursor.connection.commit()
+        client_socket.send("shard_copy_applied".encode())
 
-    # Función para iniciar el servidor en un nodo
-    def start_server(self, ip, port):
+    @message_handler("shard_query", int, priority="control", database=True)
+    def handle_shard_query(self, client_socket, cursor, data, codigo):
+        articulo = self.query_local_articulo(cursor, codigo)
+        if articulo:
+            client_socket.send("|".join(str(field) for field in articulo).encode())
+        else:
+            client_socket.send("not_found".encode())
+
+    # merkle_root|tabla: empieza cada comparación, así que el árbol se reconstruye (el del caché puede ser anterior
+    # a la última escritura) y los merkle_node/merkle_rows que siguen usan el nuevo
+    @message_handler("merkle_root", str, priority="bulk", database=True)
+    def handle_merkle_root(self, client_socket, cursor, data, table):
+        levels, _ = self.get_merkle_tree(cursor, table, refresh=True)
+        client_socket.send(levels[0][0].encode())
+
+    @message_handler("merkle_node", str, int, int, priority="bulk", database=True)
+    def handle_merkle_node(self, client_socket, cursor, data, table, level, index):
+        levels, _ = self.get_merkle_tree(cursor, table)
+        children = levels[level + 1][2 * index:2 * index + 2]
+        client_socket.send("|".join(children).encode())
+
+    @message_handler("merkle_rows", str, int, priority="bulk", database=True)
+    def handle_merkle_rows(self, client_socket, cursor, data, table, bucket):
+        _, buckets = self.get_merkle_tree(cursor, table)
+        client_socket.sendall(json.dumps(buckets[bucket]).encode())
+
+    # new_master_node|maestro anterior|nuevo maestro[|nueva dueña|espacio]: en modo particionado trae la sucursal
+    # que eligió el nuevo maestro para los artículos del anterior (ver redistribute_shard_articles)
+    @message_handler("new_master_node", raw=True, priority="control", database=True)
+    def handle_new_master_node(self, client_socket, cursor, data):
+        fields = [int(field) for field in data.split("|")[1:]]
+        self.update_master_node_status(cursor, fields[0], fields[1], tuple(fields[2:4]) or None)
+        client_socket.send("new_master_updated".encode())
+
+    @message_handler("node_failure", int, priority="control", database=True)
+    def handle_node_failure(self, client_socket, cursor, data, id):
+        placement = self.update_node_failure(cursor, id)
+
+        nodes_ips = self.get_ip_active_nodes_less_master(cursor)
+        message = f"node_failure_node_active|{id}"
+        if placement is not None:
+            message += "|{}|{}".format(*placement)
+        for ip in nodes_ips:
+            self.send_message_node_failure_node_active(ip, message)
+        client_socket.send("master_node_failure_updated".encode())
+
+    # node_failure_node_active|sucursal caída[|nueva dueña|espacio]: en modo particionado trae la sucursal que
+    # eligió el maestro para los artículos de la caída (ver redistribute_shard_articles)
+    @message_handler("node_failure_node_active", raw=True, priority="control", database=True)
+    def handle_node_failure_node_active(self, client_socket, cursor, data):
+        fields = [int(field) for field in data.split("|")[1:]]
+        self.update_node_failure(cursor, fields[0], tuple(fields[1:3]) or None)
+        client_socket.send("node_failure_updated".encode())
+
+    # Función para aplicar en la base de datos local una operación replicada (ver REPLICATED_OPERATIONS).
+    # Las operaciones desconocidas o con otro número de campos se ignoran
+    @traced("apply_operation")
+    @timed("apply_operation")
+    def apply_operation(self, cursor, operation):
+        parts = operation.split('|')
+        entry = REPLICATED_OPERATIONS.get(parts[0])
+        if entry is None or len(parts) != entry.arity:
+            return
+        fields = entry.decode(parts)
+        if entry.sql is not None:
+            cursor.execute(entry.sql, fields)
+            cursor.connection.commit()
+        else:
+            entry.handler(self, cursor, *fields)
+
+    # Función para obtener la dirección (ip, puerto) de un nodo. SUCURSAL.ip puede incluir el puerto
+    # como "ip:puerto" (p. ej. varios nodos en 127.0.0.1); si no lo incluye se usa el puerto 2222
+    @staticmethod
+    def node_address(ip):
+        host, _, port = ip.partition(":")
+        return (host, int(port) if port else 2222)
+
+    # Función para iniciar el servidor en un nodo. Un solo hilo acepta las conexiones y espera (con un
+    # selector) a que llegue el mensaje; con su primera parte ya leída se clasifica y pasa por el control de
+    # admisión (el resto de un mensaje largo lo lee handle_message o handle_batch en su propio hilo). Las
+    # conexiones que no envían nada en `idle_timeout` segundos se cierran
+    def start_server(self, ip, port, idle_timeout=10.0):
         try:
             server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             server.bind((ip, port))
-            server.listen(50)
+            server.listen(self.backlog)
 
+            selector = selectors.DefaultSelector()
+            selector.register(server, selectors.EVENT_READ)
+            waiting = {}
             while self.is_running:  # Verifica la bandera de ejecución
-                client, addr = server.accept()
-                client_handler = threading.Thread(target=self.handle_client, args=(client,))
-                client_handler.start()
+                for key, _ in selector.select(timeout=1.0):
+                    if key.fileobj is server:
+                        client, addr = server.accept()
+                        try:
+                            # Casi siempre el mensaje ya llegó junto con la conexión
+                            raw = client.recv(1024, socket.MSG_DONTWAIT)
+                        except BlockingIOError:
+                            selector.register(client, selectors.EVENT_READ)
+                            waiting[client] = time.monotonic()
+                            continue
+                        except OSError:
+                            client.close()
+                            continue
+                    else:
+                        client = key.fileobj
+                        selector.unregister(client)
+                        del waiting[client]
+                        try:
+                            raw = client.recv(1024)
+                        except OSError:
+                            client.close()
+                            continue
+                    if not raw:
+                        client.close()
+                        continue
+                    self.admit(client, raw)
+
+                now = time.monotonic()
+                for client in [client for client, accepted_at in waiting.items() if now - accepted_at > idle_timeout]:
+                    selector.unregister(client)
+                    del waiting[client]
+                    client.close()
         except OSError as e:
             sys.exit(1)
         finally:
             server.close()  # Cierra el socket del servidor
 
+    # Función para obtener la clase de prioridad de un mensaje (sin su contexto de trazado). Los lotes
+    # llevan los mensajes de consenso, así que son de control
+    @staticmethod
+    def message_priority(raw):
+        if raw[:1] == BATCH_MARKER:
+            return "control"
+        if raw[:1] == MESSAGE_MARKER:
+            raw = raw[MESSAGE_HEADER.size:]
+        if raw.startswith(b"trace:"):
+            raw = raw.split(b" ", 1)[-1]
+        opcode = raw.split(b"|", 1)[0].split(b"-", 1)[0].decode(errors="replace")
+        entry = MESSAGE_HANDLERS.get(opcode)
+        return entry.priority if entry is not None else "normal"
+
+    # Función para pasar un mensaje por el control de admisión. Si se rechaza se responde `busy`
+    def admit(self, client_socket, raw):
+        priority = self.message_priority(raw)
+        self.metrics.inc("nodo_admission_requests_total", priority=priority)
+        if self.admission.submit(priority, self.handle_client, client_socket, raw):
+            return
+        try:
+            client_socket.send(BUSY_REPLY)
+        except OSError:
+            pass
+        client_socket.close()
+
+    # Función para exponer las métricas por HTTP (GET /metrics) en formato de texto de Prometheus. http.server
+    # se importa aquí para no pagar su carga en el arranque de los nodos sin endpoint de métricas
+    def start_metrics_server(self, ip, port):
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        metrics = self.metrics
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((ip, port), MetricsHandler)
+        server.daemon_threads = True
+        server.serve_forever()
+
     def create_tables(self):
         self.create_table("CLIENTE", """
             id_cliente INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -237,18 +2479,13 @@ class Nodo:
             FOREIGN KEY (id_sucursal) REFERENCES SUCURSAL(id_sucursal)
         """)
 
-        self.create_table("GUIA_ENVIO", """
-            id_guia INTEGER PRIMARY KEY AUTOINCREMENT,
-            id_cliente INTEGER NOT NULL,
-            id_articulo INTEGER NOT NULL,
-            id_sucursal INTEGER NOT NULL,
-            serie INTEGER NOT NULL UNIQUE,
-            monto_total REAL NOT NULL,
-            fecha_compra TEXT NOT NULL,
-            FOREIGN KEY (id_cliente) REFERENCES CLIENTE(id_cliente),
-            FOREIGN KEY (id_articulo) REFERENCES ARTICULO(id_articulo),
-            FOREIGN KEY (id_sucursal) REFERENCES SUCURSAL(id_sucursal)
-        """)
+        # GUIA_ENVIO es la vista de las particiones mensuales, que se crean con la primera guía de cada mes
+        self.guia_envio.create_schema(self.cursor)
+        self.connection.commit()
+
+        # La conexión principal se abrió antes de que existiera SUCURSAL: se le instalan ahora los triggers
+        self.cluster.attach(self.connection)
+        self.cluster.load(self.connection)
 
     def create_table(self, table_name, fields):
         self.cursor.execute(f"""
@@ -265,61 +2502,181 @@ class Nodo:
             (5, '192.168.222.133', 0, 1, 1, 9, 0)
         ]
 
-        for sucursal_data in sucursales_data:
-            self.cursor.execute("""
-                INSERT OR IGNORE INTO SUCURSAL (id_sucursal, ip, nodo_actual, nodo_maestro, status, capacidad, espacio_usado)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, sucursal_data)
-            self.connection.commit()
+        self.cursor.executemany("""
+            INSERT OR IGNORE INTO SUCURSAL (id_sucursal, ip, nodo_actual, nodo_maestro, status, capacidad, espacio_usado)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, sucursales_data)
+        self.connection.commit()
+
+    # Función para preparar la base de datos al arrancar. Si el esquema ya está en SCHEMA_VERSION no se toca
+    # nada (arranque en caliente). Si GUIA_ENVIO todavía es una tabla (esquema 1, o una base creada por una
+    # versión anterior que no marcaba user_version) se migra a las particiones antes de que create_schema cree
+    # la vista con el mismo nombre; una base sin versión se completa con sus tablas y sucursales iniciales y
+    # una del esquema 2 sólo necesita el índice de series. Luego se marca la versión. Devuelve True si la base
+    # ya estaba lista
+    def prepare_storage(self):
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version == SCHEMA_VERSION:
+            return True
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"La base de datos {self.db_path} tiene el esquema {version} y este nodo sólo conoce hasta el {SCHEMA_VERSION}")
+        if self.cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'GUIA_ENVIO'").fetchone():
+            migrated = self.guia_envio.migrate(self.cursor)
+            print(f"\n>> Arranque: GUIA_ENVIO migrada a {len(self.guia_envio.months)} partición(es) mensual(es) ({migrated} guías).")
+        if version == 0:
+            self.create_tables()
+            self.insert_initial_sucursales()
+        elif version == 2:
+            # Esquema 2: se agrega el índice de series de las particiones calientes y de los archivos
+            self.guia_envio.create_schema(self.cursor)
+            self.guia_envio.index_series(self.cursor)
+        self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.commit()
+        return False
+
+    # Función para guardar el estado del nodo que no vive en la base de datos: los índices de replicación,
+    # la membresía de SUCURSAL con la que se guardaron y el RTT observado de cada par. Se escribe en un
+    # archivo temporal y se renombra, así que un corte nunca deja un estado a medias
+    def save_state(self, clean=False):
+        if self.state_path is None:
+            return
+        view = self.cluster.view
+        membership = [[branch.id_sucursal, branch.ip, branch.nodo_actual, branch.nodo_maestro, branch.status]
+                      for id_sucursal, branch in sorted(view.branches.items())]
+        peers = {ip: [state.srtt, state.rttvar] for ip, state in list(self.transport.peers.items()) if state.srtt is not None}
+        state = {
+            "format": STATE_FORMAT,
+            "schema_version": SCHEMA_VERSION,
+            "saved_at": self.clock.time(),
+            "clean": clean,
+            "applied_index": self.applied_index,
+            "grant_index": self.grant_index,
+            "last_write_index": self.last_write_index,
+            "membership": membership,
+            "peers": peers,
+        }
+        with self.semaphore_state:
+            temporary_path = self.state_path + ".tmp"
+            with open(temporary_path, "w") as file:
+                json.dump(state, file, separators=(",", ":"))
+            os.replace(temporary_path, self.state_path)
+
+    # Función para recuperar el estado guardado en el arranque. Sólo se usa si es del mismo formato y esquema
+    # y si la sucursal actual de la membresía guardada coincide con la de la base de datos (si no, el archivo
+    # es de otro nodo o la base se reemplazó). Los RTT sólo se recuperan si el estado es reciente.
+    # Devuelve el estado recuperado o None
+    def load_state(self, max_age=300.0):
+        if self.state_path is None:
+            return None
+        try:
+            with open(self.state_path) as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if state.get("format") != STATE_FORMAT or state.get("schema_version") != SCHEMA_VERSION:
+            return None
+
+        current = next(([branch.id_sucursal, branch.ip] for branch in self.cluster.view.branches.values() if branch.nodo_actual == 1), None)
+        saved_current = next(([row[0], row[1]] for row in state["membership"] if row[2] == 1), None)
+        if current is None or current != saved_current:
+            print(f"\n>> Arranque: el estado guardado en {self.state_path} no corresponde a esta base de datos, se ignora.")
+            return None
 
+        with self.applied_condition:
+            self.applied_index = max(self.applied_index, state["applied_index"])
+        self.grant_index = max(self.grant_index, state["grant_index"], state["applied_index"])
+        self.last_write_index = max(self.last_write_index, state["last_write_index"])
+        if self.clock.time() - state["saved_at"] <= max_age:
+            for ip, (srtt, rttvar) in state["peers"].items():
+                peer = self.transport.peer(ip)
+                peer.srtt, peer.rttvar = srtt, rttvar
+        return state
+
+    # Función de arranque: prepara la base de datos (sólo si el esquema no está al día) y recupera el estado
+    # guardado. Devuelve True si fue un arranque en caliente (esquema listo y estado válido)
+    def warm_start(self):
+        schema_ready = self.prepare_storage()
+        state = self.load_state() if schema_ready else None
+        if state is not None:
+            print(f"\n>> Arranque en caliente: índice aplicado {self.applied_index}"
+                  f"{'' if state['clean'] else ' (el nodo no se detuvo limpiamente)'}")
+        return state is not None
+
+    # Función para validar tras arrancar en qué punto de la secuencia de replicación está el nodo: pide al
+    # maestro el índice de la última escritura completa y, si el nodo quedó atrás mientras estaba detenido,
+    # sincroniza sus tablas con anti-entropía antes de darse por al día con ese índice. Sin esto un nodo
+    # reiniciado (applied_index vuelve a 0 sin archivo de estado) no atiende lecturas linearizable ni bounded
+    # hasta recibir la siguiente escritura, así que si el maestro no responde se reintenta con espera creciente
+    def catch_up(self, retries=5, delay=1.0):
+        master = self.cluster.view.master
+        if master is None or master.nodo_actual == 1:
+            return
+
+        for attempt in range(retries):
+            try:
+                index = int(self.call(master.ip, "read_index"))
+                break
+            except (OSError, ValueError) as e:
+                if attempt == retries - 1:
+                    print(f"\n>> Arranque: no se pudo consultar el índice de replicación del maestro ({e}).")
+                    return
+                self.clock.sleep(delay * 2 ** attempt)
+        if index > self.applied_index:
+            print(f"\n>> Arranque: el nodo aplicó hasta el índice {self.applied_index} y el maestro está en {index}, sincronizando...")
+            # La reparación se posterga mientras haya escrituras en curso; sin ella el nodo no está al día
+            for attempt in range(retries):
+                try:
+                    if self.run_anti_entropy():
+                        break
+                except OSError as e:
+                    print(f"\n>> Arranque: no se pudo sincronizar con el maestro ({e}).")
+                if attempt == retries - 1:
+                    return
+                self.clock.sleep(delay * 2 ** attempt)
+        self.mark_applied(index)
+
+    # Función para guardar el estado cada `state_interval` segundos mientras haya cambios
+    def state_loop(self):
+        saved = None
+        while self.is_running:
+            self.clock.sleep(self.state_interval)
+            current = (self.applied_index, self.grant_index, self.last_write_index, len(self.transport.peers))
+            if current == saved:
+                continue
+            try:
+                self.save_state()
+                saved = current
+            except Exception as e:
+                print(f"\n>> Error al guardar el estado: {e} \n")
+
+    # Función para mostrar una tabla. prettytable se importa sólo cuando se pide una tabla interactiva
     def pretty_table_query(self, table_name):
+        from prettytable import PrettyTable
+
         self.cursor.execute(f"SELECT * FROM {table_name}")
         rows = self.cursor.fetchall()
         table = PrettyTable([description[0] for description in self.cursor.description])
         table.add_rows(rows)
         print(table)
 
-    def create_cliente(self, cursor, usuario, nombre, direccion, tarjeta):
-        status = "Activo"
-        cursor.execute("""
-            INSERT INTO CLIENTE (usuario, nombre, direccion, tarjeta, status)
-            VALUES (?, ?, ?, ?, ?)
-        """, (usuario, nombre, direccion, tarjeta, status))
-        cursor.connection.commit()
-
     def read_cliente(self):
         self.pretty_table_query("CLIENTE")
 
-    def update_cliente(self, cursor, usuario, nombre, direccion, tarjeta):
-        cursor.execute("""
-            UPDATE CLIENTE
-            SET nombre = ?, direccion = ?, tarjeta = ?
-            WHERE usuario = ?
-        """, (nombre, direccion, tarjeta, usuario))
-        cursor.connection.commit()
-
-    def activate_cliente(self, cursor, usuario):
-        cursor.execute("""
-            UPDATE CLIENTE
-            SET status = 'Activo'
-            WHERE usuario = ?
-        """, (usuario,))
-        cursor.connection.commit()
-
-    def deactivate_cliente(self, cursor, usuario):
-        cursor.execute("""
-            UPDATE CLIENTE
-            SET status = 'Inactivo'
-            WHERE usuario = ?
-        """, (usuario,))
-        cursor.connection.commit()
-
+    @replicated_operation("create_articulo", int, str, float, int)
     def create_articulo(self, cursor, codigo, nombre, precio, id_sucursal):
         stock = "Disponible"
-        cursor.execute("""
-            INSERT INTO ARTICULO (id_sucursal, codigo, nombre, precio, stock)
-            VALUES (?, ?, ?, ?, ?)
-        """, (id_sucursal, codigo, nombre, precio, stock))
+        if self.sharded:
+            # En modo particionado cada nodo sólo guarda un subconjunto de artículos, por lo que el
+            # AUTOINCREMENT divergiría entre nodos; se usa el código (único) como id_articulo global
+            cursor.execute("""
+                INSERT INTO ARTICULO (id_articulo, id_sucursal, codigo, nombre, precio, stock)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (codigo, id_sucursal, codigo, nombre, precio, stock))
+        else:
+            cursor.execute("""
+                INSERT INTO ARTICULO (id_sucursal, codigo, nombre, precio, stock)
+                VALUES (?, ?, ?, ?, ?)
+            """, (id_sucursal, codigo, nombre, precio, stock))
         cursor.execute("""
             UPDATE SUCURSAL
             SET espacio_usado = espacio_usado + 1
@@ -327,38 +2684,38 @@ class Nodo:
         """, (id_sucursal,))
         cursor.connection.commit()
 
-    def read_articulo(self):
-        self.pretty_table_query("ARTICULO")
-
-    def update_articulo(self, cursor, codigo, nombre, precio):
-        cursor.execute("""
-            UPDATE ARTICULO
-            SET nombre = ?, precio = ?
-            WHERE codigo = ?
-        """, (nombre, precio, codigo))
-        cursor.connection.commit()
-
-    def restock_articulo(self, cursor, codigo):
-        cursor.execute("""
-            UPDATE ARTICULO
-            SET stock = 'Disponible'
-            WHERE codigo = ? AND stock = 'Agotado'
-        """, (codigo,))
+    # Función para migrar artículos entre sucursales. Cada movimiento es (codigo, origen, destino) y sólo se
+    # aplica si el artículo sigue en el origen, así el espacio_usado se ajusta una sola vez por artículo
+    @replicated_operation("migrate_articulos", decode_moves)
+    def migrate_articulos(self, cursor, moves):
+        for codigo, id_origen, id_destino in moves:
+            cursor.execute("""
+                UPDATE ARTICULO
+                SET id_sucursal = ?
+                WHERE codigo = ? AND id_sucursal = ?
+            """, (id_destino, codigo, id_origen))
+            if cursor.rowcount == 0:
+                continue
+            cursor.execute("""
+                UPDATE SUCURSAL
+                SET espacio_usado = espacio_usado - 1
+                WHERE id_sucursal = ?
+            """, (id_origen,))
+            cursor.execute("""
+                UPDATE SUCURSAL
+                SET espacio_usado = espacio_usado + 1
+                WHERE id_sucursal = ?
+            """, (id_destino,))
         cursor.connection.commit()
 
-    def deactivate_articulo(self, cursor, codigo):
-        cursor.execute("""
-            UPDATE ARTICULO
-            SET stock = 'Agotado'
-            WHERE codigo = ? AND stock = 'Disponible'
-        """, (codigo,))
-        cursor.connection.commit()
+    def read_articulo(self):
+        if self.sharded:
+            print("\n>> Modo particionado: se muestran sólo los artículos almacenados en esta sucursal.")
+        self.pretty_table_query("ARTICULO")
 
+    @replicated_operation("create_guia_envio", int, int, int, int, float, str)
     def create_guia_envio(self, cursor, id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra):
-        cursor.execute("""
-            INSERT INTO GUIA_ENVIO (id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra))
+        self.guia_envio.insert(cursor, id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra)
 
         cursor.execute("""
             UPDATE ARTICULO
@@ -367,7 +2724,15 @@ class Nodo:
         """, (id_articulo,))
         cursor.connection.commit()
 
-    def update_master_node_status(self, cursor, old_master, new_master):
+    # Función para registrar el cambio de maestro. En modo particionado devuelve la redistribución de los
+    # artículos del maestro anterior (ver redistribute_shard_articles)
+    def update_master_node_status(self, cursor, old_master, new_master, placement=None):
+        redistribution_start = self.clock.perf_counter()
+
+        # Si este nodo pasa a ser el maestro, su índice de replicación continúa desde lo que ya aplicó
+        self.last_write_index = max(self.last_write_index, self.applied_index)
+        self.grant_index = max(self.grant_index, self.applied_index)
+
         # Actualizar el nodo maestro antiguo
         cursor.execute("""
             UPDATE SUCURSAL
@@ -392,6 +2757,9 @@ class Nodo:
             """, (old_master,))
             cursor.connection.commit()
 
+            if self.sharded:
+                return self.redistribute_shard_articles(cursor, old_master, placement)
+
             # Obtener la lista de artículos del nodo caído
             cursor.execute("""
                 SELECT id_articulo, id_sucursal
@@ -452,6 +2820,8 @@ class Nodo:
 
         except Exception as e:
             print(f"\n>> Error en update_node_failure: {e} \n")
+        finally:
+            self.metrics.observe("nodo_redistribution_seconds", self.clock.perf_counter() - redistribution_start, reason="master_failure")
 
     def check_cliente_activo(self, usuario):
         self.cursor.execute("SELECT status FROM CLIENTE WHERE usuario = ?", (usuario,))
@@ -463,6 +2833,10 @@ class Nodo:
             return False
 
     def check_articulo_disponible(self, codigo):
+        if self.sharded:
+            articulo = self.lookup_articulo(codigo)
+            return articulo is not None and articulo[2] == 'Disponible'
+
         self.cursor.execute("SELECT stock FROM ARTICULO WHERE codigo = ?", (codigo,))
         stock = self.cursor.fetchone()
 
@@ -474,54 +2848,79 @@ class Nodo:
     def read_guia_envio(self):
         self.pretty_table_query("GUIA_ENVIO")
 
+    # Función para leer las guías de un rango de fechas ("AAAA-MM-DD HH:MM:SS"), incluidas las archivadas
+    def read_guia_envio_range(self, since=None, until=None):
+        from prettytable import PrettyTable
+
+        table = PrettyTable(list(GUIA_ENVIO_COLUMNS))
+        table.add_rows(self.guia_envio.select(self.cursor, since=since, until=until, include_archive=True))
+        print(table)
+
     def estado_sucursales(self):
         print("\n=== Estado de Sucursales ===")
         self.pretty_table_query("SUCURSAL")
 
+    # Análisis columnar de capacidad y carga (requiere NumPy, por eso se importa al usarlo)
+    def analisis_capacidad(self):
+        try:
+            import analytics
+        except ImportError as e:
+            print(f"\n>> El análisis de capacidad requiere NumPy. {e}")
+            return
+        if self.capacity_tracker is None:
+            self.capacity_tracker = analytics.CapacityTracker()
+        analytics.print_report(self.capacity_tracker.update(self.connection))
+        if self.sharded:
+            print("\n>> Modo particionado: los artículos y ventas corresponden solo a las particiones locales.")
+
     def get_cliente_id(self, usuario):
         self.cursor.execute("SELECT id_cliente FROM CLIENTE WHERE usuario = ?", (usuario,))
         return self.cursor.fetchone()[0]
 
     def get_articulo_id(self, codigo):
+        if self.sharded:
+            return self.lookup_articulo(codigo)[0]
         self.cursor.execute("SELECT id_articulo FROM ARTICULO WHERE codigo = ?", (codigo,))
         return self.cursor.fetchone()[0]
 
     def get_articulo_price(self, codigo):
+        if self.sharded:
+            return self.lookup_articulo(codigo)[1]
         self.cursor.execute("SELECT precio FROM ARTICULO WHERE codigo = ?", (codigo,))
         return self.cursor.fetchone()[0]
 
+    # Los datos de las sucursales se leen de la vista en memoria del clúster (self.cluster.view). Los métodos
+    # que reciben un cursor lo conservan por compatibilidad con quienes los llaman desde otros hilos. Mientras
+    # este nodo no figure en SUCURSAL (nodo_actual = 1) los datos de la sucursal actual son None
     def get_current_sucursal_id(self):
-        self.cursor.execute("SELECT id_sucursal FROM SUCURSAL WHERE nodo_actual = 1 AND status = 1")
-        return self.cursor.fetchone()[0]
+        current = self.cluster.view.current
+        return None if current is None else current.id_sucursal
 
     def get_current_sucursal_id_continue_consensus(self, cursor):
-        cursor.execute("SELECT id_sucursal FROM SUCURSAL WHERE nodo_actual = 1 AND status = 1")
-        return cursor.fetchone()[0]
+        return self.get_current_sucursal_id()
 
     def get_current_sucursal_ip(self):
-        self.cursor.execute("SELECT ip FROM SUCURSAL WHERE nodo_actual = 1 AND status = 1")
-        return self.cursor.fetchone()[0]
+        current = self.cluster.view.current
+        return None if current is None else current.ip
+
+    def get_current_espacio_usado(self):
+        current = self.cluster.view.current
+        return None if current is None else current.espacio_usado
     
     def get_start_consensus_sucursal_ip(self, cursor, id_start_consensus):
-        cursor.execute("SELECT ip FROM SUCURSAL WHERE id_sucursal = ?", (id_start_consensus,))
-        return cursor.fetchone()[0]
+        return self.cluster.view.branches[id_start_consensus].ip
     
     def get_node_failure_id(self, ip):
-        self.cursor.execute("SELECT id_sucursal FROM SUCURSAL WHERE ip = ?", (ip,))
-        return self.cursor.fetchone()[0]
+        return self.cluster.view.by_ip[ip].id_sucursal
     
     def get_master_node_id(self):
-        self.cursor.execute("SELECT id_sucursal FROM SUCURSAL WHERE nodo_maestro = 1 AND status = 1")
-        return self.cursor.fetchone()[0]
+        return self.cluster.view.master.id_sucursal
     
     def get_master_node_ip(self):
-        self.cursor.execute("SELECT ip FROM SUCURSAL WHERE nodo_maestro = 1 AND status = 1")
-        return self.cursor.fetchone()[0]
+        return self.cluster.view.master.ip
         
     def get_active_nodes_count(self, cursor):
-        cursor.execute("SELECT id_sucursal FROM SUCURSAL WHERE nodo_actual = 0 AND status = 1")
-        results = cursor.fetchall()
-        return len(results)
+        return len(self.cluster.view.peers)
 
     def update_sucursal_info(self, cursor, nodo_id, status, espacio_usado):
         cursor.execute("""
@@ -538,133 +2937,364 @@ class Nodo:
 
     # Método para verificar si el código existe
     def check_code_exists(self, codigo):
+        if self.sharded:
+            return self.lookup_articulo(codigo) is not None
         self.cursor.execute("SELECT 1 FROM ARTICULO WHERE codigo = ?", (codigo,))
         return bool(self.cursor.fetchone())
 
     # Función para enviar mensajes a un nodo específico
     def send_message_to_node(self, ip, message):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((ip, 2222))
-        client_socket.send(f"{message}".encode())
-        client_socket.close()
-
-    # Función para enviar mensajes a todos los nodos actuales
-    def send_messages_to_nodes(self, message):
-        id_actual_node = self.get_current_sucursal_id()
-        start_consensus = f"start_consensus-{id_actual_node}|{message}"
-        self.cursor.execute("SELECT ip FROM SUCURSAL WHERE nodo_actual = 0 AND status = 1")
-        nodes_ips = self.cursor.fetchall()
-        for ip in nodes_ips:
-            self.send_message_to_node(ip[0], start_consensus)
-        self.active_nodes_count = int(self.get_active_nodes_count(self.cursor)) - 1
-        while self.consensus_completion_count < self.active_nodes_count:
-            pass
+        self.send_to_nodes([ip], message)
+
+    # Función para enviar mensajes a todos los nodos actuales. Los hilos en segundo plano pasan su propio cursor.
+    # El mensaje lleva el índice del permiso actual para que cada nodo registre hasta dónde aplicó
+    @traced("consensus")
+    def send_messages_to_nodes(self, message, cursor=None):
+        cursor = self.cursor if cursor is None else cursor
+        consensus_start = self.clock.perf_counter()
+        id_actual_node = self.get_current_sucursal_id_continue_consensus(cursor)
+        self.lock_wrote = True
+        start_consensus = f"start_consensus-{id_actual_node}-{self.write_index or 0}|{message}"
+        self.send_to_nodes([branch.ip for branch in self.cluster.view.peers], start_consensus)
+        self.active_nodes_count = int(self.get_active_nodes_count(cursor)) - 1
+        # Esperar la confirmación de cada nodo (consensus_over)
+        with self.consensus_condition:
+            self.consensus_condition.wait_for(lambda: self.consensus_completion_count >= self.active_nodes_count)
         self.consensus_completion_count = 0
+        self.metrics.observe("nodo_consensus_round_seconds", self.clock.perf_counter() - consensus_start, role="inicial")
 
     # Función para enviar mensajes a todos los nodos actuales
+    @traced("continue_consensus")
     def send_messages_to_nodes_continue_consensus(self, cursor, id_start_node, message):
         id_actual_node = self.get_current_sucursal_id_continue_consensus(cursor)
-        continue_consensus = f"continue_consensus-{id_actual_node}|{message}"
+        if id_actual_node is None:
+            print(">> Consenso: Este nodo no figura en SUCURSAL; no vota.")
+            return
+        vote = f"digest:{self.vote_digest(message)}" if self.digest_votes else message
+        continue_consensus = f"continue_consensus-{id_actual_node}|{vote}"
+        self.send_to_nodes([branch.ip for branch in self.cluster.view.peers if branch.id_sucursal != id_start_node], continue_consensus)
+
+    # Función para obtener el anillo de hash consistente sobre las sucursales activas
+    def get_hash_ring(self, cursor):
+        ids_sucursales = tuple(branch.id_sucursal for branch in self.cluster.view.active)
+        if self.hash_ring is None or self.hash_ring.ids_sucursales != ids_sucursales:
+            self.hash_ring = HashRing(ids_sucursales)
+        return self.hash_ring
+
+    # Función para obtener las sucursales que almacenan un artículo: su sucursal dueña más R réplicas del anillo
+    def get_article_hosts(self, cursor, codigo, id_sucursal):
+        ring = self.get_hash_ring(cursor)
+        replicas = [id_node for id_node in ring.preference_list(codigo, self.replicas + 1) if id_node != id_sucursal]
+        return [id_sucursal] + replicas[:self.replicas]
+
+    # Función para guardar un artículo que llega de otra sucursal en modo particionado, insertándolo o
+    # reemplazando el que tenga el mismo código. Como en create_articulo el id_articulo es el código, salvo que
+    # ese id ya lo tenga otro artículo (p. ej. uno creado antes de particionar, con id de AUTOINCREMENT):
+    # entonces SQLite le asigna uno nuevo en lugar de descartar la fila
+    def store_shard_articulo(self, cursor, codigo, nombre, precio, stock, id_sucursal):
         cursor.execute("""
-            SELECT ip FROM SUCURSAL 
-            WHERE nodo_actual = 0 AND status = 1 AND id_sucursal != ?""", (id_start_node,))
-        nodes_ips = cursor.fetchall()
-        for ip in nodes_ips:
-            self.send_message_to_node(ip[0], continue_consensus)
+            INSERT INTO ARTICULO (id_articulo, id_sucursal, codigo, nombre, precio, stock)
+            VALUES ((SELECT CASE WHEN EXISTS (SELECT 1 FROM ARTICULO WHERE id_articulo = ?) THEN NULL ELSE ? END), ?, ?, ?, ?, ?)
+            ON CONFLICT(codigo) DO UPDATE SET
+                id_sucursal = excluded.id_sucursal, nombre = excluded.nombre, precio = excluded.precio, stock = excluded.stock
+        """, (codigo, codigo, id_sucursal, codigo, nombre, precio, stock))
+
+    def query_local_articulo(self, cursor, codigo):
+        cursor.execute("SELECT id_articulo, precio, stock, id_sucursal FROM ARTICULO WHERE codigo = ?", (codigo,))
+        return cursor.fetchone()
+
+    # Función para enviar un mensaje del modo particionado a un nodo y esperar su respuesta
+    def send_message_shard_to_node(self, ip, message):
+        return self.call(ip, message, reply_timeout=30)
+
+    # Función para localizar un artículo en modo particionado. Con réplicas el primer nodo del anillo para el
+    # código siempre es dueño o réplica (tras una redistribución copy_shard_articles le copia el artículo y,
+    # si la copia falló, la anti-entropía con la dueña), así que su respuesta basta: un código nuevo no
+    # consulta a todo el clúster. Sólo si ese nodo no responde, o sin réplicas (el artículo sólo está en su
+    # dueña, que puede no ser la del anillo), se consulta al resto
+    def lookup_articulo(self, codigo):
+        articulo = self.query_local_articulo(self.cursor, codigo)
+        if articulo:
+            return articulo
+
+        id_actual_node = self.get_current_sucursal_id()
+        ring = self.get_hash_ring(self.cursor)
+        candidates = ring.preference_list(codigo, self.replicas + 1)
+        candidates += [id_node for id_node in ring.ids_sucursales if id_node not in candidates]
+        for position, id_node in enumerate(candidates):
+            if id_node == id_actual_node:
+                data = "not_found"
+            else:
+                ip = self.get_start_consensus_sucursal_ip(self.cursor, id_node)
+                try:
+                    data = self.send_message_shard_to_node(ip, f"shard_query|{codigo}")
+                except OSError:
+                    continue
+            if data and data != "not_found":
+                id_articulo, precio, stock, id_sucursal = data.split("|")
+                return (int(id_articulo), float(precio), stock, int(id_sucursal))
+            if position == 0 and self.replicas:
+                return None
+        return None
+
+    # Función para replicar y aplicar una operación sobre un artículo. Devuelve si la escritura quedó aplicada.
+    # Sin particionado se replica a todos los nodos por consenso y se aplica localmente. En modo particionado
+    # no hay consenso ni se escribe en las sucursales que no guardan el artículo: quien tiene la exclusión
+    # mutua escribe con shard_write primero en la sucursal dueña y después en sus réplicas, revisando cada
+    # respuesta (shard_write se reintenta sin aplicarse dos veces). Si la dueña no la aplica la escritura se
+    # cancela; una réplica que no respondió se reporta como caída (su redistribución restablece las copias) y
+    # una que respondió con error la repara la anti-entropía con la dueña. El espacio usado de la dueña llega
+    # en su respuesta y se le informa al maestro con release_permission; las demás sucursales lo reciben con
+    # los heart_beat
+    @traced("replicate_articulo")
+    def replicate_articulo(self, message, codigo, id_sucursal=None):
+        if not self.sharded:
+            self.send_messages_to_nodes(message)
+            self.apply_local(message)
+            return True
+
+        if id_sucursal is None:
+            id_sucursal = self.lookup_articulo(codigo)[3]
+        hosts = self.get_article_hosts(self.cursor, codigo, id_sucursal)
+
+        try:
+            espacio_usado = self.write_shard_host(id_sucursal, message)
+        except PeerUnavailableError:
+            espacio_usado = None
+            self.node_failure(id_sucursal)
+        if espacio_usado is None:
+            print(f"\n>> Particionado: la sucursal dueña (Nodo ID {id_sucursal}) no aplicó la escritura, se cancela.")
+            return False
+        if message.startswith("create_articulo|"):
+            if self.get_current_sucursal_id() not in hosts:
+                self.apply_local(f"set_espacio_usado|{id_sucursal}|{espacio_usado}")
+            self.shard_usage = (id_sucursal, espacio_usado)
+
+        for id_node in hosts[1:]:
+            try:
+                if self.write_shard_host(id_node, message) is None:
+                    print(f"\n>> Particionado: la réplica Nodo ID {id_node} no aplicó la escritura, la reparará la anti-entropía.")
+            except PeerUnavailableError:
+                print("\n>> Falla de nodo: Nodo ID ", id_node)
+                self.node_failure(id_node)
+        return True
+
+    # Función para aplicar una escritura del modo particionado en una de las sucursales que guardan el artículo.
+    # Devuelve el espacio usado de esa sucursal o None si no la pudo aplicar; si no responde lanza PeerUnavailableError
+    def write_shard_host(self, id_node, message):
+        if id_node == self.get_current_sucursal_id():
+            self.apply_local(message)
+            return self.get_current_espacio_usado()
+        ip = self.get_start_consensus_sucursal_ip(self.cursor, id_node)
+        reply = self.send_message_shard_to_node(ip, f"shard_write-{self.write_index or 0}|{message}")
+        if not reply.startswith("shard_write_applied|"):
+            return None
+        return int(reply.split("|")[1])
+
+    # Función para redistribuir los artículos de un nodo caído en modo particionado. Cada nodo sólo guarda
+    # su partición, así que el espacio usado se traslada completo para que SUCURSAL coincida en todos los nodos.
+    # La nueva dueña la elige el nodo que detecta la falla (el maestro, o el nuevo maestro si cayó el anterior)
+    # con su SUCURSAL, la que se actualiza con cada escritura, y llega a los demás en `placement` (nueva dueña,
+    # espacio usado trasladado): cada nodo sólo conoce al día el espacio usado de las sucursales con las que
+    # habló y elegir por su cuenta podría repartir los artículos distinto. Devuelve la elección
+    def redistribute_shard_articles(self, cursor, id, placement=None):
+        if placement is None:
+            cursor.execute("SELECT espacio_usado FROM SUCURSAL WHERE id_sucursal = ?", (id,))
+            espacio_usado = cursor.fetchone()[0]
+
+            best_fit_node = cursor.execute("""
+                SELECT id_sucursal, capacidad - espacio_usado
+                FROM SUCURSAL
+                WHERE status = 1 AND id_sucursal != ?
+                ORDER BY capacidad - espacio_usado DESC, id_sucursal
+                LIMIT 1
+            """, (id,)).fetchone()
+
+            if best_fit_node is None or best_fit_node[1] < espacio_usado:
+                print(f"\n>> Falla redistribución: No hay espacio disponible para la redistribución de los artículos del Nodo ID {id}")
+                return None
+            placement = (best_fit_node[0], espacio_usado)
+        id_new_owner, espacio_usado = placement
+
+        # Primero se copian las filas a las sucursales que ahora deben guardarlas y después se cambia la dueña
+        self.copy_shard_articles(cursor, id, id_new_owner)
+        cursor.execute("""
+            UPDATE ARTICULO
+            SET id_sucursal = ?
+            WHERE id_sucursal = ?
+        """, (id_new_owner, id))
+        cursor.execute("""
+            UPDATE SUCURSAL
+            SET espacio_usado = 0
+            WHERE id_sucursal = ?
+        """, (id,))
+        cursor.execute("""
+            UPDATE SUCURSAL
+            SET espacio_usado = espacio_usado + ?
+            WHERE id_sucursal = ?
+        """, (espacio_usado, id_new_owner))
+        cursor.connection.commit()
+
+        print(f"\n>> Artículos del Nodo {id} redistribuidos a Nodo {id_new_owner}")
+        return placement
+
+    # Función para restablecer las réplicas de los artículos locales que guardaba el nodo caído (como dueño o
+    # como réplica). Con el anillo sin ese nodo cada artículo tiene nuevas sucursales; las que no lo tenían
+    # reciben una copia con shard_copy. Todos los nodos que tienen la fila la envían, así que una sucursal
+    # puede recibirla más de una vez (shard_copy es idempotente). Con --replicas 0 los artículos del nodo
+    # caído no están en ningún otro nodo y se pierden
+    def copy_shard_articles(self, cursor, id, id_new_owner):
+        ring = self.get_hash_ring(cursor)
+        old_ring = HashRing(ring.ids_sucursales + (id,))
+        id_actual_node = self.get_current_sucursal_id()
+        rows = cursor.execute("SELECT codigo, nombre, precio, stock, id_sucursal FROM ARTICULO").fetchall()
+        copies = 0
+        for codigo, nombre, precio, stock, id_sucursal in rows:
+            old_hosts = [id_sucursal] + [id_node for id_node in old_ring.preference_list(codigo, self.replicas + 1) if id_node != id_sucursal][:self.replicas]
+            if id not in old_hosts:
+                continue
+            id_owner = id_new_owner if id_sucursal == id else id_sucursal
+            for id_node in self.get_article_hosts(cursor, codigo, id_owner):
+                if id_node == id_actual_node or id_node in old_hosts:
+                    continue
+                ip = self.get_start_consensus_sucursal_ip(cursor, id_node)
+                try:
+                    self.send_message_shard_to_node(ip, f"shard_copy|{codigo}|{nombre}|{precio}|{stock}|{id_owner}")
+                    copies += 1
+                except OSError as e:
+                    print(f"\n>> No se pudo copiar el artículo {codigo} al Nodo {id_node}: {e}")
+        if copies:
+            print(f"\n>> {copies} copia(s) de artículos enviadas para restablecer las réplicas del Nodo {id}")
 
     # Función para enviar mensaje de nuevo maestro a un nodo específico
     def send_message_new_master_to_node(self, ip, message):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((ip, 2222))
-        client_socket.send(f"{message}".encode())
-        data = client_socket.recv(1024).decode()
-        if data == "new_master_updated":
-            pass
-        client_socket.close()
+        self.call(ip, message, reply_timeout=30)
 
     # Función para enviar mensaje a los nodos sobre el cambio de maestro
+    @traced("new_master_node")
     def new_master_node(self, old_master, new_master):
-        self.update_master_node_status(self.cursor, old_master, new_master)
+        placement = self.update_master_node_status(self.cursor, old_master, new_master)
         message = f"new_master_node|{old_master}|{new_master}"
+        if placement is not None:
+            message += "|{}|{}".format(*placement)
         nodes_ips = self.get_ip_active_nodes_less_master(self.cursor)
         for ip in nodes_ips:
-            self.send_message_new_master_to_node(ip, message)
+            try:
+                self.send_message_new_master_to_node(ip, message)
+            except PeerUnavailableError as e:
+                # Un nodo caído no detiene la elección; lo detectará el siguiente heart_beat
+                print(f"\n>> Elección: {e}")
 
     def get_ip_active_nodes_less_master(self, cursor):
-        cursor.execute("SELECT ip FROM SUCURSAL WHERE nodo_actual = 0 AND nodo_maestro = 0 AND status = 1")
-        return [ip[0] for ip in cursor.fetchall()]
-
-    def acquire_permission(self):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        return [branch.ip for branch in self.cluster.view.peers if branch.nodo_maestro == 0]
+
+    # Función para obtener el permiso de exclusión mutua del maestro. Si el maestro no responde, este nodo se
+    # elige como nuevo maestro y se vuelve a intentar, a lo más una vez por sucursal registrada. Si el maestro
+    # está sobrecargado (control de admisión) se espera con backoff y se reintenta; agotados `busy_retries`
+    # reintentos se avisa que el sistema está ocupado y se devuelve False sin tomar el permiso
+    @traced("acquire_permission")
+    @timed("acquire_permission")
+    def acquire_permission(self, busy_retries=5, busy_delay=0.2):
+        self.semaphore_writer.acquire()
+        granted = False
         try:
-            master_ip = self.get_master_node_ip()
-            client_socket.connect((master_ip, 2222))
-            client_socket.send("acquire_permission".encode())
-            data = client_socket.recv(1024).decode()
-            if data == "authorized_permission":
-                print("\n>> Exclusión mutua: Permiso autorizado.")
-            client_socket.close()
-            self.check_active_nodes()
-        except ConnectionRefusedError:
-            client_socket.close()
-            self.new_master_node(self.get_master_node_id(), self.get_current_sucursal_id())
-            print("\n>> Elección: Seleccionado nuevo nodo maestro - Nodo ID", self.get_current_sucursal_id())
-            self.acquire_permission()
-        except OSError as e:
-            if "[Errno 113] No route to host" in str(e):
-                client_socket.close()
-                self.new_master_node(self.get_master_node_id(), self.get_current_sucursal_id())
-                print("\n>> Elección: Seleccionado nuevo nodo maestro - Nodo ID", self.get_current_sucursal_id())
-                self.acquire_permission()
+            if self.get_current_sucursal_id() is None:
+                print("\n>> Exclusión mutua: Este nodo no figura en SUCURSAL; no puede escribir.")
+                return False
+            elections = 0
+            busy_attempts = 0
+            while elections < len(self.cluster.view.branches):
+                lock_wait_start = self.clock.perf_counter()
+                master_ip = self.get_master_node_ip()
+                try:
+                    data = self.call(master_ip, "acquire_permission")
+                except PeerBusyError:
+                    if busy_attempts == busy_retries:
+                        print("\n>> Exclusión mutua: Sistema ocupado, intente de nuevo más tarde.")
+                        return False
+                    self.clock.sleep(self.clock.random.uniform(0, busy_delay * 2 ** busy_attempts))
+                    busy_attempts += 1
+                    continue
+                except PeerUnavailableError:
+                    elections += 1
+                    self.new_master_node(self.get_master_node_id(), self.get_current_sucursal_id())
+                    print("\n>> Elección: Seleccionado nuevo nodo maestro - Nodo ID", self.get_current_sucursal_id())
+                    continue
+                if data.startswith("authorized_permission"):
+                    self.write_index = int(data.split("|")[1])
+                    self.lock_wrote = False
+                    self.permission_acquired_at = self.clock.perf_counter()
+                    self.metrics.observe("nodo_lock_wait_seconds", self.permission_acquired_at - lock_wait_start, side="solicitante")
+                    print("\n>> Exclusión mutua: Permiso autorizado.")
+                granted = True
+                self.check_active_nodes()
+                return True
+            raise PeerUnavailableError("Ningún nodo maestro otorgó el permiso de exclusión mutua")
+        finally:
+            # Con el permiso tomado el escritor sigue siendo este hasta release_permission
+            if not granted:
+                self.semaphore_writer.release()
 
+    @traced("release_permission")
+    @timed("release_permission")
     def release_permission(self):
-        master_ip = self.get_master_node_ip()
-        self.send_message_to_node(master_ip, "release_permission")
+        try:
+            master_ip = self.get_master_node_ip()
+            if self.lock_wrote:
+                # La escritura ya se aplicó localmente y los demás nodos confirmaron el consenso
+                self.mark_applied(self.write_index)
+            message = f"release_permission|{self.write_index or 0}|{int(self.lock_wrote)}"
+            if self.shard_usage is not None:
+                message += "|{}|{}".format(*self.shard_usage)
+            self.send_message_to_node(master_ip, message)
+        finally:
+            self.write_index = None
+            self.lock_wrote = False
+            self.shard_usage = None
+            if self.permission_acquired_at is not None:
+                self.metrics.observe("nodo_lock_hold_seconds", self.clock.perf_counter() - self.permission_acquired_at)
+                self.permission_acquired_at = None
+            self.semaphore_writer.release()
         print("\n>> Exclusión mutua: Permiso finalizado.")
 
+    # Función para verificar los nodos activos con heart_beat. En modo particionado se omiten los pares con un
+    # intercambio exitoso reciente (así los mensajes por escritura no crecen con el clúster) y las respuestas
+    # traen el espacio usado de cada sucursal
+    @traced("check_active_nodes")
     def check_active_nodes(self):
         nodes_ips = self.get_ip_active_nodes_less_master(self.cursor)
         for ip in nodes_ips:
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            state = self.transport.peers.get(ip)
+            if (self.sharded and state is not None and state.last_success is not None
+                    and self.clock.monotonic() - state.last_success < self.heartbeat_interval):
+                continue
             try:
-                client_socket.connect(( ip, 2222))
-                client_socket.send("heart_beat".encode())
-                data = client_socket.recv(1024).decode()
-                if data == "still_here":
-                    pass
-                client_socket.close()
-            except ConnectionRefusedError:
-                client_socket.close()
+                heartbeat_start = self.clock.perf_counter()
+                data = self.call(ip, "heart_beat")
+                if data.startswith("still_here"):
+                    self.metrics.observe("nodo_heartbeat_rtt_seconds", self.clock.perf_counter() - heartbeat_start, peer=ip)
+                fields = data.split("|")
+                branch = self.cluster.view.by_ip.get(ip)
+                if len(fields) == 2 and branch is not None and branch.espacio_usado != int(fields[1]):
+                    self.apply_local(f"set_espacio_usado|{branch.id_sucursal}|{fields[1]}")
+            except PeerUnavailableError:
                 self.node_failure(self.get_node_failure_id(ip))
                 print("\n>> Falla de nodo: Nodo ID ",self.get_node_failure_id(ip))
-            except OSError as e:
-                if "[Errno 113] No route to host" in str(e):
-                    client_socket.close()
-                    self.node_failure(self.get_node_failure_id(ip))
-                    print("\n>> Falla de nodo: Nodo ID ",self.get_node_failure_id(ip))
 
     # Función para enviar mensaje al nodo maestro sobre la falla de un nodo
+    @traced("node_failure")
     def node_failure(self, id):
         message = f"node_failure|{id}"
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         master_ip = self.get_master_node_ip()
-        client_socket.connect((master_ip, 2222))
-        client_socket.send(f"{message}".encode())
-        data = client_socket.recv(1024).decode()
-        if data == "master_node_failure_updated":
-            pass
-        client_socket.close()
+        self.call(master_ip, message, reply_timeout=30)
 
     def send_message_node_failure_node_active(self, ip, message):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client_socket.connect((ip, 2222))
-        client_socket.send(f"{message}".encode())
-        data = client_socket.recv(1024).decode()
-        if data == "node_failure_updated":
-            pass
-        client_socket.close()
+        self.call(ip, message, reply_timeout=30)
 
-    def update_node_failure(self, cursor, id):
+    # Función para registrar la caída de un nodo. En modo particionado devuelve la redistribución de sus
+    # artículos (ver redistribute_shard_articles)
+    def update_node_failure(self, cursor, id, placement=None):
+        redistribution_start = self.clock.perf_counter()
         try:
             # Actualizar el nodo caído
             cursor.execute("""
@@ -674,6 +3304,9 @@ class Nodo:
             """, (id,))
             cursor.connection.commit()
 
+            if self.sharded:
+                return self.redistribute_shard_articles(cursor, id, placement)
+
             # Obtener la lista de artículos del nodo caído
             cursor.execute("""
                 SELECT id_articulo, id_sucursal
@@ -734,40 +3367,341 @@ class Nodo:
 
         except Exception as e:
             print(f"\n>> Error en update_node_failure: {e} \n")
+        finally:
+            self.metrics.observe("nodo_redistribution_seconds", self.clock.perf_counter() - redistribution_start, reason="node_failure")
+
+    @staticmethod
+    def merkle_hash(value):
+        return hashlib.md5(value.encode()).hexdigest()[:16]
+
+    def merkle_bucket(self, key):
+        return int(hashlib.md5(str(key).encode()).hexdigest()[:8], 16) % (2 ** self.merkle_depth)
+
+    # Función para construir el árbol de Merkle de una tabla. Las hojas agrupan las filas por el hash de
+    # su llave natural; levels[0] es la raíz y levels[profundidad] son las hojas. De GUIA_ENVIO sólo se
+    # comparan los meses calientes: los fríos se archivan en cada nodo por su cuenta. En modo particionado la
+    # tabla puede venir como "ARTICULO:dueña:sucursal" o "GUIA_ENVIO:dueña:sucursal" (ver filter_shard_rows)
+    def build_merkle_tree(self, cursor, table):
+        table, _, scope = table.partition(":")
+        key, columns = ANTI_ENTROPY_TABLES[table]
+        if table == "GUIA_ENVIO":
+            rows = self.guia_envio.select(cursor, columns, since=self.guia_envio.cutoff(self.clock.time()))
+        else:
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table}")
+            rows = cursor.fetchall()
+        if scope:
+            id_owner, id_host = (int(field) for field in scope.split(":"))
+            rows = self.filter_shard_rows(cursor, table, rows, id_owner, id_host)
+        buckets = [[] for _ in range(2 ** self.merkle_depth)]
+        for row in rows:
+            buckets[self.merkle_bucket(row[0])].append(list(row))
+
+        leaves = []
+        for bucket in buckets:
+            bucket.sort(key=lambda row: str(row[0]))
+            leaves.append(self.merkle_hash("".join(self.merkle_hash(json.dumps(row)) for row in bucket)))
+
+        levels = [leaves]
+        while len(levels[0]) > 1:
+            children = levels[0]
+            levels.insert(0, [self.merkle_hash(children[i] + children[i + 1]) for i in range(0, len(children), 2)])
+        return levels, buckets
+
+    # Función para quedarse con las filas (de ARTICULO o GUIA_ENVIO) de los artículos de la sucursal `id_owner`
+    # que también guarda `id_host`: lo que deben tener en común esas dos réplicas en modo particionado. Las guías
+    # se asocian a su artículo por el id_articulo de la copia local
+    def filter_shard_rows(self, cursor, table, rows, id_owner, id_host):
+        def shared(codigo, id_sucursal):
+            return id_sucursal == id_owner and id_host in self.get_article_hosts(cursor, codigo, id_sucursal)
+
+        if table == "ARTICULO":
+            return [row for row in rows if shared(row[0], row[1])]
+        cursor.execute("SELECT id_articulo, codigo, id_sucursal FROM ARTICULO")
+        articles = {id_articulo: (codigo, id_sucursal) for id_articulo, codigo, id_sucursal in cursor.fetchall()}
+        return [row for row in rows if row[2] in articles and shared(*articles[row[2]])]
+
+    # Función para obtener el árbol de Merkle de una tabla, reutilizándolo durante un mismo recorrido de un par
+    # (con refresh se reconstruye)
+    @timed("get_merkle_tree")
+    def get_merkle_tree(self, cursor, table, refresh=False):
+        with self.semaphore_merkle_cache:
+            cached = self.merkle_cache.get(table)
+            if refresh or cached is None or self.clock.time() - cached[0] > 2:
+                cached = (self.clock.time(),) + self.build_merkle_tree(cursor, table)
+                self.merkle_cache[table] = cached
+            return cached[1], cached[2]
+
+    # Función para enviar una consulta de anti-entropía y leer la respuesta completa (puede superar 1024 bytes)
+    def send_message_anti_entropy_to_node(self, ip, message):
+        return self.call(ip, message, read_all=True)
+
+    # Función para reemplazar las filas locales de un rango de la tabla por las filas del par
+    def repair_merkle_bucket(self, cursor, table, local_rows, remote_rows):
+        table = table.partition(":")[0]
+        key, columns = ANTI_ENTROPY_TABLES[table]
+        remote_keys = {row[0] for row in remote_rows}
+        id_actual_node = self.get_current_sucursal_id_continue_consensus(cursor) if table == "SUCURSAL" else None
+
+        for row in local_rows:
+            if row[0] not in remote_keys and row[0] != id_actual_node:
+                if table == "GUIA_ENVIO":
+                    self.guia_envio.delete(cursor, row[0], row[5])
+                else:
+                    cursor.execute(f"DELETE FROM {table} WHERE {key} = ?", (row[0],))
+
+        if table == "GUIA_ENVIO":
+            for row in remote_rows:
+                self.guia_envio.upsert(cursor, *row)
+            cursor.connection.commit()
+            return
+
+        if table == "ARTICULO" and self.sharded:
+            # El id_articulo de cada réplica es local (ver store_shard_articulo)
+            for codigo, id_sucursal, nombre, precio, stock in remote_rows:
+                self.store_shard_articulo(cursor, codigo, nombre, precio, stock, id_sucursal)
+            cursor.connection.commit()
+            return
+
+        insert_columns = columns + (["nodo_actual"] if table == "SUCURSAL" else [])
+        updates = ", ".join(f"{column} = excluded.{column}" for column in columns[1:])
+        for row in remote_rows:
+            # La sucursal actual se mantiene activa aunque el resto del clúster la considere caída
+            if row[0] == id_actual_node:
+                row = row[:3] + [1] + row[4:]
+            values = row + ([0] if table == "SUCURSAL" else [])
+            cursor.execute(f"""
+                INSERT INTO {table} ({', '.join(insert_columns)})
+                VALUES ({', '.join('?' for _ in insert_columns)})
+                ON CONFLICT({key}) DO UPDATE SET {updates}
+            """, values)
+        cursor.connection.commit()
+
+    # Función para sincronizar una tabla con un par: se desciende por el árbol de Merkle sólo en los
+    # subárboles con hash distinto (O(log n) intercambios por rango) y se transfieren sólo esos rangos
+    def sync_table_with_node(self, cursor, ip, table):
+        levels, buckets = self.build_merkle_tree(cursor, table)
+        if self.send_message_anti_entropy_to_node(ip, f"merkle_root|{table}") == levels[0][0]:
+            return 0
+
+        differing = [0]
+        for level in range(self.merkle_depth):
+            next_differing = []
+            for index in differing:
+                remote_children = self.send_message_anti_entropy_to_node(ip, f"merkle_node|{table}|{level}|{index}").split("|")
+                for offset, remote_hash in enumerate(remote_children):
+                    child = 2 * index + offset
+                    if levels[level + 1][child] != remote_hash:
+                        next_differing.append(child)
+            differing = next_differing
+
+        for leaf in differing:
+            remote_rows = json.loads(self.send_message_anti_entropy_to_node(ip, f"merkle_rows|{table}|{leaf}"))
+            self.repair_merkle_bucket(cursor, table, buckets[leaf], remote_rows)
+        return len(differing)
+
+    # Función de anti-entropía: cada nodo compara sus tablas con las del nodo maestro, que recibe todas
+    # las escrituras bajo exclusión mutua y se toma como referencia. En modo particionado ARTICULO y GUIA_ENVIO
+    # se comparan en cambio con cada sucursal activa, sólo en los artículos de los que ella es dueña y que este
+    # nodo también guarda: la dueña es la referencia (replicate_articulo le escribe primero y cancela la
+    # escritura si ella no la aplica). Usa su propia conexión a la base de datos para no bloquear el camino
+    # del consenso. Las raíces se comparan sin coordinarse, pero sólo se repara con la exclusión mutua del
+    # maestro tomada sin esperar (try_permission) y sin rondas de consenso propias a medio aplicar (el nodo
+    # inicial suelta el permiso sin esperar al último participante): si no, se podría copiar del par una fila
+    # que este nodo todavía va a insertar (y su apply_local fallaría) o borrar una que el par todavía no
+    # aplicó. Si hay una escritura en curso la reparación se deja para la siguiente vuelta. Devuelve False si
+    # se postergó
+    def run_anti_entropy(self):
+        local_connection = self.connect_db()
+        cursor = local_connection.cursor()
+        try:
+            master = self.cluster.view.master
+            if master is None:
+                return True
+
+            # Pares (ip, tabla) a comparar
+            pairs = []
+            if master.nodo_actual == 0:
+                pairs += [(master.ip, table) for table in ANTI_ENTROPY_TABLES
+                          if not (self.sharded and table in ("ARTICULO", "GUIA_ENVIO"))]
+            id_actual_node = self.get_current_sucursal_id_continue_consensus(cursor)
+            if self.sharded and id_actual_node is not None:
+                pairs += [(branch.ip, f"{table}:{branch.id_sucursal}:{id_actual_node}")
+                          for branch in self.cluster.view.peers for table in ("ARTICULO", "GUIA_ENVIO")]
+
+            differing = []
+            for ip, table in pairs:
+                levels, _ = self.build_merkle_tree(cursor, table)
+                try:
+                    if self.send_message_anti_entropy_to_node(ip, f"merkle_root|{table}") != levels[0][0]:
+                        differing.append((ip, table))
+                except PeerUnavailableError:
+                    # Una réplica caída no detiene la comparación con las demás (el maestro sí)
+                    if ip == master.ip:
+                        raise
+            if not differing:
+                return True
+
+            granted = not self.rounds_in_flight and self.call(master.ip, "try_permission") == "authorized_repair"
+            try:
+                # Una ronda pudo llegar mientras se pedía el permiso
+                if not granted or self.rounds_in_flight:
+                    print(f"\n>> Anti-entropía: hay una escritura en curso, se posterga la reparación de {', '.join(table for _, table in differing)}")
+                    return False
+                for ip, table in differing:
+                    repaired = self.sync_table_with_node(cursor, ip, table)
+                    if repaired:
+                        print(f"\n>> Anti-entropía: {table} - {repaired} rango(s) reparado(s)")
+            finally:
+                if granted:
+                    self.send_message_to_node(master.ip, "release_permission|0|0")
+            return True
+        finally:
+            cursor.close()
+            local_connection.close()
+
+    # Función para archivar los meses fríos de GUIA_ENVIO con su propia conexión a la base de datos
+    def run_archive(self):
+        local_connection = self.connect_db()
+        cursor = local_connection.cursor()
+        try:
+            for month, count in self.guia_envio.archive(cursor, self.clock.time()):
+                print(f"\n>> Archivo: {count} guía(s) de {month} compactadas en {self.guia_envio.archive_path(month)}")
+        except Exception:
+            local_connection.rollback()
+            raise
+        finally:
+            cursor.close()
+            local_connection.close()
+
+    def archive_loop(self):
+        while self.is_running:
+            try:
+                self.run_archive()
+            except Exception as e:
+                print(f"\n>> Error en archive: {e} \n")
+            self.clock.sleep(self.archive_interval)
+
+    def anti_entropy_loop(self):
+        while self.is_running:
+            self.clock.sleep(self.anti_entropy_interval)
+            try:
+                self.run_anti_entropy()
+            except Exception as e:
+                print(f"\n>> Error en anti_entropy: {e} \n")
+
+    # Función para planear una ronda de rebalanceo: mientras haya una sucursal con utilización por encima de
+    # la global más la tolerancia y otra con espacio libre, se mueve un artículo de la más excedida a la más
+    # holgada (sólo si el movimiento reduce el desvío). Devuelve los movimientos (codigo, origen, destino)
+    def plan_rebalance(self, cursor, limit):
+        cursor.execute("SELECT id_sucursal, capacidad, espacio_usado FROM SUCURSAL WHERE status = 1 AND capacidad > 0")
+        branches = {id_sucursal: [capacidad, espacio_usado] for id_sucursal, capacidad, espacio_usado in cursor.fetchall()}
+        total_capacity = sum(capacidad for capacidad, _ in branches.values())
+        if not branches:
+            return []
+        target = sum(espacio_usado for _, espacio_usado in branches.values()) / total_capacity
+
+        def excess(id_sucursal):
+            capacidad, espacio_usado = branches[id_sucursal]
+            return espacio_usado - capacidad * target
+
+        moves = []
+        candidates = {}
+        while len(moves) < limit:
+            donor = max(branches, key=excess)
+            receiver = min(branches, key=excess)
+            donor_capacity, donor_used = branches[donor]
+            receiver_capacity, receiver_used = branches[receiver]
+            if (donor_used / donor_capacity - target <= self.rebalance_tolerance or receiver_used >= receiver_capacity
+                    or excess(donor) - excess(receiver) <= 1):
+                break
+
+            if donor not in candidates:
+                cursor.execute("SELECT codigo FROM ARTICULO WHERE id_sucursal = ? ORDER BY id_articulo DESC", (donor,))
+                candidates[donor] = [row[0] for row in cursor.fetchall()]
+            if not candidates[donor]:
+                break
+            moves.append((candidates[donor].pop(0), donor, receiver))
+            branches[donor][1] -= 1
+            branches[receiver][1] += 1
+        return moves
+
+    # Función para ejecutar una ronda de rebalanceo en el maestro. Sólo toma la exclusión mutua si está libre
+    # (una escritura en primer plano nunca espera detrás del rebalanceo) y replica el lote en un solo consenso.
+    # Es una escritura más de este nodo: toma también el semáforo de escritor, así no pisa el write_index de
+    # una escritura de la API que acaba de devolver el permiso, y grant_index y last_write_index sólo cambian
+    # con la exclusión mutua tomada, como en acquire_permission y release_permission
+    @traced("rebalance")
+    def run_rebalance(self, cursor):
+        master = self.cluster.view.master
+        if master is None or master.nodo_actual != 1:
+            return 0
+
+        limit = min(self.rebalance_batch, int(self.rebalance_tokens))
+        if limit < 1 or not self.semaphore_writer.acquire(blocking=False):
+            return 0
+        try:
+            if not self.semaphore_mutual_exclusion.acquire(blocking=False):
+                return 0
+            return self.run_rebalance_round(cursor, limit)
+        finally:
+            self.semaphore_writer.release()
+
+    # Función para planear, replicar y aplicar una ronda de rebalanceo con la exclusión mutua tomada (la suelta)
+    def run_rebalance_round(self, cursor, limit):
+        rebalance_start = self.clock.perf_counter()
+        try:
+            moves = self.plan_rebalance(cursor, limit)
+            if not moves:
+                return 0
+            # El lote viaja en un solo mensaje
+            message = "migrate_articulos|" + ",".join(f"{codigo}:{id_origen}:{id_destino}" for codigo, id_origen, id_destino in moves)
+            self.grant_index += 1
+            self.write_index = self.grant_index
+            self.send_messages_to_nodes(message, cursor)
+            self.apply_local(message)
+            self.mark_applied(self.write_index)
+            self.last_write_index = max(self.last_write_index, self.write_index)
+            self.write_index = None
+            self.lock_wrote = False
+            self.rebalance_tokens -= len(moves)
+            self.metrics.inc("nodo_rebalance_articles_total", len(moves))
+            for codigo, id_origen, id_destino in moves:
+                print(f"\n>> Rebalanceo: Artículo {codigo} migrado de Nodo {id_origen} a Nodo {id_destino}")
+            return len(moves)
+        finally:
+            self.release_mutual_exclusion()
+            self.metrics.observe("nodo_rebalance_round_seconds", self.clock.perf_counter() - rebalance_start)
+
+    def rebalance_loop(self):
+        local_connection = self.connect_db()
+        cursor = local_connection.cursor()
+        try:
+            while self.is_running:
+                self.clock.sleep(self.rebalance_interval)
+                # Cubeta de fichas: se acumulan rebalance_rate fichas por segundo, hasta un lote completo
+                self.rebalance_tokens = min(self.rebalance_tokens + self.rebalance_rate * self.rebalance_interval, self.rebalance_batch)
+                try:
+                    self.run_rebalance(cursor)
+                except Exception as e:
+                    print(f"\n>> Error en rebalance: {e} \n")
+        finally:
+            cursor.close()
+            local_connection.close()
 
     def sum_capacity_active_branches(self):
-        self.cursor.execute("""
-            SELECT SUM(capacidad) FROM SUCURSAL WHERE status = 1
-        """)
-        sum_capacity = self.cursor.fetchone()[0]
-        return sum_capacity
+        return self.cluster.view.total_capacity
 
     def sum_used_space_active_branches(self):
-        self.cursor.execute("""
-            SELECT SUM(espacio_usado) FROM SUCURSAL WHERE status = 1
-        """)
-        sum_used_space = self.cursor.fetchone()[0]
-        return sum_used_space if sum_used_space is not None else 0
+        return self.cluster.view.total_used
     
+    @traced("master_node_distributes_new_article")
     def master_node_distributes_new_article(self):
-        client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         master_ip = self.get_master_node_ip()
-        client_socket.connect((master_ip, 2222))
-        client_socket.send("distribute_new_article".encode())
-        data = client_socket.recv(1024).decode()
-        if data is not None:
-            pass
-        client_socket.close()
-        return data
+        return self.call(master_ip, "distribute_new_article")
         
     def automatic_distribution_new_article(self, cursor):
-        # Seleccionar registros con status igual a 1
-        cursor.execute("""
-            SELECT id_sucursal, capacidad, espacio_usado
-            FROM SUCURSAL
-            WHERE status = 1
-        """)
-        sucursales_data = cursor.fetchall()
+        # Sucursales con status igual a 1
+        sucursales_data = self.cluster.view.active
 
         if not sucursales_data:
             # No hay sucursales disponibles
@@ -776,10 +3710,10 @@ class Nodo:
         # Calcular espacio disponible para cada sucursal
         max_space_sucursal = max(
             sucursales_data,
-            key=lambda sucursal: sucursal[1] - sucursal[2]
+            key=lambda sucursal: sucursal.capacidad - sucursal.espacio_usado
         )
 
-        id_branch_new_article = max_space_sucursal[0]
+        id_branch_new_article = max_space_sucursal.id_sucursal
         return id_branch_new_article
 
     def main_menu(self):
@@ -789,6 +3723,7 @@ class Nodo:
             print("2. Operaciones con Artículos")
             print("3. Operaciones con Guías de Envío")
             print("4. Estado de Sucursales")
+            print("5. Análisis de Capacidad")
             print("0. Salir")
 
             choice = input(">> Ingrese su opción: ")
@@ -800,6 +3735,8 @@ class Nodo:
                 self.guia_envio_menu()
             elif choice == '4':
                 self.estado_sucursales()
+            elif choice == '5':
+                self.analisis_capacidad()
             elif choice == '0':
                 self.is_running = False
                 break
@@ -807,6 +3744,181 @@ class Nodo:
                 print("\n>> Opción no válida. Intente de nuevo.")
         print("\n>> Ctrl+Z o Ctrl+C para finalizar el programa.")
 
+    # API programática de lecturas con nivel de consistencia ("local", "bounded" o "linearizable"). En modo
+    # particionado los artículos se leen de sus sucursales dueñas y las garantías aplican a las tablas replicadas
+    def api_read_cliente(self, usuario, consistency="local", max_staleness=1.0):
+        with self.span("read_cliente"):
+            self.ensure_read_consistency(consistency, max_staleness)
+            self.cursor.execute("SELECT id_cliente, usuario, nombre, direccion, tarjeta, status FROM CLIENTE WHERE usuario = ?", (usuario,))
+            return self.cursor.fetchone()
+
+    def api_read_articulo(self, codigo, consistency="local", max_staleness=1.0):
+        with self.span("read_articulo"):
+            self.ensure_read_consistency(consistency, max_staleness)
+            if self.sharded:
+                return self.lookup_articulo(codigo)
+            self.cursor.execute("SELECT id_articulo, precio, stock, id_sucursal FROM ARTICULO WHERE codigo = ?", (codigo,))
+            return self.cursor.fetchone()
+
+    def api_check_articulo_disponible(self, codigo, consistency="local", max_staleness=1.0):
+        with self.span("check_articulo_disponible"):
+            self.ensure_read_consistency(consistency, max_staleness)
+            return self.check_articulo_disponible(codigo)
+
+    # API programática de operaciones replicadas (la usan los menús y el benchmark de varios nodos).
+    # Cada operación devuelve True si se replicó y aplicó, o False si no se cumplieron sus condiciones o
+    # el maestro estaba ocupado y no otorgó el permiso
+    def api_create_cliente(self, usuario, nombre, direccion, tarjeta):
+        if self.check_user_exists(usuario):
+            return False
+        with self.span("create_cliente"):
+            if not self.acquire_permission():
+                return False
+            try:
+                message = f"create_cliente|{usuario}|{nombre}|{direccion}|{tarjeta}"
+                self.send_messages_to_nodes(message)
+
+                self.apply_local(message)
+            finally:
+                self.release_permission()
+        return True
+
+    def api_update_cliente(self, usuario, nombre, direccion, tarjeta):
+        if not self.check_user_exists(usuario):
+            return False
+        with self.span("update_cliente"):
+            if not self.acquire_permission():
+                return False
+            try:
+                message = f"update_cliente|{usuario}|{nombre}|{direccion}|{tarjeta}"
+                self.send_messages_to_nodes(message)
+
+                self.apply_local(message)
+            finally:
+                self.release_permission()
+        return True
+
+    def api_activate_cliente(self, usuario):
+        if not self.check_user_exists(usuario):
+            return False
+        with self.span("activate_cliente"):
+            if not self.acquire_permission():
+                return False
+            try:
+                message = f"activate_cliente|{usuario}"
+                self.send_messages_to_nodes(message)
+
+                self.apply_local(message)
+            finally:
+                self.release_permission()
+        return True
+
+    def api_deactivate_cliente(self, usuario):
+        if not self.check_user_exists(usuario):
+            return False
+        with self.span("deactivate_cliente"):
+            if not self.acquire_permission():
+                return False
+            try:
+                message = f"deactivate_cliente|{usuario}"
+                self.send_messages_to_nodes(message)
+
+                self.apply_local(message)
+            finally:
+                self.release_permission()
+        return True
+
+    def api_create_articulo(self, codigo, nombre, precio):
+        if int(self.sum_used_space_active_branches()) >= int(self.sum_capacity_active_branches()):
+            return False
+        if self.check_code_exists(codigo):
+            return False
+        with self.span("create_articulo"):
+            if not self.acquire_permission():
+                return False
+            try:
+                id_sucursal = int(self.master_node_distributes_new_article())
+                message = f"create_articulo|{codigo}|{nombre}|{precio}|{id_sucursal}"
+                if not self.replicate_articulo(message, codigo, id_sucursal):
+                    return False
+            finally:
+                self.release_permission()
+        return True
+
+    def api_update_articulo(self, codigo, nombre, precio):
+        if not self.check_code_exists(codigo):
+            return False
+        with self.span("update_articulo"):
+            if not self.acquire_permission():
+                return False
+            try:
+                message = f"update_articulo|{codigo}|{nombre}|{precio}"
+                if not self.replicate_articulo(message, codigo):
+                    return False
+            finally:
+                self.release_permission()
+        return True
+
+    def api_restock_articulo(self, codigo):
+        if not self.check_code_exists(codigo):
+            return False
+        with self.span("restock_articulo"):
+            if not self.acquire_permission():
+                return False
+            try:
+                message = f"restock_articulo|{codigo}"
+                if not self.replicate_articulo(message, codigo):
+                    return False
+            finally:
+                self.release_permission()
+        return True
+
+    def api_deactivate_articulo(self, codigo):
+        if not self.check_code_exists(codigo):
+            return False
+        with self.span("deactivate_articulo"):
+            if not self.acquire_permission():
+                return False
+            try:
+                message = f"deactivate_articulo|{codigo}"
+                if not self.replicate_articulo(message, codigo):
+                    return False
+            finally:
+                self.release_permission()
+        return True
+
+    def api_comprar(self, usuario, codigo):
+        created = False
+        with self.span("create_guia_envio"):
+            if not self.acquire_permission():
+                return False
+            try:
+                # Verificar si el usuario y código existen y tienen los formatos correctos
+                user_exists = self.check_user_exists(usuario)
+                code_exists = self.check_code_exists(codigo)
+
+                if user_exists and code_exists:
+
+                    # Verificar si el usuario está activo y si hay stock
+                    usuario_activo = self.check_cliente_activo(usuario)
+                    stock_disponible = self.check_articulo_disponible(codigo)
+
+                    if usuario_activo and stock_disponible:
+                        # Obtener los datos necesarios
+                        id_cliente = self.get_cliente_id(usuario)
+                        id_articulo = self.get_articulo_id(codigo)
+                        id_sucursal = self.get_current_sucursal_id()
+                        now = time.localtime(self.clock.time())
+                        serie = int(time.strftime("%Y", now)) + int(time.strftime("%m", now)) + int(time.strftime("%d", now)) + int(time.strftime("%H", now)) + int(time.strftime("%M", now)) + int(time.strftime("%S", now)) + id_sucursal + int(self.clock.random.randint(1, 100))
+                        monto_total = self.get_articulo_price(codigo)
+                        fecha_compra = time.strftime("%Y-%m-%d %H:%M:%S", now)
+
+                        message = f"create_guia_envio|{id_cliente}|{id_articulo}|{id_sucursal}|{serie}|{monto_total}|{fecha_compra}"
+                        created = self.replicate_articulo(message, codigo)
+            finally:
+                self.release_permission()
+        return created
+
     def cliente_menu(self):
         while True:
             print("\n=== Menú de Operaciones con Clientes ===")
@@ -829,14 +3941,7 @@ class Nodo:
                     direccion = input(">> Ingrese la dirección: ")
                     tarjeta = int(input(">> Ingrese el número de tarjeta: "))
 
-                    self.acquire_permission()
-
-                    message = f"create_cliente|{usuario}|{nombre}|{direccion}|{tarjeta}"
-                    self.send_messages_to_nodes(message)
-
-                    self.create_cliente(self.cursor, usuario, nombre, direccion, tarjeta)
-
-                    self.release_permission()
+                    self.api_create_cliente(usuario, nombre, direccion, tarjeta)
             elif choice == '2':
                 self.read_cliente()
             elif choice == '3':
@@ -850,44 +3955,13 @@ class Nodo:
                     direccion = input(">> Ingrese la nueva dirección: ")
                     tarjeta = int(input(">> Ingrese la nueva tarjeta: "))
 
-                    self.acquire_permission()
-
-                    message = f"update_cliente|{usuario}|{nombre}|{direccion}|{tarjeta}"
-                    self.send_messages_to_nodes(message)
-                    
-                    self.update_cliente(self.cursor, usuario, nombre, direccion, tarjeta)
-
-                    self.release_permission()
+                    self.api_update_cliente(usuario, nombre, direccion, tarjeta)
             elif choice == '4':
                 usuario = input(">> Ingrese el usuario del cliente a activar: ")
-    
-                # Verificar si el usuario existe y tiene el formato correcto
-                user_exists = self.check_user_exists(usuario)
-    
-                if user_exists:
-                    self.acquire_permission()
-
-                    message = f"activate_cliente|{usuario}"
-                    self.send_messages_to_nodes(message)
-
-                    self.activate_cliente(self.cursor, usuario)
-
-                    self.release_permission()
+                self.api_activate_cliente(usuario)
             elif choice == '5':
                 usuario = input(">> Ingrese el usuario del cliente a desactivar: ")
-    
-                # Verificar si el usuario existe y tiene el formato correcto
-                user_exists = self.check_user_exists(usuario)
-    
-                if user_exists:
-                    self.acquire_permission()
-
-                    message = f"deactivate_cliente|{usuario}"
-                    self.send_messages_to_nodes(message)
-                    
-                    self.deactivate_cliente(self.cursor, usuario)
-
-                    self.release_permission()
+                self.api_deactivate_cliente(usuario)
             elif choice == '0':
                 break
             else:
@@ -917,15 +3991,7 @@ class Nodo:
                         nombre = input(">> Ingrese el nombre del artículo: ")
                         precio = float(input(">> Ingrese el precio del artículo: "))
 
-                        self.acquire_permission()
-
-                        id_sucursal = int(self.master_node_distributes_new_article())
-                        message = f"create_articulo|{codigo}|{nombre}|{precio}|{id_sucursal}"
-                        self.send_messages_to_nodes(message)
-                    
-                        self.create_articulo(self.cursor, codigo, nombre, precio, id_sucursal)
-
-                        self.release_permission()
+                        self.api_create_articulo(codigo, nombre, precio)
                 elif used_space == capacity:
                     print("\n>> Aviso: Capacidad máxima de artículos alcanzada!!!\n")
             elif choice == '2':
@@ -940,44 +4006,13 @@ class Nodo:
                     nombre = input(">> Ingrese el nuevo nombre: ")
                     precio = float(input(">> Ingrese el nuevo precio: "))
 
-                    self.acquire_permission()
-
-                    message = f"update_articulo|{codigo}|{nombre}|{precio}"
-                    self.send_messages_to_nodes(message)
-
-                    self.update_articulo(self.cursor, codigo, nombre, precio)
-
-                    self.release_permission()
+                    self.api_update_articulo(codigo, nombre, precio)
             elif choice == '4':
                 codigo = int(input(">> Ingrese el código del artículo a reabastecer: "))
-    
-                # Verificar si el código existe y tiene el formato correcto
-                code_exists = self.check_code_exists(codigo)
-    
-                if code_exists:
-                    self.acquire_permission()
-
-                    message = f"restock_articulo|{codigo}"
-                    self.send_messages_to_nodes(message)
-
-                    self.restock_articulo(self.cursor, codigo)
-
-                    self.release_permission()
+                self.api_restock_articulo(codigo)
             elif choice == '5':
                 codigo = int(input(">> Ingrese el código del artículo a desactivar: "))
-    
-                # Verificar si el código existe y tiene el formato correcto
-                code_exists = self.check_code_exists(codigo)
-    
-                if code_exists:
-                    self.acquire_permission()
-
-                    message = f"deactivate_articulo|{codigo}"
-                    self.send_messages_to_nodes(message)
-                    
-                    self.deactivate_articulo(self.cursor, codigo)
-
-                    self.release_permission()
+                self.api_deactivate_articulo(codigo)
             elif choice == '0':
                 break
             else:
@@ -988,41 +4023,20 @@ class Nodo:
             print("\n=== Menú de Operaciones con Guías de Envío ===")
             print("1. Comprar")
             print("2. Leer Guías de Envío")
+            print("3. Leer Guías de Envío por fechas (incluye archivadas)")
             print("0. Volver al Menú Principal")
 
             choice = input(">> Ingrese su opción: ")
             if choice == '1':
-                self.acquire_permission()
                 usuario = input(">> Ingrese el usuario del cliente: ")
                 codigo = int(input(">> Ingrese el código del artículo: "))
-
-                # Verificar si el usuario y código existen y tienen los formatos correctos
-                user_exists = self.check_user_exists(usuario)
-                code_exists = self.check_code_exists(codigo)
-
-                if user_exists and code_exists:
-
-                    # Verificar si el usuario está activo y si hay stock
-                    usuario_activo = self.check_cliente_activo(usuario)
-                    stock_disponible = self.check_articulo_disponible(codigo)
-
-                    if usuario_activo and stock_disponible:
-                        # Obtener los datos necesarios
-                        id_cliente = self.get_cliente_id(usuario)
-                        id_articulo = self.get_articulo_id(codigo)
-                        id_sucursal = self.get_current_sucursal_id()
-                        serie = int(time.strftime("%Y")) + int(time.strftime("%m")) + int(time.strftime("%d")) + int(time.strftime("%H")) + int(time.strftime("%M")) + int(time.strftime("%S")) + id_sucursal + int(random.randint(1, 100))
-                        monto_total = self.get_articulo_price(codigo)
-                        fecha_compra = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-
-                        message = f"create_guia_envio|{id_cliente}|{id_articulo}|{id_sucursal}|{serie}|{monto_total}|{fecha_compra}"
-                        self.send_messages_to_nodes(message)
-
-                        self.create_guia_envio(self.cursor, id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra)
-
-                self.release_permission()
+                self.api_comprar(usuario, codigo)
             elif choice == '2':
                 self.read_guia_envio()
+            elif choice == '3':
+                since = input(">> Desde (AAAA-MM-DD, vacío sin límite): ").strip() or None
+                until = input(">> Hasta, sin incluir (AAAA-MM-DD, vacío sin límite): ").strip() or None
+                self.read_guia_envio_range(since, until)
             elif choice == '0':
                 break
             else:
@@ -1030,9 +4044,57 @@ class Nodo:
 
 
 if __name__ == "__main__":
-    nodo = Nodo("nodo.db")
-    nodo.create_tables()
-    nodo.insert_initial_sucursales()
+    parser = argparse.ArgumentParser(description="Nodo del sistema distribuido de sucursales")
+    parser.add_argument("--sharded", action="store_true", help="Particionar ARTICULO y GUIA_ENVIO con hash consistente en lugar de replicarlos completos (las escrituras de artículos van directo a sus réplicas, sin consenso)")
+    parser.add_argument("--replicas", type=int, default=1, help="Número de réplicas adicionales por artículo en modo particionado")
+    parser.add_argument("--anti-entropy-interval", type=float, default=30, help="Segundos entre sincronizaciones de anti-entropía con el nodo maestro (0 para desactivar)")
+    parser.add_argument("--metrics", action="store_true", help="Registrar métricas (consultables con el mensaje 'metrics')")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Puerto HTTP para exponer /metrics en formato de Prometheus (0 para desactivar)")
+    parser.add_argument("--tracing", action="store_true", help="Propagar el contexto de trazado y guardar los spans en un buffer circular")
+    parser.add_argument("--trace-log", default=None, help="Archivo JSONL donde se escriben los spans (activa el trazado)")
+    parser.add_argument("--rebalance-interval", type=float, default=0, help="Segundos entre rondas de rebalanceo de artículos en el maestro (0, por defecto, lo desactiva)")
+    parser.add_argument("--rebalance-rate", type=float, default=1.0, help="Artículos por segundo que puede migrar el rebalanceo")
+    parser.add_argument("--rebalance-batch", type=int, default=5, help="Artículos máximos por ronda de rebalanceo (un consenso por ronda; el lote se recorta para caber en un mensaje)")
+    parser.add_argument("--rebalance-tolerance", type=float, default=0.1, help="Desvío de utilización sobre la global a partir del cual se migran artículos")
+    parser.add_argument("--group-commit-size", type=int, default=64, help="Operaciones replicadas máximas por commit")
+    parser.add_argument("--group-commit-delay", type=float, default=0.0, help="Segundos que el escritor espera más operaciones antes de confirmar un grupo")
+    parser.add_argument("--peer-retries", type=int, default=2, help="Reintentos (con espera exponencial y jitter) de los mensajes a otros nodos")
+    parser.add_argument("--breaker-threshold", type=int, default=3, help="Llamadas fallidas seguidas (tras sus reintentos) con un nodo que abren su cortacircuitos")
+    parser.add_argument("--breaker-reset", type=float, default=2.0, help="Segundos que el cortacircuitos queda abierto antes de probar de nuevo")
+    parser.add_argument("--full-votes", action="store_true", help="Enviar el mensaje completo en los votos de consenso en lugar de su resumen")
+    parser.add_argument("--no-batching", action="store_true", help="Enviar cada mensaje en su propia conexión sin agrupar por nodo")
+    parser.add_argument("--compress-threshold", type=int, default=1024, help="Bytes a partir de los cuales se comprime un lote con zlib (0 para no comprimir)")
+    parser.add_argument("--control-in-flight", type=int, default=256, help="Mensajes de control (consenso, latidos, fallas) atendidos a la vez (start_consensus ocupa el suyo ~1 s)")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="Pedidos de la exclusión mutua (acquire_permission, read_index) atendidos a la vez")
+    parser.add_argument("--bulk-in-flight", type=int, default=4, help="Mensajes de fondo (anti-entropía, métricas, trazas) atendidos a la vez")
+    parser.add_argument("--max-queued", type=int, default=64, help="Mensajes normales y de fondo en espera antes de responder 'busy'")
+    parser.add_argument("--control-queued", type=int, default=1024, help="Mensajes de control en espera antes de responder 'busy'")
+    parser.add_argument("--backlog", type=int, default=128, help="Conexiones pendientes de aceptar en el socket del servidor")
+    parser.add_argument("--db", default="nodo.db", help="Archivo de base de datos del nodo")
+    parser.add_argument("--state-file", default=None, help="Archivo de estado para el arranque en caliente (por defecto <db>.state)")
+    parser.add_argument("--state-interval", type=float, default=5.0, help="Segundos entre guardados del estado del nodo (0 para guardar sólo al salir)")
+    parser.add_argument("--cold-start", action="store_true", help="Ignorar el estado guardado y arrancar en frío")
+    parser.add_argument("--archive-dir", default=None, help="Directorio de los meses archivados de GUIA_ENVIO (por defecto <db>_archivo)")
+    parser.add_argument("--hot-months", type=int, default=3, help="Meses de GUIA_ENVIO que quedan en la base de datos; los anteriores se archivan")
+    parser.add_argument("--archive-interval", type=float, default=3600, help="Segundos entre revisiones de meses fríos para archivar (0 para desactivar)")
+    parser.add_argument("--heartbeat-interval", type=float, default=1.0, help="Modo particionado: segundos sin heart_beat a un nodo después de un intercambio exitoso con él")
+    args = parser.parse_args()
+
+    nodo = Nodo(args.db, sharded=args.sharded, replicas=args.replicas, anti_entropy_interval=args.anti_entropy_interval,
+                metrics_enabled=args.metrics or args.metrics_port > 0, tracing_enabled=args.tracing, trace_log_path=args.trace_log,
+                rebalance_interval=args.rebalance_interval, rebalance_rate=args.rebalance_rate,
+                rebalance_batch=args.rebalance_batch, rebalance_tolerance=args.rebalance_tolerance,
+                group_commit_size=args.group_commit_size, group_commit_delay=args.group_commit_delay,
+                peer_retries=args.peer_retries, breaker_threshold=args.breaker_threshold, breaker_reset=args.breaker_reset,
+                digest_votes=not args.full_votes, batch_messages=not args.no_batching, compress_threshold=args.compress_threshold,
+                state_path=args.state_file or args.db + ".state", state_interval=args.state_interval,
+                control_in_flight=args.control_in_flight, max_in_flight=args.max_in_flight, bulk_in_flight=args.bulk_in_flight,
+                max_queued=args.max_queued, control_queued=args.control_queued, backlog=args.backlog, archive_directory=args.archive_dir,
+                hot_months=args.hot_months, archive_interval=args.archive_interval, heartbeat_interval=args.heartbeat_interval)
+    if args.cold_start:
+        nodo.prepare_storage()
+    else:
+        nodo.warm_start()
 
     # Registra la función de manejo de señales para la interrupción (Ctrl+C)
     signal.signal(signal.SIGINT, nodo.signal_handler)
@@ -1041,8 +4103,38 @@ if __name__ == "__main__":
     signal.signal(signal.SIGTSTP, nodo.signal_stop_handler)
 
     # Iniciar el servidor en el nodo
-    server_thread = threading.Thread(target=nodo.start_server, args=(nodo.get_current_sucursal_ip(), 2222))
+    if nodo.get_current_sucursal_ip() is None:
+        print(f">> La base {args.db} no tiene la sucursal de este nodo (SUCURSAL con nodo_actual = 1).")
+        sys.exit(1)
+    server_thread = threading.Thread(target=nodo.start_server, args=nodo.node_address(nodo.get_current_sucursal_ip()))
     server_thread.start()
+
+    # Validar la posición en la secuencia de replicación y guardar el estado periódicamente
+    threading.Thread(target=nodo.catch_up, daemon=True).start()
+    if nodo.state_interval > 0:
+        state_thread = threading.Thread(target=nodo.state_loop, daemon=True)
+        state_thread.start()
+
+    # Iniciar el endpoint HTTP de métricas
+    if args.metrics_port > 0:
+        metrics_thread = threading.Thread(target=nodo.start_metrics_server, args=(nodo.node_address(nodo.get_current_sucursal_ip())[0], args.metrics_port), daemon=True)
+        metrics_thread.start()
+
+    # Archivar los meses fríos de GUIA_ENVIO en segundo plano
+    if nodo.archive_interval > 0:
+        archive_thread = threading.Thread(target=nodo.archive_loop, daemon=True)
+        archive_thread.start()
+
+    # Iniciar la anti-entropía en segundo plano
+    if nodo.anti_entropy_interval > 0:
+        anti_entropy_thread = threading.Thread(target=nodo.anti_entropy_loop, daemon=True)
+        anti_entropy_thread.start()
+
+    # Iniciar el rebalanceo de artículos en segundo plano. En modo particionado mover la sucursal dueña
+    # también cambiaría las réplicas que guardan el artículo, así que ahí sólo se redistribuye ante fallas
+    if nodo.rebalance_interval > 0 and not nodo.sharded:
+        rebalance_thread = threading.Thread(target=nodo.rebalance_loop, daemon=True)
+        rebalance_thread.start()
     
     nodo.main_menu()
 
@@ -0,0 +1,249 @@
+import argparse
+import calendar
+import json
+import os
+import sqlite3
+import time
+import zlib
+import numpy as np
+
+# Tipos de las columnas que se leen de cada tabla. fecha_compra (hora local del nodo) se convierte a
+# segundos en SQLite, así que los intervalos se muestran con gmtime para recuperar la hora local
+SUCURSAL_DTYPE = np.dtype([("id_sucursal", np.int64), ("status", np.int8), ("capacidad", np.int64), ("espacio_usado", np.int64)])
+ARTICULO_DTYPE = np.dtype([("id_sucursal", np.int64)])
+GUIA_ENVIO_DTYPE = np.dtype([("id_guia", np.int64), ("id_sucursal", np.int64), ("monto_total", np.float64), ("fecha_compra", np.int64)])
+
+# Función para convertir segundos de época a la escala de fecha_compra (hora local tratada como UTC)
+def local_seconds(seconds):
+    return calendar.timegm(time.localtime(seconds))
+
+# Función para leer las guías de los meses archivados por el nodo (GUIA_ENVIO_AAAA_MM.json.z, con las
+# columnas de la tabla original) que no tienen partición en la base, a partir del mes de `since_text`
+def load_archived(archive_directory, months, since_text=None, after_id=0):
+    if archive_directory is None or not os.path.isdir(archive_directory):
+        return np.zeros(0, dtype=GUIA_ENVIO_DTYPE)
+    prefix, suffix = "GUIA_ENVIO_", ".json.z"
+    rows = []
+    for name in sorted(os.listdir(archive_directory)):
+        if not (name.startswith(prefix) and name.endswith(suffix)):
+            continue
+        month = name[len(prefix):-len(suffix)].replace("_", "-")
+        if month in months or (since_text is not None and month < since_text[:7]):
+            continue
+        with open(os.path.join(archive_directory, name), "rb") as file:
+            for row in json.loads(zlib.decompress(file.read()))["rows"]:
+                if row[0] > after_id and (since_text is None or row[6] >= since_text):
+                    rows.append((row[0], row[3], row[5], calendar.timegm(time.strptime(row[6], "%Y-%m-%d %H:%M:%S"))))
+    return np.array(rows, dtype=GUIA_ENVIO_DTYPE)
+
+# Función para leer SUCURSAL, ARTICULO y GUIA_ENVIO en forma columnar. np.fromiter consume el cursor sin
+# crear la lista intermedia de tuplas. Con `since` (segundos) solo se leen las guías a partir de esa fecha,
+# con `after_id` solo las guías nuevas (GUIA_ENVIO solo recibe inserciones) y con `archive_directory`
+# también las de los meses que el nodo ya archivó
+def load_columns(connection, since=None, after_id=0, archive_directory=None):
+    cursor = connection.cursor()
+    cursor.execute("SELECT id_sucursal, status, capacidad, espacio_usado FROM SUCURSAL ORDER BY id_sucursal")
+    sucursal = np.fromiter(cursor, dtype=SUCURSAL_DTYPE)
+
+    cursor.execute("SELECT id_sucursal FROM ARTICULO")
+    articulo = np.fromiter(cursor, dtype=ARTICULO_DTYPE)
+
+    # GUIA_ENVIO está particionada por mes (GUIA_ENVIO_AAAA_MM): se leen directamente las particiones que
+    # quedan en la base y se descartan las anteriores al mes de `since`. Las bases sin particionar usan la tabla
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB 'GUIA_ENVIO_[0-9]*' ORDER BY name")
+    tables = [name for (name,) in cursor.fetchall()] or ["GUIA_ENVIO"]
+    months = {name[11:].replace("_", "-") for name in tables}
+    parameters = [after_id]
+    condition = "id_guia > ?"
+    since_text = None
+    if since is not None:
+        since_text = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(since))
+        tables = [name for name in tables if name == "GUIA_ENVIO" or name[11:].replace("_", "-") >= since_text[:7]]
+        parameters.append(since_text)
+        condition += " AND fecha_compra >= ?"
+    guia_envio = load_archived(archive_directory, months, since_text, after_id)
+    for table in tables:
+        cursor.execute(f"SELECT id_guia, id_sucursal, monto_total, CAST(strftime('%s', fecha_compra) AS INTEGER) FROM {table} WHERE {condition}", parameters)
+        guia_envio = np.concatenate((guia_envio, np.fromiter(cursor, dtype=GUIA_ENVIO_DTYPE)))
+    cursor.close()
+    return {"sucursal": sucursal, "articulo": articulo, "guia_envio": guia_envio}
+
+# Función para convertir ids de sucursal en índices 0..n-1 (las sucursales vienen ordenadas por id).
+# Los ids que no existen en SUCURSAL quedan en -1
+def branch_index(branch_ids, ids):
+    index = np.searchsorted(branch_ids, ids)
+    index = np.minimum(index, max(len(branch_ids) - 1, 0))
+    valid = branch_ids[index] == ids if len(branch_ids) else np.zeros(len(ids), dtype=bool)
+    return np.where(valid, index, -1)
+
+# Función para calcular en una pasada las métricas de capacidad y carga de todas las sucursales:
+#   utilization: espacio_usado / capacidad
+#   articles: artículos alojados según ARTICULO (para detectar desvíos respecto a espacio_usado)
+#   sales_count / sales_amount: guías y monto vendido por sucursal
+#   sales_buckets / amount_buckets: matriz sucursal x intervalo de `bucket_seconds`
+#   sales_trend: pendiente (guías por intervalo) de las ventas de cada sucursal
+#   imbalance: utilización menos la utilización global; imbalance_cv: coeficiente de variación entre
+#   sucursales activas; excess: artículos por encima del reparto proporcional a la capacidad
+def compute_report(columns, bucket_seconds=3600):
+    sucursal = columns["sucursal"]
+    branch_ids = sucursal["id_sucursal"]
+    count = len(branch_ids)
+    active = sucursal["status"] == 1
+    capacity = sucursal["capacidad"].astype(np.float64)
+    used = sucursal["espacio_usado"].astype(np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        utilization = np.where(capacity > 0, used / capacity, 0.0)
+
+    article_index = branch_index(branch_ids, columns["articulo"]["id_sucursal"])
+    articles = np.bincount(article_index[article_index >= 0], minlength=count)
+
+    guia_envio = columns["guia_envio"]
+    sale_index = branch_index(branch_ids, guia_envio["id_sucursal"])
+    known = sale_index >= 0
+    sale_index = sale_index[known]
+    amounts = guia_envio["monto_total"][known]
+    dates = guia_envio["fecha_compra"][known]
+    sales_count = np.bincount(sale_index, minlength=count)
+    sales_amount = np.bincount(sale_index, weights=amounts, minlength=count)
+
+    if len(dates):
+        first_bucket = dates.min() // bucket_seconds
+        bucket = dates // bucket_seconds - first_bucket
+        bucket_count = int(bucket.max()) + 1
+        flat = sale_index * bucket_count + bucket
+        sales_buckets = np.bincount(flat, minlength=count * bucket_count).reshape(count, bucket_count)
+        amount_buckets = np.bincount(flat, weights=amounts, minlength=count * bucket_count).reshape(count, bucket_count)
+        bucket_start = (first_bucket + np.arange(bucket_count)) * bucket_seconds
+    else:
+        sales_buckets = np.zeros((count, 0), dtype=np.int64)
+        amount_buckets = np.zeros((count, 0))
+        bucket_start = np.zeros(0, dtype=np.int64)
+
+    # Pendiente de mínimos cuadrados de todas las filas a la vez
+    if sales_buckets.shape[1] > 1:
+        x = np.arange(sales_buckets.shape[1], dtype=np.float64)
+        x -= x.mean()
+        sales_trend = (sales_buckets - sales_buckets.mean(axis=1, keepdims=True)) @ x / (x @ x)
+    else:
+        sales_trend = np.zeros(count)
+
+    total_capacity = capacity[active].sum()
+    total_used = used[active].sum()
+    global_utilization = total_used / total_capacity if total_capacity > 0 else 0.0
+    imbalance = np.where(active, utilization - global_utilization, 0.0)
+    active_utilization = utilization[active]
+    mean_utilization = active_utilization.mean() if len(active_utilization) else 0.0
+    imbalance_cv = active_utilization.std() / mean_utilization if mean_utilization > 0 else 0.0
+    excess = np.where(active, np.maximum(used - capacity * global_utilization, 0.0), 0.0)
+
+    return {
+        "id_sucursal": branch_ids,
+        "active": active,
+        "capacity": sucursal["capacidad"],
+        "used": sucursal["espacio_usado"],
+        "utilization": utilization,
+        "articles": articles,
+        "sales_count": sales_count,
+        "sales_amount": sales_amount,
+        "bucket_seconds": bucket_seconds,
+        "bucket_start": bucket_start,
+        "sales_buckets": sales_buckets,
+        "amount_buckets": amount_buckets,
+        "sales_trend": sales_trend,
+        "global_utilization": global_utilization,
+        "imbalance": imbalance,
+        "imbalance_cv": imbalance_cv,
+        "excess": excess,
+        "articles_to_move": int(np.floor(excess.sum())),
+    }
+
+# Clase SEGUIMIENTO DE CAPACIDAD: pensada para llamarse en cada decisión de rebalanceo. Las guías ya leídas
+# se conservan en memoria y en cada llamada solo se leen las nuevas, así que el costo de SQLite es
+# proporcional a las ventas desde la última decisión. ARTICULO no guarda fechas, así que el ritmo de
+# llenado de cada sucursal se estima con una media móvil exponencial de la variación de espacio_usado
+# entre llamadas, y con él se proyecta el tiempo hasta llenarse. Solo lee las particiones de la base (no los
+# meses archivados), que son las ventas recientes que cuentan para rebalancear
+class CapacityTracker:
+    def __init__(self, bucket_seconds=3600, window=None, smoothing=0.3):
+        self.bucket_seconds = bucket_seconds
+        self.window = window
+        self.smoothing = smoothing
+        self.previous = None
+        self.fill_rate = None
+        self.guia_envio = np.zeros(0, dtype=GUIA_ENVIO_DTYPE)
+
+    def update(self, connection, now=None):
+        now = time.time() if now is None else now
+        after_id = int(self.guia_envio["id_guia"].max()) if len(self.guia_envio) else 0
+        columns = load_columns(connection, after_id=after_id)
+        if len(columns["guia_envio"]):
+            self.guia_envio = np.concatenate((self.guia_envio, columns["guia_envio"]))
+        if self.window:
+            # Descartar las guías que salieron de la ventana
+            self.guia_envio = self.guia_envio[self.guia_envio["fecha_compra"] >= local_seconds(now - self.window)]
+        columns["guia_envio"] = self.guia_envio
+        report = compute_report(columns, self.bucket_seconds)
+
+        branch_ids = report["id_sucursal"]
+        used = report["used"].astype(np.float64)
+        if self.previous is not None and now > self.previous[0]:
+            previous_time, previous_ids, previous_used, previous_rate = self.previous
+            index = branch_index(previous_ids, branch_ids)
+            delta = np.where(index >= 0, used - previous_used[index], 0.0)
+            rate = delta / (now - previous_time)
+            if previous_rate is not None:
+                rate = np.where(index >= 0, self.smoothing * rate + (1 - self.smoothing) * previous_rate[index], rate)
+            self.fill_rate = rate
+            self.previous = (now, branch_ids, used, rate)
+        elif self.previous is None:
+            # Primera llamada: todavía no hay ritmo de llenado
+            self.fill_rate = np.zeros(len(branch_ids))
+            self.previous = (now, branch_ids, used, None)
+
+        remaining = report["capacity"] - used
+        with np.errstate(divide="ignore", invalid="ignore"):
+            report["time_to_full"] = np.where(self.fill_rate > 0, np.maximum(remaining, 0) / self.fill_rate, np.inf)
+        report["fill_rate"] = self.fill_rate
+        return report
+
+# Función para imprimir el reporte por sucursal
+def print_report(report):
+    print(f"\n=== Capacidad y carga de sucursales (utilización global {report['global_utilization'] * 100:.1f}%, "
+          f"CV {report['imbalance_cv']:.3f}, artículos a mover {report['articles_to_move']}) ===")
+    print(f"{'sucursal':>8} {'activa':>6} {'uso':>11} {'util %':>7} {'desvío %':>9} {'artículos':>9} {'ventas':>8} {'monto':>12} {'tendencia':>9} {'llena en':>10}")
+    time_to_full = report.get("time_to_full")
+    for i, branch_id in enumerate(report["id_sucursal"]):
+        if time_to_full is None or not np.isfinite(time_to_full[i]):
+            full = "-"
+        else:
+            full = f"{time_to_full[i] / 3600:.1f} h"
+        print(f"{branch_id:>8} {'sí' if report['active'][i] else 'no':>6} {report['used'][i]:>5}/{report['capacity'][i]:<5} "
+              f"{report['utilization'][i] * 100:>7.1f} {report['imbalance'][i] * 100:>+9.1f} {report['articles'][i]:>9} "
+              f"{report['sales_count'][i]:>8} {report['sales_amount'][i]:>12.2f} {report['sales_trend'][i]:>+9.2f} {full:>10}")
+
+    if report["sales_buckets"].shape[1]:
+        last = report["sales_buckets"][:, -8:]
+        starts = report["bucket_start"][-8:]
+        print(f"\nVentas por intervalo de {report['bucket_seconds']} s (últimos {last.shape[1]}):")
+        print(f"{'sucursal':>8} " + " ".join(time.strftime("%m-%d %H:%M", time.gmtime(start)) for start in starts))
+        for i, branch_id in enumerate(report["id_sucursal"]):
+            print(f"{branch_id:>8} " + " ".join(f"{value:>11}" for value in last[i]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Análisis de capacidad y carga de las sucursales")
+    parser.add_argument("--db", default="nodo.db", help="Archivo de base de datos del nodo")
+    parser.add_argument("--bucket", type=int, default=3600, help="Segundos por intervalo de ventas")
+    parser.add_argument("--window", type=float, default=None, help="Solo considerar las guías de los últimos N segundos")
+    parser.add_argument("--archive-dir", default=None, help="Directorio de los meses archivados de GUIA_ENVIO (por defecto <db>_archivo)")
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.db)
+    since = time.time() - args.window if args.window else None
+    archive_directory = args.archive_dir or os.path.splitext(args.db)[0] + "_archivo"
+    start = time.perf_counter()
+    report = compute_report(load_columns(connection, since, archive_directory=archive_directory), args.bucket)
+    elapsed = time.perf_counter() - start
+    print_report(report)
+    print(f"\n>> Calculado en {elapsed * 1000:.1f} ms")
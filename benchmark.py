@@ -0,0 +1,1220 @@
+import argparse
+import collections
+import contextlib
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Función para cargar un Middleware como módulo (el nombre del archivo contiene puntos y no se puede importar directamente)
+def load_middleware(filename="Middleware_v2.0.py"):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    module_name = filename.replace(".py", "").replace(".", "_").lower()
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Función para calcular un percentil (p entre 0 y 100) de una lista de valores
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+# Función para crear los nodos de un clúster local con su tabla SUCURSAL inicial (y el esquema marcado como
+# listo para que los nodos arranquen en caliente). El último nodo es el maestro. `options` se pasa a cada Nodo
+def create_cluster(middleware, directory, node_count, sharded, replicas, capacity, addresses=None, **options):
+    if addresses is None:
+        addresses = [f"127.0.0.{id_sucursal}" for id_sucursal in range(1, node_count + 1)]
+    nodos = []
+    for id_nodo in range(1, node_count + 1):
+        nodo = middleware.Nodo(os.path.join(directory, f"nodo_{id_nodo}.db"), sharded=sharded, replicas=replicas, **options)
+        nodo.create_tables()
+        for id_sucursal in range(1, node_count + 1):
+            nodo.cursor.execute("""
+                INSERT INTO SUCURSAL (id_sucursal, ip, nodo_actual, nodo_maestro, status, capacidad, espacio_usado)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (id_sucursal, addresses[id_sucursal - 1], int(id_sucursal == id_nodo), int(id_sucursal == node_count), 1, capacity, 0))
+        nodo.cursor.execute(f"PRAGMA user_version = {middleware.SCHEMA_VERSION}")
+        nodo.connection.commit()
+        nodos.append(nodo)
+    return nodos
+
+# Proceso de un nodo del clúster local: levanta el servidor del Nodo y ejecuta las operaciones de la API
+# programática que le envía el benchmark por un Pipe, respondiendo (éxito, latencia, error). `options` se pasa al Nodo
+def cluster_node_worker(db_path, address, connection, verbose, legacy_wire=False, options=None):
+    if not verbose:
+        sys.stdout = open(os.devnull, "w")
+    middleware = load_middleware()
+    nodo = middleware.Nodo(db_path, anti_entropy_interval=0, digest_votes=not legacy_wire, batch_messages=not legacy_wire,
+                           **(options or {}))
+    server_thread = threading.Thread(target=nodo.start_server, args=nodo.node_address(address), daemon=True)
+    server_thread.start()
+
+    # Esperar a que el servidor acepte conexiones antes de avisar que el nodo está listo
+    while True:
+        try:
+            socket.create_connection(nodo.node_address(address), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    connection.send("ready")
+
+    while True:
+        try:
+            command = connection.recv()
+        except EOFError:
+            break
+        if command is None:
+            break
+        operation, arguments = command
+        if operation == "cpu":
+            times = os.times()
+            connection.send(times.user + times.system)
+            continue
+        if operation == "wire":
+            connection.send((nodo.transport.bytes_sent, nodo.transport.messages_sent, nodo.transport.connections_opened))
+            continue
+
+        start = time.perf_counter()
+        try:
+            success = getattr(nodo, f"api_{operation}")(*arguments)
+            error = None
+        except Exception as e:
+            success = False
+            error = str(e)
+        connection.send((success, time.perf_counter() - start, error))
+
+# Generador de carga mixta. Mantiene los clientes y artículos creados para que las compras y los
+# re-stock siempre tengan datos válidos; es compartido por los hilos que manejan cada nodo
+class Workload:
+    def __init__(self, mix, seed, read_consistency="local", max_staleness=1.0):
+        self.operations = list(mix)
+        self.weights = [mix[operation] for operation in self.operations]
+        self.random = random.Random(seed)
+        self.read_consistency = read_consistency
+        self.max_staleness = max_staleness
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.usuarios = []
+        self.available = []
+        self.sold = []
+
+    def next_operation(self, id_nodo):
+        with self.lock:
+            self.sequence += 1
+            operation = self.random.choices(self.operations, self.weights)[0]
+            if operation in ("update_cliente", "comprar", "read_cliente") and not self.usuarios:
+                operation = "create_cliente"
+            if operation == "read_articulo" and not (self.available or self.sold):
+                operation = "create_articulo"
+            if operation == "comprar" and not self.available:
+                operation = "create_articulo"
+            if operation == "restock_articulo" and not self.sold:
+                operation = "create_articulo"
+
+            if operation == "create_cliente":
+                return operation, (f"usuario-{id_nodo}-{self.sequence}", "Nombre", "Direccion", self.sequence)
+            if operation == "update_cliente":
+                return operation, (self.random.choice(self.usuarios), "Nombre nuevo", "Direccion nueva", 10 ** 9 + self.sequence)
+            if operation == "create_articulo":
+                return operation, (self.sequence, f"articulo-{self.sequence}", round(self.random.uniform(1, 500), 2))
+            if operation == "restock_articulo":
+                return operation, (self.sold.pop(self.random.randrange(len(self.sold))),)
+            if operation == "read_cliente":
+                return operation, (self.random.choice(self.usuarios), self.read_consistency, self.max_staleness)
+            if operation == "read_articulo":
+                return operation, (self.random.choice(self.available + self.sold), self.read_consistency, self.max_staleness)
+            codigo = self.available.pop(self.random.randrange(len(self.available)))
+            return operation, (self.random.choice(self.usuarios), codigo)
+
+    def completed(self, operation, arguments, success):
+        with self.lock:
+            if operation == "create_cliente" and success:
+                self.usuarios.append(arguments[0])
+            elif operation == "create_articulo" and success:
+                self.available.append(arguments[0])
+            elif operation == "restock_articulo":
+                self.available.append(arguments[0])
+            elif operation == "comprar":
+                (self.sold if success else self.available).append(arguments[1])
+
+# Función para levantar un proceso por nodo del clúster local (ver cluster_node_worker) sobre las bases
+# de create_cluster y esperar a que todos acepten conexiones. Agrega los procesos y sus Pipes a las listas
+# recibidas, para que quien llama los detenga con stop_cluster_processes aunque el arranque falle a la mitad
+def start_cluster_processes(processes, connections, directory, addresses, verbose, legacy_wire=False, **options):
+    context = multiprocessing.get_context("spawn")
+    for id_nodo in range(1, len(addresses) + 1):
+        parent_connection, child_connection = context.Pipe()
+        process = context.Process(
+            target=cluster_node_worker,
+            args=(os.path.join(directory, f"nodo_{id_nodo}.db"), addresses[id_nodo - 1], child_connection, verbose, legacy_wire, options),
+            daemon=True
+        )
+        process.start()
+        child_connection.close()
+        processes.append(process)
+        connections.append(parent_connection)
+    for connection in connections:
+        connection.recv()
+
+# Función para pedirle a cada proceso del clúster local un contador ("cpu" o "wire"); None si no responde
+def query_cluster_processes(connections, operation):
+    values = []
+    for connection in connections:
+        try:
+            connection.send((operation, ()))
+            values.append(connection.recv() if connection.poll(2) else None)
+        except (EOFError, OSError):
+            values.append(None)
+    return values
+
+# Función para detener los procesos del clúster local
+def stop_cluster_processes(processes, connections):
+    for process, connection in zip(processes, connections):
+        try:
+            connection.send(None)
+        except OSError:
+            pass
+        process.join(timeout=2)
+        if process.is_alive():
+            process.kill()
+
+# Benchmark de escritura de artículos: replicación completa contra particionado con hash consistente. Cada
+# configuración levanta N nodos reales en 127.0.0.1 (como benchmark_cluster) y todos crean artículos a la vez
+# durante `duration` segundos a través de la API programática, así que cada escritura pasa por la exclusión
+# mutua y replicate_articulo. Se informan los mensajes que envían todos los nodos (permisos, consenso o
+# shard_write, heart_beat) por escritura confirmada, las filas de ARTICULO por nodo y las copias por artículo
+def benchmark_sharding(args):
+    middleware = load_middleware()
+
+    print(f"{'modo':<14}{'nodos':>6}{'escrituras/s':>14}{'mensajes/escritura':>20}{'filas/nodo':>12}{'copias/artículo':>17}")
+    for node_count in range(args.min_nodes, args.max_nodes + 1):
+        for sharded in (False, True):
+            addresses = [f"127.0.0.1:{args.base_port + i}" for i in range(node_count)]
+            directory = tempfile.mkdtemp(prefix="bench_sharding_")
+            processes = []
+            connections = []
+            try:
+                for nodo in create_cluster(middleware, directory, node_count, sharded, args.replicas, args.capacity, addresses):
+                    nodo.connection.close()
+                start_cluster_processes(processes, connections, directory, addresses, False, sharded=sharded, replicas=args.replicas)
+
+                committed = [0] * node_count
+                deadline = time.perf_counter() + args.duration
+
+                def drive(id_nodo):
+                    connection = connections[id_nodo - 1]
+                    sequence = 0
+                    while time.perf_counter() < deadline:
+                        sequence += 1
+                        codigo = id_nodo * 10 ** 6 + sequence
+                        try:
+                            connection.send(("create_articulo", (codigo, f"articulo-{codigo}", 10.0)))
+                            if not connection.poll(args.operation_timeout):
+                                break
+                            success, _, _ = connection.recv()
+                        except (EOFError, OSError):
+                            break
+                        committed[id_nodo - 1] += int(bool(success))
+
+                start = time.perf_counter()
+                drivers = [threading.Thread(target=drive, args=(id_nodo,)) for id_nodo in range(1, node_count + 1)]
+                for driver in drivers:
+                    driver.start()
+                for driver in drivers:
+                    driver.join()
+                elapsed = time.perf_counter() - start
+                wire = [counters for counters in query_cluster_processes(connections, "wire") if counters is not None]
+            finally:
+                stop_cluster_processes(processes, connections)
+
+            try:
+                rows = 0
+                for id_nodo in range(1, node_count + 1):
+                    with contextlib.closing(sqlite3.connect(os.path.join(directory, f"nodo_{id_nodo}.db"))) as connection:
+                        rows += connection.execute("SELECT COUNT(*) FROM ARTICULO").fetchone()[0]
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+            total = sum(committed)
+            mode = "particionado" if sharded else "completo"
+            if not total:
+                print(f"{mode:<14}{node_count:>6}{'sin escrituras confirmadas':>40}")
+                continue
+            print(f"{mode:<14}{node_count:>6}{total / elapsed:>14.1f}{sum(counters[1] for counters in wire) / total:>20.1f}"
+                  f"{rows / node_count:>12.1f}{rows / total:>17.2f}")
+
+# Benchmark de N nodos reales en 127.0.0.1 (un proceso, puerto y base de datos por nodo) con carga mixta
+# a través de la API programática. Con --kill-master-at se mata al maestro a mitad de la ejecución
+def benchmark_cluster(args):
+    middleware = load_middleware()
+    mix = dict((item.split("=")[0], float(item.split("=")[1])) for item in args.mix.split(","))
+    addresses = [f"127.0.0.1:{args.base_port + i}" for i in range(args.nodes)]
+    directory = tempfile.mkdtemp(prefix="bench_cluster_")
+    processes = []
+    connections = []
+
+    try:
+        for nodo in create_cluster(middleware, directory, args.nodes, False, 1, args.capacity, addresses):
+            nodo.connection.close()
+        start_cluster_processes(processes, connections, directory, addresses, args.verbose, args.legacy_wire)
+
+        workload = Workload(mix, args.seed, args.read_consistency, args.max_staleness)
+        results = []
+        results_lock = threading.Lock()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        killed_at = []
+        blocked = []
+
+        def drive(id_nodo):
+            connection = connections[id_nodo - 1]
+            while time.perf_counter() < deadline:
+                operation, arguments = workload.next_operation(id_nodo)
+                operation_start = time.perf_counter()
+                try:
+                    connection.send((operation, arguments))
+                    if not connection.poll(args.operation_timeout):
+                        # El nodo quedó bloqueado (p. ej. esperando un consenso del maestro caído)
+                        workload.completed(operation, arguments, False)
+                        with results_lock:
+                            results.append((operation, operation_start - start, args.operation_timeout, False, "timeout"))
+                        blocked.append(id_nodo)
+                        break
+                    success, latency, error = connection.recv()
+                except (EOFError, OSError):
+                    workload.completed(operation, arguments, False)
+                    break
+                workload.completed(operation, arguments, success)
+                with results_lock:
+                    results.append((operation, operation_start - start, latency, success, error))
+
+        def kill_master():
+            time.sleep(args.kill_master_at)
+            processes[-1].kill()
+            killed_at.append(time.perf_counter() - start)
+
+        drivers = [threading.Thread(target=drive, args=(id_nodo,)) for id_nodo in range(1, args.nodes + 1)]
+        if args.kill_master_at is not None:
+            drivers.append(threading.Thread(target=kill_master, daemon=True))
+        for driver in drivers:
+            driver.start()
+        for driver in drivers:
+            driver.join()
+        elapsed = time.perf_counter() - start
+
+        cpu_seconds = query_cluster_processes(connections, "cpu")
+        wire = query_cluster_processes(connections, "wire")
+    finally:
+        stop_cluster_processes(processes, connections)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"\n=== Clúster local: {args.nodes} nodos, {elapsed:.1f} s ===")
+    print(f"{'operación':<20}{'total':>7}{'errores':>9}{'rechazadas':>12}{'ops/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for operation in sorted({result[0] for result in results}) + [None]:
+        selected = [result for result in results if operation is None or result[0] == operation]
+        latencies = [result[2] * 1000 for result in selected if result[3]]
+        failed = sum(1 for result in selected if result[4])
+        rejected = sum(1 for result in selected if not result[3] and not result[4])
+        print(f"{operation or 'TOTAL':<20}{len(selected):>7}{failed:>9}{rejected:>12}{len(latencies) / elapsed:>9.2f}"
+              f"{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}{percentile(latencies, 99):>10.1f}")
+
+    errors = collections.Counter(result[4] for result in results if result[4])
+    if errors:
+        print("\n>> Errores más frecuentes:")
+        for error, count in errors.most_common(3):
+            print(f"   {count:>6} x {error}")
+
+    print(f"\n{'nodo':<20}{'CPU s':>10}{'CPU %':>10}")
+    for id_nodo, cpu in enumerate(cpu_seconds, start=1):
+        if cpu is None:
+            print(f"{addresses[id_nodo - 1]:<20}{'-':>10}{'-':>10}")
+        else:
+            print(f"{addresses[id_nodo - 1]:<20}{cpu:>10.2f}{cpu / elapsed * 100:>10.1f}")
+
+    # Bytes en la red por operación confirmada: todo lo que enviaron los nodos (consenso, permisos, heartbeats)
+    # entre las escrituras exitosas
+    committed = sum(1 for result in results if result[3] and not result[0].startswith("read_"))
+    sent = [counters for counters in wire if counters is not None]
+    if committed and sent:
+        total_bytes = sum(counters[0] for counters in sent)
+        total_messages = sum(counters[1] for counters in sent)
+        total_connections = sum(counters[2] for counters in sent)
+        print(f"\n>> Red ({'protocolo original' if args.legacy_wire else 'votos con resumen y lotes por nodo'}): "
+              f"{total_bytes / committed:.0f} bytes, {total_messages / committed:.1f} mensajes y "
+              f"{total_connections / committed:.1f} conexiones por escritura confirmada")
+
+    if killed_at:
+        kill_time = killed_at[0]
+        after = [result for result in results if result[1] + result[2] >= kill_time]
+        recovered = [result[1] + result[2] for result in after if result[3]]
+        print(f"\n>> Maestro eliminado en t = {kill_time:.2f} s")
+        if recovered:
+            print(f">> Primera operación exitosa tras la falla: {(min(recovered) - kill_time) * 1000:.1f} ms después")
+        else:
+            print(">> Ninguna operación se completó después de la falla del maestro")
+        print(f">> Operaciones fallidas tras la falla: {sum(1 for result in after if not result[3])}")
+    if blocked:
+        print(f">> Nodos bloqueados (sin respuesta en {args.operation_timeout} s): {', '.join(addresses[id_nodo - 1] for id_nodo in sorted(blocked))}")
+        print(f">> p99 antes / después de la falla: "
+              f"{percentile([r[2] * 1000 for r in results if r[1] + r[2] < kill_time and r[3]], 99):.1f} ms / "
+              f"{percentile([r[2] * 1000 for r in after if r[3]], 99):.1f} ms")
+
+# Función para correr un escenario simulado: N nodos en este proceso sobre una red en memoria con reloj virtual.
+# Cada nodo recibe carga mixta de su propio cliente (con `think_time` entre operaciones); con `fault` se inyecta una falla en `fault_at` segundos
+# virtuales (crash-master, crash-node o partition del maestro, que se repara en `heal_at`). Al final se
+# comprueba que los nodos en ejecución coincidan en el maestro y en la tabla CLIENTE
+def run_simulation(middleware, args, seed):
+    mix = dict((item.split("=")[0], float(item.split("=")[1])) for item in args.mix.split(","))
+    directory = tempfile.mkdtemp(prefix="bench_simulation_")
+    clock = middleware.SimulatedClock(seed)
+    network = middleware.SimulatedNetwork(clock, args.latency, args.jitter, args.loss)
+    try:
+        nodos = create_cluster(middleware, directory, args.nodes, False, 1, args.capacity, clock=clock, network=network)
+        workload = Workload(mix, seed)
+        results = []
+        pending = {}
+
+        def drive(id_nodo, nodo):
+            while clock.now < args.duration:
+                operation, arguments = workload.next_operation(id_nodo)
+                start = clock.monotonic()
+                pending[id_nodo] = operation
+                try:
+                    success = getattr(nodo, f"api_{operation}")(*arguments)
+                    error = None
+                except Exception as e:
+                    success = False
+                    error = type(e).__name__
+                del pending[id_nodo]
+                workload.completed(operation, arguments, success)
+                results.append((operation, start, clock.monotonic() - start, success, error))
+                clock.sleep(args.think_time)
+
+        for id_nodo, nodo in enumerate(nodos, start=1):
+            clock.spawn(drive, id_nodo, nodo, owner=nodo)
+
+        master = nodos[-1]
+        if args.fault == "crash-master":
+            clock.call_later(args.fault_at, network.crash, master)
+        elif args.fault == "crash-node":
+            clock.call_later(args.fault_at, network.crash, nodos[clock.random.randrange(len(nodos) - 1)])
+        elif args.fault == "partition":
+            clock.call_later(args.fault_at, network.partition, [master])
+            clock.call_later(args.heal_at, network.heal)
+
+        # Después de la carga se deja un margen para que terminen las operaciones en curso
+        clock.run(until=args.duration + args.drain)
+        stuck = sorted(pending.values())
+        clock.stop()
+
+        live = [nodo for nodo in nodos if nodo not in network.down]
+        masters = {nodo.cluster.view.master.id_sucursal if nodo.cluster.view.master else None for nodo in live}
+        tables = set()
+        for nodo in live:
+            nodo.cursor.execute("SELECT usuario, nombre, direccion, tarjeta, status FROM CLIENTE ORDER BY usuario")
+            tables.add(tuple(nodo.cursor.fetchall()))
+        fingerprint = hashlib.sha1(repr((results, sorted(masters, key=str), sorted(tables))).encode()).hexdigest()[:12]
+        for nodo in nodos:
+            nodo.connection.close()
+        return {
+            "seed": seed,
+            "results": results,
+            "stuck": stuck,
+            "masters": masters,
+            "diverged": len(tables) > 1,
+            "errors": clock.errors,
+            "fingerprint": fingerprint,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+# Benchmark de escenarios simulados: corre --scenarios semillas seguidas y resume latencias y rendimiento en
+# tiempo virtual, escenarios por minuto de reloj real y los escenarios que terminaron con operaciones
+# bloqueadas, maestros distintos o réplicas divergentes (con su semilla para repetirlos)
+def benchmark_simulation(args):
+    middleware = load_middleware()
+    scenarios = []
+    start = time.perf_counter()
+    for seed in range(args.seed, args.seed + args.scenarios):
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else open(os.devnull, "w")):
+            scenarios.append(run_simulation(middleware, args, seed))
+        if args.scenarios <= 10:
+            scenario = scenarios[-1]
+            print(f">> Semilla {seed}: {len(scenario['results'])} operaciones, huella {scenario['fingerprint']}")
+    elapsed = time.perf_counter() - start
+
+    results = [result for scenario in scenarios for result in scenario["results"]]
+    virtual_time = args.scenarios * args.duration
+    print(f"\n=== Simulación: {args.scenarios} escenarios de {args.nodes} nodos, {args.duration:.0f} s virtuales cada uno, "
+          f"falla {args.fault} ===")
+    print(f"{'operación':<20}{'total':>7}{'errores':>9}{'rechazadas':>12}{'ops/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for operation in sorted({result[0] for result in results}) + [None]:
+        selected = [result for result in results if operation is None or result[0] == operation]
+        latencies = [result[2] * 1000 for result in selected if result[3]]
+        failed = sum(1 for result in selected if result[4])
+        rejected = sum(1 for result in selected if not result[3] and not result[4])
+        print(f"{operation or 'TOTAL':<20}{len(selected):>7}{failed:>9}{rejected:>12}{len(latencies) / virtual_time:>9.2f}"
+              f"{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}{percentile(latencies, 99):>10.1f}")
+
+    errors = collections.Counter(result[4] for result in results if result[4])
+    if errors:
+        print("\n>> Errores más frecuentes:")
+        for error, count in errors.most_common(3):
+            print(f"   {count:>6} x {error}")
+
+    print(f"\n>> {args.scenarios} escenarios en {elapsed:.1f} s de reloj real ({args.scenarios / elapsed * 60:.0f} escenarios/min)")
+    checks = [
+        ("con operaciones bloqueadas al final", [scenario for scenario in scenarios if scenario["stuck"]]),
+        ("sin un maestro común", [scenario for scenario in scenarios if len(scenario["masters"]) != 1]),
+        ("con réplicas de CLIENTE divergentes", [scenario for scenario in scenarios if scenario["diverged"]]),
+        ("con excepciones en tareas", [scenario for scenario in scenarios if scenario["errors"]]),
+    ]
+    for description, failing in checks:
+        seeds = ", ".join(str(scenario["seed"]) for scenario in failing[:10])
+        print(f">> Escenarios {description}: {len(failing)}" + (f" (semillas {seeds})" if failing else ""))
+
+# Benchmark de la mensajería v1: modo de un solo uso (una conexión y una confirmación síncrona por mensaje)
+# contra el modo sesión (conexión persistente con tramas y confirmaciones asíncronas). Se cuentan los
+# mensajes que registra el servidor para detectar mensajes partidos o fusionados
+def benchmark_messenger(args):
+    messenger = load_middleware("Middleware_v1.0.py")
+
+    class CountingJournal(messenger.MessageJournal):
+        received = 0
+
+        def record(self, direction, peer, current_time, node_name, message):
+            if direction == "<<":
+                self.received += 1
+            super().record(direction, peer, current_time, node_name, message)
+
+    directory = tempfile.mkdtemp(prefix="bench_messenger_")
+    stdout, stderr = sys.stdout, sys.stderr
+    results = []
+    try:
+        server_journal = CountingJournal(os.path.join(directory, "servidor.jsonl"))
+        client_journal = messenger.MessageJournal(os.path.join(directory, "cliente.jsonl"))
+        sys.stdout = sys.stderr = open(os.devnull, "w")
+        threading.Thread(target=messenger.start_server, args=("127.0.0.1", args.port, "servidor", server_journal), daemon=True).start()
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", args.port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+        for size in args.sizes:
+            message = "x" * size
+            for mode in ("un-solo-uso", "sesion"):
+                time.sleep(0.2)
+                received_before = server_journal.received
+                start = time.perf_counter()
+                if mode == "un-solo-uso":
+                    for _ in range(args.messages):
+                        messenger.send_message("127.0.0.1", args.port, "cliente", message, client_journal)
+                else:
+                    session = messenger.PeerSession("127.0.0.1", args.port, "cliente", client_journal, verbose=False)
+                    for _ in range(args.messages):
+                        session.send(message)
+                    session.close()
+                elapsed = time.perf_counter() - start
+                time.sleep(0.2)
+                results.append((size, mode, args.messages / elapsed, args.messages * size / elapsed / 1e6,
+                                server_journal.received - received_before))
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{'tamaño':>8}  {'modo':<12}{'mensajes/s':>12}{'MB/s':>9}{'recibidos':>11}")
+    for size, mode, rate, megabytes, received in results:
+        print(f"{size:>8}  {mode:<12}{rate:>12.0f}{megabytes:>9.2f}{received:>8}/{args.messages}")
+
+# Benchmark de aplicación de operaciones replicadas: un commit por operación (cada hilo con su conexión,
+# como antes del pipeline) contra el pipeline de commits agrupados con un solo hilo escritor. Cada hilo
+# espera a que su operación sea durable antes de enviar la siguiente, como un participante del consenso
+def benchmark_apply(args):
+    middleware = load_middleware()
+    print(f"{'modo':<18}{'hilos':>6}{'ops/s':>10}{'commits':>9}")
+    for threads in args.threads:
+        for mode in ("commit-por-op", "group-commit"):
+            directory = tempfile.mkdtemp(prefix="bench_apply_", dir=args.directory)
+            try:
+                nodo = middleware.Nodo(os.path.join(directory, "nodo.db"), metrics_enabled=True,
+                                       group_commit_size=args.group_commit_size, group_commit_delay=args.group_commit_delay)
+                nodo.create_tables()
+
+                def worker(id_thread):
+                    connection = nodo.connect_db() if mode == "commit-por-op" else None
+                    cursor = connection.cursor() if connection is not None else None
+                    for i in range(args.operations // threads):
+                        operation = f"create_cliente|usuario-{id_thread}-{i}|Nombre|Direccion|{id_thread * 10000000 + i}"
+                        if cursor is not None:
+                            nodo.apply_operation(cursor, operation)
+                        else:
+                            nodo.apply_local(operation)
+                    if connection is not None:
+                        connection.close()
+
+                workers = [threading.Thread(target=worker, args=(id_thread,)) for id_thread in range(threads)]
+                start = time.perf_counter()
+                for thread in workers:
+                    thread.start()
+                for thread in workers:
+                    thread.join()
+                elapsed = time.perf_counter() - start
+
+                metrics = nodo.metrics.render()
+                commits = sum(float(line.split()[-1]) for line in metrics.splitlines() if line.startswith("nodo_sqlite_commit_seconds_count"))
+                total = args.operations // threads * threads
+                print(f"{mode:<18}{threads:>6}{total / elapsed:>10.0f}{commits:>9.0f}")
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+
+# Copia de la cadena if/elif con la que handle_message elegía la rama de un mensaje antes del registro de
+# opcodes. Sólo elige la rama y convierte los campos, para comparar el costo del despacho
+LEGACY_DATABASE_OPCODES = {"shard_query", "merkle_root", "merkle_node", "merkle_rows", "new_master_node",
+                           "node_failure", "node_failure_node_active"}
+
+def legacy_route_message(data):
+    parts_aux = data.split('|')
+    opcode = parts_aux[0].split('-', 1)[0]
+    database = opcode in LEGACY_DATABASE_OPCODES
+    if data == 'acquire_permission':
+        return "acquire_permission", database, ()
+    elif parts_aux[0] == 'release_permission':
+        return "release_permission", database, ()
+    elif data == 'read_index':
+        return "read_index", database, ()
+    elif data == 'consensus_over':
+        return "consensus_over", database, ()
+    elif data == 'heart_beat':
+        return "heart_beat", database, ()
+    elif data == 'metrics':
+        return "metrics", database, ()
+    elif parts_aux[0] == 'traces':
+        return "traces", database, ()
+    elif data == 'distribute_new_article':
+        return "distribute_new_article", database, ()
+    elif data.startswith("continue_consensus"):
+        return "continue_consensus", database, ()
+    elif data.startswith("start_consensus"):
+        return "start_consensus", database, ()
+    elif data.startswith("shard_write|"):
+        return "shard_write", database, ()
+    elif parts_aux[0] == 'shard_query' and len(parts_aux) == 2:
+        return "shard_query", database, (int(parts_aux[1]),)
+    elif parts_aux[0] == 'merkle_root' and len(parts_aux) == 2:
+        return "merkle_root", database, (parts_aux[1],)
+    elif parts_aux[0] == 'merkle_node' and len(parts_aux) == 4:
+        return "merkle_node", database, (parts_aux[1], int(parts_aux[2]), int(parts_aux[3]))
+    elif parts_aux[0] == 'merkle_rows' and len(parts_aux) == 3:
+        return "merkle_rows", database, (parts_aux[1], int(parts_aux[2]))
+    elif parts_aux[0] == 'new_master_node' and len(parts_aux) == 3:
+        return "new_master_node", database, (int(parts_aux[1]), int(parts_aux[2]))
+    elif parts_aux[0] == 'node_failure' and len(parts_aux) == 2:
+        return "node_failure", database, (parts_aux[1],)
+    elif parts_aux[0] == 'node_failure_node_active' and len(parts_aux) == 2:
+        return "node_failure_node_active", database, (parts_aux[1],)
+    return None
+
+# Copia de la cadena if/elif con la que apply_operation elegía y decodificaba una operación replicada
+def legacy_route_operation(operation):
+    parts = operation.split('|')
+    if parts[0] == 'create_cliente' and len(parts) == 5:
+        usuario, nombre, direccion, tarjeta = parts[1:]
+        return "create_cliente", (usuario, nombre, direccion, int(tarjeta))
+    elif parts[0] == 'update_cliente' and len(parts) == 5:
+        usuario, nombre, direccion, tarjeta = parts[1:]
+        return "update_cliente", (usuario, nombre, direccion, int(tarjeta))
+    elif parts[0] == 'activate_cliente' and len(parts) == 2:
+        return "activate_cliente", (parts[1],)
+    elif parts[0] == 'deactivate_cliente' and len(parts) == 2:
+        return "deactivate_cliente", (parts[1],)
+    elif parts[0] == 'create_articulo' and len(parts) == 5:
+        codigo, nombre, precio, id_sucursal = parts[1:]
+        return "create_articulo", (int(codigo), nombre, float(precio), int(id_sucursal))
+    elif parts[0] == 'update_articulo' and len(parts) == 4:
+        codigo, nombre, precio = parts[1:]
+        return "update_articulo", (int(codigo), nombre, float(precio))
+    elif parts[0] == 'restock_articulo' and len(parts) == 2:
+        return "restock_articulo", (int(parts[1]),)
+    elif parts[0] == 'deactivate_articulo' and len(parts) == 2:
+        return "deactivate_articulo", (int(parts[1]),)
+    elif parts[0] == 'create_guia_envio' and len(parts) == 7:
+        id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra = parts[1:]
+        return "create_guia_envio", (int(id_cliente), int(id_articulo), int(id_sucursal), int(serie), float(monto_total), fecha_compra)
+    elif parts[0] == 'increment_espacio_usado' and len(parts) == 2:
+        return "increment_espacio_usado", (int(parts[1]),)
+    elif parts[0] == 'migrate_articulos' and len(parts) == 2:
+        return "migrate_articulos", ([tuple(int(field) for field in move.split(':')) for move in parts[1].split(',')],)
+    return None
+
+# Funciones con los pasos de handle_message y apply_operation hasta llamar al manejador registrado
+def registry_route_message(middleware):
+    registry = middleware.MESSAGE_HANDLERS
+    def route(data):
+        parts = data.split('|')
+        entry = registry.get(parts[0].split('-', 1)[0])
+        if entry is None or (entry.arity is not None and len(parts) != entry.arity):
+            return None
+        return entry.handler, entry.database, entry.decode(parts) if entry.arity is not None else ()
+    return route
+
+def registry_route_operation(middleware):
+    registry = middleware.REPLICATED_OPERATIONS
+    def route(operation):
+        parts = operation.split('|')
+        entry = registry.get(parts[0])
+        if entry is None or len(parts) != entry.arity:
+            return None
+        return entry.handler, entry.decode(parts)
+    return route
+
+# Función para medir los nanosegundos por mensaje de una función de despacho sobre una lista de mensajes
+def dispatch_nanoseconds(route, messages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for message in messages:
+            route(message)
+    return (time.perf_counter() - start) / (repeat * len(messages)) * 1e9
+
+# Benchmark del despacho de mensajes: cadena if/elif anterior contra el registro de opcodes, para la mezcla de
+# mensajes entre nodos, la mezcla de operaciones replicadas y el último opcode de cada cadena (el peor caso
+# de la cadena). Después aplica la mezcla de operaciones con apply_operation para ver qué parte del costo de
+# aplicar una operación es el despacho
+def benchmark_dispatch(args):
+    middleware = load_middleware()
+    operation = "create_cliente|usuario-1|Nombre|Direccion|1"
+    messages = ["acquire_permission", "release_permission|5|1", "read_index", "consensus_over", "heart_beat",
+                "metrics", "traces", "distribute_new_article", f"continue_consensus-2|{operation}",
+                f"start_consensus-1-5|{operation}", f"shard_write|{operation}", "shard_query|12", "merkle_root|CLIENTE",
+                "merkle_node|CLIENTE|2|3", "merkle_rows|CLIENTE|7", "new_master_node|1|2", "node_failure|3",
+                "node_failure_node_active|3"]
+    fecha = time.strftime("%Y-%m-%d %H:%M:%S")
+    operations = []
+    for i in range(1, args.operations + 1):
+        codigo = 1000 + i
+        operations.extend([
+            f"create_cliente|usuario-{i}|Nombre|Direccion|{2 * i}",
+            f"update_cliente|usuario-{i}|Nombre nuevo|Direccion nueva|{2 * i + 1}",
+            f"deactivate_cliente|usuario-{i}",
+            f"activate_cliente|usuario-{i}",
+            f"create_articulo|{codigo}|articulo-{codigo}|10.5|{i % 5 + 1}",
+            f"update_articulo|{codigo}|articulo nuevo|12.25",
+            f"create_guia_envio|{i}|{i}|{i % 5 + 1}|{i}|12.25|{fecha}",
+            f"restock_articulo|{codigo}",
+            f"deactivate_articulo|{codigo}",
+            f"increment_espacio_usado|{i % 5 + 1}",
+            f"migrate_articulos|{codigo}:{i % 5 + 1}:{(i + 1) % 5 + 1}",
+        ])
+    sample = operations[:11 * min(args.operations, 100)]
+
+    cases = [
+        ("mensajes entre nodos", messages, legacy_route_message, registry_route_message(middleware)),
+        ("  node_failure_node_active", ["node_failure_node_active|3"], legacy_route_message, registry_route_message(middleware)),
+        ("operaciones replicadas", sample, legacy_route_operation, registry_route_operation(middleware)),
+        ("  migrate_articulos", [operations[10]], legacy_route_operation, registry_route_operation(middleware)),
+    ]
+    print(f"{'mensajes':<28}{'if/elif ns':>12}{'registro ns':>13}{'mejora':>9}")
+    registry_operation_ns = None
+    for name, batch, legacy, registry in cases:
+        repeat = max(1, args.messages // len(batch))
+        legacy_ns = dispatch_nanoseconds(legacy, batch, repeat)
+        registry_ns = dispatch_nanoseconds(registry, batch, repeat)
+        if batch is sample:
+            registry_operation_ns = registry_ns
+        print(f"{name:<28}{legacy_ns:>12.0f}{registry_ns:>13.0f}{legacy_ns / registry_ns:>8.2f}x")
+
+    directory = tempfile.mkdtemp(prefix="bench_dispatch_", dir=args.directory)
+    try:
+        nodo = middleware.Nodo(os.path.join(directory, "nodo.db"))
+        nodo.create_tables()
+        nodo.insert_initial_sucursales()
+        nodo.cursor.execute("PRAGMA synchronous = OFF")
+        start = time.perf_counter()
+        for operation in operations:
+            nodo.apply_operation(nodo.cursor, operation)
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    apply_ns = elapsed / len(operations) * 1e9
+    print(f"\napply_operation: {len(operations) / elapsed:.0f} ops/s ({apply_ns / 1000:.1f} µs por operación, "
+          f"despacho {registry_operation_ns / apply_ns * 100:.1f}%)")
+
+# Benchmark del perfilado: costo por llamada de un método marcado con @timed (sin marcar, con el perfilado
+# apagado y durante una ventana) y caída del rendimiento de apply_operation en --threads hilos mientras el
+# muestreador toma pilas cada --intervals segundos
+def benchmark_profiling(args):
+    middleware = load_middleware()
+
+    class Target:
+        def __init__(self):
+            self.profiler = middleware.Profiler()
+
+        def plain(self, value):
+            return value
+
+        @middleware.timed("decorated")
+        def decorated(self, value):
+            return value
+
+    target = Target()
+    calls = args.calls
+    results = []
+    for mode, method in (("sin marcar", target.plain), ("@timed apagado", target.decorated), ("@timed en ventana", target.decorated)):
+        target.profiler.enabled = mode == "@timed en ventana"
+        start = time.perf_counter()
+        for i in range(calls):
+            method(i)
+        results.append((mode, (time.perf_counter() - start) / calls * 1e9))
+    target.profiler.enabled = False
+    print(f"{'método':<20}{'ns por llamada':>15}")
+    for mode, nanoseconds in results:
+        print(f"{mode:<20}{nanoseconds:>15.0f}")
+
+    directory = tempfile.mkdtemp(prefix="bench_profiling_", dir=args.directory)
+    try:
+        nodo = middleware.Nodo(os.path.join(directory, "nodo.db"))
+        nodo.create_tables()
+        nodo.cursor.execute("PRAGMA journal_mode = WAL")
+        nodo.cursor.execute("PRAGMA synchronous = OFF")
+
+        def run(label, interval):
+            counter = [0]
+            stop = threading.Event()
+
+            def worker(id_thread):
+                connection = nodo.connect_db()
+                cursor = connection.cursor()
+                cursor.execute("PRAGMA synchronous = OFF")
+                i = 0
+                while not stop.is_set():
+                    nodo.apply_operation(cursor, f"create_cliente|{label}-{id_thread}-{i}|Nombre|Direccion|{hash((label, id_thread, i))}")
+                    i += 1
+                counter[0] += i
+                connection.close()
+
+            workers = [threading.Thread(target=worker, args=(id_thread,)) for id_thread in range(args.threads)]
+            for thread in workers:
+                thread.start()
+            profile = None
+            if interval is None:
+                time.sleep(args.duration)
+            else:
+                profile = nodo.profiler.profile(args.duration, interval)
+            stop.set()
+            for thread in workers:
+                thread.join()
+            return counter[0] / args.duration, profile
+
+        # Las corridas se intercalan por ronda y se toma la mejor de cada modo, para que el ruido de la máquina
+        # no se confunda con el costo del muestreo
+        modes = [None] + args.intervals
+        best = dict.fromkeys(range(len(modes)), 0.0)
+        profiles = {}
+        for round_number in range(args.rounds):
+            for index, interval in enumerate(modes):
+                rate, profile = run(f"r{round_number}-{index}", interval)
+                best[index] = max(best[index], rate)
+                if profile is not None:
+                    profiles[index] = profile
+
+        baseline = best[0]
+        print(f"\n{'muestreo':<16}{'ops/s':>10}{'caída':>9}{'muestras':>10}{'pilas':>8}")
+        print(f"{'apagado':<16}{baseline:>10.0f}{'':>9}{'':>10}{'':>8}")
+        for index, interval in enumerate(modes[1:], start=1):
+            profile = profiles[index]
+            print(f"{f'cada {interval * 1000:g} ms':<16}{best[index]:>10.0f}{(1 - best[index] / baseline) * 100:>8.1f}%{profile['samples']:>10}{len(profile['stacks']):>8}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    # Funciones con más muestras propias en la última ventana (como las muestra profile_nodes.py)
+    own = collections.Counter()
+    for stack, count in profile["stacks"].items():
+        own[stack.split(";")[-1]] += count
+    total = sum(own.values())
+    print(f"\nFunciones con más muestras propias (última ventana):")
+    for frame, count in own.most_common(8):
+        print(f"{count / total * 100:>6.1f}%  {frame}")
+    for name, (count, seconds, maximum) in sorted(profile["timings"].items()):
+        print(f"@timed {name}: {count} llamadas, media {seconds / count * 1e6:.1f} µs, máx {maximum * 1000:.2f} ms")
+
+# Benchmark de GUIA_ENVIO: tabla única (esquema 1) contra particiones mensuales con los meses fríos archivados.
+# Se cargan --rows guías repartidas en --months meses hasta el actual, se migra una copia a particiones y se
+# archiva; luego se miden las compras nuevas (commit cada --commit-every), la lectura de los últimos 7 días y
+# el tamaño en disco
+def benchmark_guias(args):
+    middleware = load_middleware()
+    directory = tempfile.mkdtemp(prefix="bench_guias_", dir=args.directory)
+    generator = random.Random(args.seed)
+    now = time.time()
+    try:
+        # Guías históricas: fechas uniformes en los últimos --months meses y series aleatorias (como el índice UNIQUE las ve)
+        span = args.months * 30 * 86400
+        fechas = sorted(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now - generator.uniform(0, span))) for _ in range(args.rows))
+        series = generator.sample(range(1, 2 ** 62), args.rows + args.inserts)
+        rows = [(id_guia, generator.randint(1, 1000), generator.randint(1, 1000), generator.randint(1, 5), series[id_guia - 1],
+                 round(generator.uniform(1, 500), 2), fecha) for id_guia, fecha in enumerate(fechas, start=1)]
+
+        single_path = os.path.join(directory, "tabla_unica.db")
+        connection = sqlite3.connect(single_path)
+        connection.execute("""
+            CREATE TABLE GUIA_ENVIO (
+                id_guia INTEGER PRIMARY KEY AUTOINCREMENT,
+                id_cliente INTEGER NOT NULL,
+                id_articulo INTEGER NOT NULL,
+                id_sucursal INTEGER NOT NULL,
+                serie INTEGER NOT NULL UNIQUE,
+                monto_total REAL NOT NULL,
+                fecha_compra TEXT NOT NULL
+            )
+        """)
+        connection.executemany("INSERT INTO GUIA_ENVIO VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        connection.commit()
+        connection.close()
+
+        partitioned_path = os.path.join(directory, "particionada.db")
+        shutil.copy(single_path, partitioned_path)
+        partitions = middleware.ShipmentPartitions(os.path.join(directory, "archivo"), args.hot_months)
+        connection = sqlite3.connect(partitioned_path)
+        cursor = connection.cursor()
+        start = time.perf_counter()
+        partitions.migrate(cursor)
+        connection.commit()
+        migrate_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        archived = partitions.archive(cursor, now)
+        archive_seconds = time.perf_counter() - start
+        connection.execute("VACUUM")
+        connection.close()
+        print(f">> Migración de {args.rows} guías a {len(partitions.months) + len(archived)} particiones: {migrate_seconds:.2f} s; "
+              f"archivo de {len(archived)} meses fríos: {archive_seconds:.2f} s")
+
+        fecha = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now))
+        since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now - 7 * 86400))
+        print(f"\n{'almacenamiento':<16}{'compras/s':>11}{'7 días ms':>11}{'historia ms':>13}{'base MB':>9}{'archivo MB':>12}")
+        for mode, path in (("tabla única", single_path), ("particionada", partitioned_path)):
+            connection = sqlite3.connect(path)
+            cursor = connection.cursor()
+            new_rows = [(generator.randint(1, 1000), generator.randint(1, 1000), generator.randint(1, 5), serie,
+                         round(generator.uniform(1, 500), 2), fecha) for serie in series[args.rows:]]
+            start = time.perf_counter()
+            for i, row in enumerate(new_rows, start=1):
+                if mode == "tabla única":
+                    cursor.execute("INSERT INTO GUIA_ENVIO (id_cliente, id_articulo, id_sucursal, serie, monto_total, fecha_compra) VALUES (?, ?, ?, ?, ?, ?)", row)
+                else:
+                    partitions.insert(cursor, *row[:4], row[4], row[5])
+                if i % args.commit_every == 0:
+                    connection.commit()
+            connection.commit()
+            insert_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(args.reads):
+                if mode == "tabla única":
+                    recent = cursor.execute("SELECT * FROM GUIA_ENVIO WHERE fecha_compra >= ?", (since,)).fetchall()
+                else:
+                    recent = partitions.select(cursor, since=since)
+            read_seconds = (time.perf_counter() - start) / args.reads
+
+            start = time.perf_counter()
+            if mode == "tabla única":
+                history = cursor.execute("SELECT * FROM GUIA_ENVIO").fetchall()
+            else:
+                partitions.archive_cache = (None, None)
+                history = partitions.select(cursor, include_archive=True)
+            history_seconds = time.perf_counter() - start
+            connection.close()
+
+            archive_size = sum(os.path.getsize(os.path.join(partitions.archive_directory, name))
+                               for name in os.listdir(partitions.archive_directory)) if mode == "particionada" and archived else 0
+            print(f"{mode:<16}{len(new_rows) / insert_seconds:>11.0f}{read_seconds * 1000:>11.2f}{history_seconds * 1000:>13.1f}"
+                  f"{os.path.getsize(path) / 2 ** 20:>9.1f}{archive_size / 2 ** 20:>12.1f}   ({len(recent)} guías en 7 días, {len(history)} en total)")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+# Proceso que arranca un nodo como el __main__ del Middleware y mide cada fase: importar el módulo, preparar
+# la base de datos y el estado guardado, y levantar el servidor hasta que acepta conexiones
+def startup_node_worker(db_path, address, connection):
+    sys.stdout = open(os.devnull, "w")
+    start = time.perf_counter()
+    middleware = load_middleware()
+    imported = time.perf_counter()
+    nodo = middleware.Nodo(db_path, anti_entropy_interval=0, state_path=db_path + ".state")
+    warm = nodo.warm_start()
+    if not warm:
+        # En una base nueva la sucursal actual se configura a mano; aquí se usa la sucursal 1 en 127.0.0.1
+        nodo.cursor.execute("UPDATE SUCURSAL SET ip = ?, nodo_actual = 1 WHERE id_sucursal = 1", (address,))
+        nodo.connection.commit()
+    prepared = time.perf_counter()
+
+    server_thread = threading.Thread(target=nodo.start_server, args=nodo.node_address(nodo.get_current_sucursal_ip()), daemon=True)
+    server_thread.start()
+    while True:
+        try:
+            socket.create_connection(nodo.node_address(address), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.001)
+    serving = time.perf_counter()
+    connection.send((warm, imported - start, prepared - imported, serving - prepared))
+
+    # Detenerse como con Ctrl+C: guardando el estado
+    connection.recv()
+    nodo.save_state(clean=True)
+    connection.send(None)
+
+# Benchmark de arranque: un nodo con una base nueva (arranque en frío: crea el esquema y las sucursales)
+# contra el mismo nodo reiniciado (arranque en caliente: esquema al día y estado guardado). Cada arranque
+# es un intérprete nuevo, así que el tiempo total incluye la carga de Python y de los módulos
+def benchmark_startup(args):
+    context = multiprocessing.get_context("spawn")
+    address = f"127.0.0.1:{args.port}"
+    results = collections.defaultdict(list)
+    for run in range(args.runs):
+        directory = tempfile.mkdtemp(prefix="bench_startup_", dir=args.directory)
+        try:
+            for mode in ("frío", "caliente"):
+                parent_connection, child_connection = context.Pipe()
+                process = context.Process(target=startup_node_worker, args=(os.path.join(directory, "nodo.db"), address, child_connection), daemon=True)
+                start = time.perf_counter()
+                process.start()
+                warm, import_time, prepare_time, serve_time = parent_connection.recv()
+                total = time.perf_counter() - start
+                if warm != (mode == "caliente"):
+                    raise RuntimeError(f"Se esperaba un arranque {mode}")
+                parent_connection.send(None)
+                parent_connection.recv()
+                process.join()
+                results[mode].append((total, import_time, prepare_time, serve_time))
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(f"{'modo':<10}{'total ms':>10}{'import ms':>11}{'base+estado ms':>16}{'servidor ms':>13}")
+    for mode, samples in results.items():
+        columns = [percentile([sample[i] * 1000 for sample in samples], 50) for i in range(4)]
+        print(f"{mode:<10}{columns[0]:>10.1f}{columns[1]:>11.1f}{columns[2]:>16.2f}{columns[3]:>13.2f}")
+    print(f"\n>> Medianas de {args.runs} corridas; el total incluye el arranque del intérprete")
+
+# Proceso de un nodo para el benchmark de admisión: con `limited` usa el control de admisión por defecto y
+# si no, cupos prácticamente infinitos (un hilo por mensaje, como antes). Mide el máximo de hilos vivos
+def admission_node_worker(db_path, address, connection, limited):
+    sys.stdout = open(os.devnull, "w")
+    middleware = load_middleware()
+    limits = {} if limited else {"control_in_flight": 10 ** 6, "max_in_flight": 10 ** 6, "bulk_in_flight": 10 ** 6}
+    nodo = middleware.Nodo(db_path, anti_entropy_interval=0, metrics_enabled=True, **limits)
+    threading.Thread(target=nodo.start_server, args=nodo.node_address(address), daemon=True).start()
+    while True:
+        try:
+            socket.create_connection(nodo.node_address(address), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    peak_threads = [0]
+    def sample_threads():
+        while True:
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.01)
+    threading.Thread(target=sample_threads, daemon=True).start()
+
+    connection.send("ready")
+    connection.recv()
+    connection.send(peak_threads[0])
+
+# Función para enviar un mensaje a un nodo y leer toda la respuesta
+def send_raw(address, message, timeout=30):
+    host, _, port = address.partition(":")
+    with socket.create_connection((host, int(port)), timeout=timeout) as client_socket:
+        client_socket.sendall(message.encode())
+        chunks = []
+        while True:
+            chunk = client_socket.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+# Benchmark de admisión: muchos hilos piden rangos de anti-entropía (tráfico de fondo) sobre una tabla
+# grande mientras se mide la latencia de heart_beat (tráfico de control), sin y con control de admisión
+def benchmark_admission(args):
+    middleware = load_middleware()
+    context = multiprocessing.get_context("spawn")
+    address = f"127.0.0.1:{args.port}"
+    print(f"{'modo':<14}{'latido p50 ms':>14}{'p99 ms':>9}{'máx ms':>9}{'fondo/s':>9}{'busy':>7}{'errores':>9}{'hilos máx':>11}")
+    for limited in (False, True):
+        directory = tempfile.mkdtemp(prefix="bench_admission_")
+        try:
+            nodo = create_cluster(middleware, directory, 1, False, 1, args.rows, [address])[0]
+            nodo.cursor.executemany("INSERT INTO ARTICULO (id_sucursal, codigo, nombre, precio, stock) VALUES (1, ?, ?, 10.0, 'Disponible')",
+                                    ((codigo, f"articulo-{codigo}") for codigo in range(1, args.rows + 1)))
+            nodo.connection.commit()
+            nodo.connection.close()
+
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(target=admission_node_worker, args=(os.path.join(directory, "nodo_1.db"), address, child_connection, limited), daemon=True)
+            process.start()
+            parent_connection.recv()
+
+            deadline = time.perf_counter() + args.duration
+            counts = collections.Counter()
+            counts_lock = threading.Lock()
+            heartbeats = []
+
+            def flood():
+                while time.perf_counter() < deadline:
+                    try:
+                        reply = send_raw(address, f"merkle_rows|ARTICULO|{random.randrange(256)}")
+                        outcome = "busy" if reply == b"busy" else "ok"
+                        if outcome == "busy":
+                            # Como PeerTransport: esperar antes de reintentar un mensaje rechazado
+                            time.sleep(random.uniform(0, 0.1))
+                    except OSError:
+                        outcome = "error"
+                    with counts_lock:
+                        counts[outcome] += 1
+
+            def probe():
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        if send_raw(address, "heart_beat", timeout=10) == b"still_here":
+                            heartbeats.append(time.perf_counter() - start)
+                    except OSError:
+                        pass
+                    time.sleep(0.01)
+
+            threads = [threading.Thread(target=flood) for _ in range(args.flood_threads)] + [threading.Thread(target=probe)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            parent_connection.send(None)
+            peak_threads = parent_connection.recv()
+            process.terminate()
+            process.join()
+
+            latencies = [latency * 1000 for latency in heartbeats]
+            mode = "con admisión" if limited else "sin admisión"
+            print(f"{mode:<14}{percentile(latencies, 50):>14.1f}{percentile(latencies, 99):>9.1f}{max(latencies, default=0):>9.1f}"
+                  f"{counts['ok'] / args.duration:>9.0f}{counts['busy']:>7}{counts['error']:>9}{peak_threads:>11}")
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks del sistema distribuido de sucursales")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_sharding = subparsers.add_parser("sharding", help="Rendimiento de escritura de artículos contra número de nodos")
+    parser_sharding.add_argument("--min-nodes", type=int, default=2)
+    parser_sharding.add_argument("--max-nodes", type=int, default=8)
+    parser_sharding.add_argument("--replicas", type=int, default=1)
+    parser_sharding.add_argument("--duration", type=float, default=10, help="Segundos de escrituras por configuración")
+    parser_sharding.add_argument("--base-port", type=int, default=22300)
+    parser_sharding.add_argument("--capacity", type=int, default=100000, help="Capacidad de artículos por sucursal")
+    parser_sharding.add_argument("--operation-timeout", type=float, default=20, help="Segundos sin respuesta tras los que un nodo deja de escribir")
+    parser_sharding.set_defaults(func=benchmark_sharding)
+
+    parser_cluster = subparsers.add_parser("cluster", help="Carga mixta sobre N nodos reales en 127.0.0.1 con puertos distintos")
+    parser_cluster.add_argument("--nodes", type=int, default=5)
+    parser_cluster.add_argument("--duration", type=float, default=30, help="Segundos de carga")
+    parser_cluster.add_argument("--base-port", type=int, default=22200)
+    parser_cluster.add_argument("--capacity", type=int, default=100000, help="Capacidad de artículos por sucursal")
+    parser_cluster.add_argument("--mix", default="create_cliente=0.25,update_cliente=0.1,create_articulo=0.25,restock_articulo=0.1,comprar=0.3",
+                                help="Proporción de cada operación de la API programática")
+    parser_cluster.add_argument("--seed", type=int, default=1)
+    parser_cluster.add_argument("--kill-master-at", type=float, default=None, help="Segundo en el que se mata al nodo maestro")
+    parser_cluster.add_argument("--operation-timeout", type=float, default=20, help="Segundos sin respuesta tras los que un nodo se considera bloqueado")
+    parser_cluster.add_argument("--verbose", action="store_true", help="Mostrar la salida de los nodos")
+    parser_cluster.add_argument("--read-consistency", choices=["local", "bounded", "linearizable"], default="local",
+                                help="Nivel de consistencia de read_cliente/read_articulo en la mezcla")
+    parser_cluster.add_argument("--max-staleness", type=float, default=1.0, help="Segundos de retraso tolerados por las lecturas bounded")
+    parser_cluster.add_argument("--legacy-wire", action="store_true", help="Votos con el mensaje completo y sin lotes (para comparar bytes en la red)")
+    parser_cluster.set_defaults(func=benchmark_cluster)
+
+    parser_simulation = subparsers.add_parser("simulation", help="Escenarios de consenso y fallas con N nodos en un proceso, red simulada y reloj virtual")
+    parser_simulation.add_argument("--nodes", type=int, default=3)
+    parser_simulation.add_argument("--scenarios", type=int, default=20, help="Escenarios a correr, uno por semilla")
+    parser_simulation.add_argument("--seed", type=int, default=1, help="Semilla del primer escenario")
+    parser_simulation.add_argument("--duration", type=float, default=30, help="Segundos virtuales de carga por escenario")
+    parser_simulation.add_argument("--drain", type=float, default=30, help="Segundos virtuales para terminar las operaciones en curso")
+    parser_simulation.add_argument("--capacity", type=int, default=100000, help="Capacidad de artículos por sucursal")
+    parser_simulation.add_argument("--mix", default="create_cliente=0.25,update_cliente=0.1,create_articulo=0.25,restock_articulo=0.1,comprar=0.3",
+                                   help="Proporción de cada operación de la API programática")
+    parser_simulation.add_argument("--think-time", type=float, default=0.001, help="Segundos virtuales entre operaciones de cada cliente")
+    parser_simulation.add_argument("--latency", type=float, default=0.001, help="Latencia de un segmento en segundos")
+    parser_simulation.add_argument("--jitter", type=float, default=0.0005, help="Variación máxima de la latencia en segundos")
+    parser_simulation.add_argument("--loss", type=float, default=0.0, help="Probabilidad de perder un segmento")
+    parser_simulation.add_argument("--fault", choices=["none", "crash-master", "crash-node", "partition"], default="crash-master")
+    parser_simulation.add_argument("--fault-at", type=float, default=10, help="Segundo virtual de la falla")
+    parser_simulation.add_argument("--heal-at", type=float, default=20, help="Segundo virtual en que se repara la partición")
+    parser_simulation.add_argument("--verbose", action="store_true", help="Mostrar la salida de los nodos")
+    parser_simulation.set_defaults(func=benchmark_simulation)
+
+    parser_messenger = subparsers.add_parser("messenger", help="Mensajería v1: modo de un solo uso contra modo sesión")
+    parser_messenger.add_argument("--messages", type=int, default=2000, help="Mensajes por modo y tamaño")
+    parser_messenger.add_argument("--sizes", type=int, nargs="+", default=[64, 1024, 16384], help="Tamaños de mensaje en bytes")
+    parser_messenger.add_argument("--port", type=int, default=22300)
+    parser_messenger.set_defaults(func=benchmark_messenger)
+
+    parser_apply = subparsers.add_parser("apply", help="Aplicación de operaciones: commit por operación contra commits agrupados")
+    parser_apply.add_argument("--operations", type=int, default=2000, help="Operaciones por corrida")
+    parser_apply.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32], help="Hilos que aplican operaciones a la vez")
+    parser_apply.add_argument("--directory", default=None, help="Directorio de la base de datos (usar el disco a medir)")
+    parser_apply.add_argument("--group-commit-size", type=int, default=64)
+    parser_apply.add_argument("--group-commit-delay", type=float, default=0.0)
+    parser_apply.set_defaults(func=benchmark_apply)
+
+    parser_dispatch = subparsers.add_parser("dispatch", help="Despacho de mensajes: cadena if/elif contra registro de opcodes")
+    parser_dispatch.add_argument("--messages", type=int, default=500000, help="Mensajes despachados por caso")
+    parser_dispatch.add_argument("--operations", type=int, default=2000, help="Rondas de la mezcla de operaciones replicadas que se aplican")
+    parser_dispatch.add_argument("--directory", default=None, help="Directorio de la base de datos (usar el disco a medir)")
+    parser_dispatch.set_defaults(func=benchmark_dispatch)
+
+    parser_profiling = subparsers.add_parser("profiling", help="Costo de @timed y del muestreo de pilas sobre la aplicación de operaciones")
+    parser_profiling.add_argument("--calls", type=int, default=1000000, help="Llamadas por modo al medir @timed")
+    parser_profiling.add_argument("--threads", type=int, default=2, help="Hilos que aplican operaciones")
+    parser_profiling.add_argument("--duration", type=float, default=2, help="Segundos de cada corrida")
+    parser_profiling.add_argument("--rounds", type=int, default=3, help="Rondas intercaladas por modo (se toma la mejor)")
+    parser_profiling.add_argument("--intervals", type=float, nargs="+", default=[0.01, 0.005, 0.001], help="Segundos entre muestras")
+    parser_profiling.add_argument("--directory", default=None, help="Directorio de la base de datos (usar el disco a medir)")
+    parser_profiling.set_defaults(func=benchmark_profiling)
+
+    parser_guias = subparsers.add_parser("guias", help="GUIA_ENVIO en una tabla contra particiones mensuales con archivo de meses fríos")
+    parser_guias.add_argument("--rows", type=int, default=500000, help="Guías históricas")
+    parser_guias.add_argument("--months", type=int, default=24, help="Meses de historia")
+    parser_guias.add_argument("--hot-months", type=int, default=3)
+    parser_guias.add_argument("--inserts", type=int, default=20000, help="Compras nuevas a medir")
+    parser_guias.add_argument("--commit-every", type=int, default=64, help="Compras por commit (como el pipeline de commits agrupados)")
+    parser_guias.add_argument("--reads", type=int, default=20, help="Lecturas de los últimos 7 días a promediar")
+    parser_guias.add_argument("--seed", type=int, default=1)
+    parser_guias.add_argument("--directory", default=None, help="Directorio de las bases de datos (usar el disco a medir)")
+    parser_guias.set_defaults(func=benchmark_guias)
+
+    parser_admission = subparsers.add_parser("admission", help="Latencia de los latidos bajo una ráfaga de anti-entropía, sin y con control de admisión")
+    parser_admission.add_argument("--flood-threads", type=int, default=128, help="Hilos que piden rangos de anti-entropía a la vez")
+    parser_admission.add_argument("--rows", type=int, default=50000, help="Artículos en la tabla que se sincroniza")
+    parser_admission.add_argument("--duration", type=float, default=10)
+    parser_admission.add_argument("--port", type=int, default=22500)
+    parser_admission.set_defaults(func=benchmark_admission)
+
+    parser_startup = subparsers.add_parser("startup", help="Arranque de un nodo: base nueva contra reinicio en caliente")
+    parser_startup.add_argument("--runs", type=int, default=5)
+    parser_startup.add_argument("--port", type=int, default=22400)
+    parser_startup.add_argument("--directory", default=None, help="Directorio de la base de datos (usar el disco a medir)")
+    parser_startup.set_defaults(func=benchmark_startup)
+
+    args = parser.parse_args()
+    args.func(args)
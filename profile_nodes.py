@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import socket
+import threading
+from collections import Counter
+
+# Función para pedir a un nodo en ejecución un perfil de `seconds` segundos (mensaje `profile`)
+def fetch_node_profile(ip, seconds, interval):
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client_socket.settimeout(seconds + 30)
+    host, _, port = ip.partition(":")
+    client_socket.connect((host, int(port) if port else 2222))
+    client_socket.send(f"profile|{seconds}|{interval}".encode())
+    chunks = []
+    while True:
+        chunk = client_socket.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    client_socket.close()
+    data = b"".join(chunks).decode()
+    if data == "profile_busy":
+        raise RuntimeError("el nodo ya tiene una ventana de perfilado en curso")
+    if data == "busy":
+        raise RuntimeError("el nodo rechazó el pedido (control de admisión)")
+    return json.loads(data)
+
+# Función para escribir las pilas colapsadas de un nodo (una por línea: "pila muestras"), la entrada de
+# flamegraph.pl y speedscope
+def write_collapsed(path, stacks):
+    with open(path, "w") as file:
+        for stack, count in sorted(stacks.items()):
+            file.write(f"{stack} {count}\n")
+
+# Función para imprimir el resumen del perfil de un nodo: las funciones con más muestras propias (la hoja de la
+# pila) y con más muestras totales (en cualquier parte de la pila), y los tiempos de los métodos medidos
+def print_profile(ip, profile, top):
+    stacks = profile["stacks"]
+    total = sum(stacks.values()) or 1
+    own = Counter()
+    inclusive = Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+
+    print(f"\n=== Sucursal {profile['node']} ({ip}): {profile['samples']} muestras en {profile['seconds']:.1f} s ===")
+    print(f"{'propias %':>9} {'totales %':>9}  función")
+    for frame, count in own.most_common(top):
+        print(f"{count / total * 100:>9.1f} {inclusive[frame] / total * 100:>9.1f}  {frame}")
+
+    if profile["timings"]:
+        print(f"\n{'método':<26}{'llamadas':>10}{'total s':>10}{'media ms':>10}{'máx ms':>10}")
+        for name, (count, seconds, maximum) in sorted(profile["timings"].items(), key=lambda item: -item[1][1]):
+            print(f"{name:<26}{count:>10}{seconds:>10.3f}{seconds / count * 1000:>10.2f}{maximum * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perfila las sucursales en ejecución y guarda sus pilas colapsadas")
+    parser.add_argument("nodes", nargs="+", help="IPs (o ip:puerto) de los nodos a perfilar")
+    parser.add_argument("--seconds", type=float, default=10, help="Duración de la ventana de perfilado")
+    parser.add_argument("--interval", type=float, default=0.01, help="Segundos entre muestras")
+    parser.add_argument("--output-dir", default=".", help="Directorio de los archivos sucursal_<id>.folded")
+    parser.add_argument("--top", type=int, default=15, help="Funciones a mostrar por nodo")
+    args = parser.parse_args()
+
+    # Las ventanas de todos los nodos se piden a la vez para que cubran el mismo intervalo
+    profiles = {}
+    errors = {}
+
+    def worker(ip):
+        try:
+            profiles[ip] = fetch_node_profile(ip, args.seconds, args.interval)
+        except (OSError, RuntimeError, ValueError) as e:
+            errors[ip] = e
+
+    threads = [threading.Thread(target=worker, args=(ip,)) for ip in args.nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for ip in args.nodes:
+        if ip in errors:
+            print(f"\n>> No se pudo perfilar {ip}: {errors[ip]}")
+            continue
+        profile = profiles[ip]
+        path = os.path.join(args.output_dir, f"sucursal_{profile['node']}.folded")
+        write_collapsed(path, profile["stacks"])
+        print_profile(ip, profile, args.top)
+        print(f"\n>> Pilas colapsadas en {path}")
@@ -0,0 +1,88 @@
+import argparse
+import json
+import socket
+
+# Función para leer los spans de los logs JSONL de cada sucursal
+def read_trace_logs(paths):
+    spans = []
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                line = line.strip()
+                if line:
+                    spans.append(json.loads(line))
+    return spans
+
+# Función para pedir a un nodo en ejecución los spans de su buffer circular
+def fetch_node_traces(ip, trace_id=None):
+    message = f"traces|{trace_id}" if trace_id else "traces"
+    client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    host, _, port = ip.partition(":")
+    client_socket.connect((host, int(port) if port else 2222))
+    client_socket.send(message.encode())
+    chunks = []
+    while True:
+        chunk = client_socket.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    client_socket.close()
+    return json.loads(b"".join(chunks).decode())
+
+# Función para ordenar los spans de una traza en profundidad (cada hijo debajo de su padre, por inicio)
+def order_spans(spans):
+    children = {}
+    span_ids = {span["span_id"] for span in spans}
+    for span in spans:
+        parent_id = span["parent_id"] if span["parent_id"] in span_ids else None
+        children.setdefault(parent_id, []).append(span)
+
+    ordered = []
+    pending = [(span, 0) for span in sorted(children.get(None, []), key=lambda span: span["start"], reverse=True)]
+    while pending:
+        span, depth = pending.pop()
+        ordered.append((span, depth))
+        for child in sorted(children.get(span["span_id"], []), key=lambda span: span["start"], reverse=True):
+            pending.append((child, depth + 1))
+    return ordered
+
+# Función para imprimir la cascada de una traza. Los inicios usan el reloj de cada sucursal, así que
+# el desfase entre relojes se refleja en la posición de los spans remotos
+def print_waterfall(spans, width=60):
+    trace_start = min(span["start"] for span in spans)
+    trace_end = max(span["start"] + span["duration"] for span in spans)
+    scale = width / max(trace_end - trace_start, 1e-9)
+
+    print(f"\n=== Traza {spans[0]['trace_id']} - {(trace_end - trace_start) * 1000:.1f} ms ===")
+    print(f"{'inicio ms':>10} {'duración ms':>12} {'nodo':>5}  {'span':<48}")
+    for span, depth in order_spans(spans):
+        offset = span["start"] - trace_start
+        bar_start = int(offset * scale)
+        bar_length = max(1, int(span["duration"] * scale))
+        bar = " " * bar_start + "█" * bar_length
+        name = ("  " * depth + span["name"])[:48]
+        print(f"{offset * 1000:>10.1f} {span['duration'] * 1000:>12.1f} {str(span['node']):>5}  {name:<48} |{bar:<{width}}|")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combina las trazas de todas las sucursales en una cascada por operación")
+    parser.add_argument("logs", nargs="*", help="Logs JSONL de trazas (--trace-log de cada nodo)")
+    parser.add_argument("--nodes", nargs="*", default=[], help="IPs (o ip:puerto) de nodos en ejecución a los que pedir su buffer de trazas")
+    parser.add_argument("--trace-id", default=None, help="Traza a mostrar (por defecto la operación raíz más reciente)")
+    args = parser.parse_args()
+
+    spans = read_trace_logs(args.logs)
+    for ip in args.nodes:
+        spans.extend(fetch_node_traces(ip, args.trace_id))
+
+    trace_id = args.trace_id
+    if trace_id is None:
+        roots = [span for span in spans if span["parent_id"] is None]
+        if not roots:
+            raise SystemExit(">> No se encontraron trazas.")
+        trace_id = max(roots, key=lambda span: span["start"])["trace_id"]
+
+    trace_spans = {span["span_id"]: span for span in spans if span["trace_id"] == trace_id}
+    if not trace_spans:
+        raise SystemExit(f">> No se encontró la traza {trace_id}.")
+    print_waterfall(list(trace_spans.values()))